@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Benchmark for HiCAssembler.merge_bins on a synthetic matrix.
+
+The synthetic matrix contains `--num_bins` bins of 1kb distributed over scaffolds of
+random length with contacts on the first diagonals. The vectorized
+merge_bins is compared against the previous implementation that
+grouped the bins using a python loop.
+
+Usage:
+    python benchmarks/bench_merge_bins.py --num_bins 2000000 --merge 25
+"""
+from __future__ import print_function
+import argparse
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix
+
+import hicexplorer.HiCMatrix as HiCMatrix
+import hicexplorer.hicMergeMatrixBins
+from hicexplorer.reduceMatrix import reduce_matrix
+from hicassembler.HiCAssembler import HiCAssembler
+
+
+def make_synthetic_hic(num_bins, bin_size=1000, num_diagonals=5, seed=0):
+    rs = np.random.RandomState(seed)
+    # scaffold lengths (in bins) following a long tailed distribution
+    lengths = []
+    while sum(lengths) < num_bins:
+        lengths.append(int(rs.lognormal(4, 1.5)) + 1)
+    lengths[-1] -= sum(lengths) - num_bins
+    lengths = [x for x in lengths if x > 0]
+
+    cut_intervals = []
+    for idx, length in enumerate(lengths):
+        name = "scaffold_{}".format(idx)
+        for pos in range(length):
+            cut_intervals.append((name, pos * bin_size, (pos + 1) * bin_size, 1.0))
+
+    rows = []
+    cols = []
+    for diag in range(num_diagonals):
+        row = np.arange(num_bins - diag)
+        rows.append(row)
+        cols.append(row + diag)
+    row = np.concatenate(rows)
+    col = np.concatenate(cols)
+    data = rs.poisson(10, len(row)).astype(np.int32) + 1
+    matrix = coo_matrix((data, (row, col)), shape=(num_bins, num_bins)).tocsr()
+    matrix = matrix + matrix.T - coo_matrix((matrix.diagonal(), (np.arange(num_bins), np.arange(num_bins))),
+                                            shape=(num_bins, num_bins))
+
+    hic = HiCMatrix.hiCMatrix()
+    hic.nan_bins = []
+    hic.setMatrix(matrix.tocsr(), cut_intervals)
+    return hic, len(lengths)
+
+
+def loop_merge_bins(hic, num_bins, skip_small=True):
+    """
+    Previous implementation of HiCAssembler.merge_bins (python loop)
+    """
+    hic = hicexplorer.hicMergeMatrixBins.remove_nans_if_needed(hic)
+    ref_name_list, start_list, end_list, coverage_list = zip(*hic.cut_intervals)
+    new_bins = []
+    bins_to_merge = []
+    prev_ref = ref_name_list[0]
+
+    idx_start = 0
+    new_start = start_list[0]
+    count = 0
+    merge_bin_id = 0
+    mapping_old_to_merged_bin_ids = {}
+    for idx, ref in enumerate(ref_name_list):
+        if (count > 0 and count % num_bins == 0) or ref != prev_ref:
+            if skip_small is True and count < num_bins / 2:
+                pass
+            else:
+                coverage = np.mean(coverage_list[idx_start:idx])
+                new_bins.append((ref_name_list[idx_start], new_start, end_list[idx - 1], coverage))
+                bins_to_merge.append(list(range(idx_start, idx)))
+                for old_bin_id in list(range(idx_start, idx)):
+                    mapping_old_to_merged_bin_ids[old_bin_id] = merge_bin_id
+                merge_bin_id += 1
+            idx_start = idx
+            new_start = start_list[idx]
+            count = 0
+
+        prev_ref = ref
+        count += 1
+
+    if not (skip_small is True and count < num_bins / 2):
+        coverage = np.mean(coverage_list[idx_start:])
+        new_bins.append((ref, new_start, end_list[idx], coverage))
+        bins_to_merge.append(list(range(idx_start, idx + 1)))
+        for old_bin_id in list(range(idx_start, idx + 1)):
+            mapping_old_to_merged_bin_ids[old_bin_id] = merge_bin_id
+        merge_bin_id += 1
+
+    hic.matrix = reduce_matrix(hic.matrix, bins_to_merge, diagonal=True)
+    hic.matrix.eliminate_zeros()
+    hic.setCutIntervals(new_bins)
+    return hic, mapping_old_to_merged_bin_ids
+
+
+def loop_grouping(ref_name_list, num_bins, skip_small=True):
+    """
+    Grouping step of the previous implementation
+    """
+    bins_to_merge = []
+    mapping_old_to_merged_bin_ids = {}
+    prev_ref = ref_name_list[0]
+    idx_start = 0
+    count = 0
+    for idx, ref in enumerate(ref_name_list):
+        if (count > 0 and count % num_bins == 0) or ref != prev_ref:
+            if not (skip_small is True and count < num_bins / 2):
+                bins_to_merge.append(list(range(idx_start, idx)))
+                for old_bin_id in list(range(idx_start, idx)):
+                    mapping_old_to_merged_bin_ids[old_bin_id] = len(bins_to_merge) - 1
+            idx_start = idx
+            count = 0
+        prev_ref = ref
+        count += 1
+    if not (skip_small is True and count < num_bins / 2):
+        bins_to_merge.append(list(range(idx_start, len(ref_name_list))))
+        for old_bin_id in list(range(idx_start, len(ref_name_list))):
+            mapping_old_to_merged_bin_ids[old_bin_id] = len(bins_to_merge) - 1
+    return bins_to_merge, mapping_old_to_merged_bin_ids
+
+
+def vectorized_grouping(ref_name_list, num_bins, skip_small=True):
+    group_start, group_end, keep = HiCAssembler.get_bins_to_merge(ref_name_list, num_bins, skip_small=skip_small)
+    return np.repeat(np.where(keep, np.cumsum(keep) - 1, -1), group_end - group_start)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num_bins', type=int, default=2000000)
+    parser.add_argument('--merge', type=int, default=25, help='number of bins to merge')
+    parser.add_argument('--skip_loop', action='store_true',
+                        help='Do not run the previous (python loop) implementation')
+    args = parser.parse_args(args)
+
+    hic, num_scaffolds = make_synthetic_hic(args.num_bins)
+    print("synthetic matrix: {:,} bins, {:,} scaffolds, {:,} non zero values".format(
+        args.num_bins, num_scaffolds, hic.matrix.nnz))
+
+    ref_name_list = [x[0] for x in hic.cut_intervals]
+    start = time.time()
+    vectorized_grouping(ref_name_list, args.merge)
+    print("grouping (vectorized): {:.2f}s".format(time.time() - start))
+    if not args.skip_loop:
+        start = time.time()
+        loop_grouping(ref_name_list, args.merge)
+        print("grouping (loop):       {:.2f}s".format(time.time() - start))
+
+    # merge_bins prints a message for each skipped group
+    stderr = sys.stderr
+    sys.stderr = open('/dev/null', 'w')
+    try:
+        start = time.time()
+        new_hic, new_map = HiCAssembler.merge_bins(hic, args.merge, return_bin_id_mapping=True)
+        vectorized_time = time.time() - start
+    finally:
+        sys.stderr = stderr
+    print("vectorized merge_bins: {:.2f}s ({:,} merged bins)".format(vectorized_time, new_hic.matrix.shape[0]))
+
+    if not args.skip_loop:
+        hic, _ = make_synthetic_hic(args.num_bins)
+        start = time.time()
+        old_hic, old_map = loop_merge_bins(hic, args.merge)
+        loop_time = time.time() - start
+        print("loop merge_bins:       {:.2f}s".format(loop_time))
+        print("speed up: {:.1f}x".format(loop_time / vectorized_time))
+
+        assert old_hic.cut_intervals == new_hic.cut_intervals
+        assert (old_hic.matrix != new_hic.matrix).nnz == 0
+        old_map_array = np.full(args.num_bins, -1, dtype=int)
+        old_map_array[list(old_map.keys())] = list(old_map.values())
+        assert np.array_equal(old_map_array, new_map)
+        print("results are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Benchmark for Scaffolds.normalize_by_mean on a synthetic reduced matrix.
+
+The synthetic matrix contains `--num_bins` merged bins, each formed by a random number
+of original bins, with contacts on the first `--num_diagonals` diagonals. The vectorized
+normalize_by_mean is compared against the previous implementation that
+looped over the non zero values of the matrix.
+
+Usage:
+    python benchmarks/bench_normalize_by_mean.py --num_bins 200000 --num_diagonals 50
+"""
+from __future__ import print_function
+import argparse
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix
+
+from hicassembler.Scaffolds import Scaffolds
+
+
+def make_synthetic_matrix(num_bins, num_diagonals, seed=0):
+    rs = np.random.RandomState(seed)
+    rows = []
+    cols = []
+    for diag in range(num_diagonals):
+        row = np.arange(num_bins - diag)
+        rows.append(row)
+        cols.append(row + diag)
+    row = np.concatenate(rows)
+    col = np.concatenate(cols)
+    data = rs.poisson(10, len(row)).astype(float) + 1
+    matrix = coo_matrix((data, (row, col)), shape=(num_bins, num_bins)).tocsr()
+    matrix = matrix + matrix.T - coo_matrix((matrix.diagonal(), (np.arange(num_bins), np.arange(num_bins))),
+                                            shape=(num_bins, num_bins))
+
+    # each merged bin is formed by 1 to 10 bins
+    paths = []
+    start = 0
+    for length in rs.randint(1, 11, num_bins):
+        paths.append(range(start, start + length))
+        start += length
+    return matrix.tocsr(), paths
+
+
+def loop_normalize_by_mean(matrix, paths):
+    """
+    Previous implementation of Scaffolds.normalize_by_mean (python loop)
+    """
+    matrix = matrix.tocoo()
+    paths_len = [len(x) for x in paths]
+    # compute mean values for reduce matrix
+    new_data = np.zeros(len(matrix.data))
+    for index, value in enumerate(matrix.data):
+        row_len = paths_len[matrix.row[index]]
+        col_len = paths_len[matrix.col[index]]
+        new_data[index] = float(value) / (row_len * col_len)
+
+    matrix.data = new_data
+    return matrix.tocsr()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num_bins', type=int, default=200000)
+    parser.add_argument('--num_diagonals', type=int, default=50)
+    parser.add_argument('--skip_loop', action='store_true',
+                        help='Do not run the previous (python loop) implementation')
+    args = parser.parse_args(args)
+
+    matrix, paths = make_synthetic_matrix(args.num_bins, args.num_diagonals)
+    print("synthetic matrix: {:,} bins, {:,} non zero values".format(args.num_bins, matrix.nnz))
+
+    start = time.time()
+    new_matrix = Scaffolds.normalize_by_mean(matrix, paths)
+    vectorized_time = time.time() - start
+    print("vectorized normalize_by_mean: {:.2f}s".format(vectorized_time))
+
+    if not args.skip_loop:
+        start = time.time()
+        old_matrix = loop_normalize_by_mean(matrix, paths)
+        loop_time = time.time() - start
+        print("loop normalize_by_mean:       {:.2f}s".format(loop_time))
+        print("speed up: {:.1f}x".format(loop_time / vectorized_time))
+
+        assert abs(old_matrix - new_matrix).max() == 0
+        print("results are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,495 @@
+import itertools
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import logging
+log = logging.getLogger("BandwidthScore")
+
+# up to this number of paths with more than one bin, all the orientations
+# of the paths are evaluated instead of using BandwidthScore.best_orientation
+MAX_PATHS_EXHAUSTIVE_ORIENTATION = 3
+
+# up to this number of paths, all the orders and orientations of the paths are evaluated
+# instead of using BandwidthScore.best_arrangement
+MAX_PATHS_EXHAUSTIVE_ORDER = 4
+
+# default number of (partial) arrangements scored by BandwidthScore.best_arrangement
+MAX_SEARCH_EVALUATIONS = 100000
+
+# up to this number of bins, BandwidthScore.evaluate_batch uses a dense array of the contacts
+MAX_BINS_DENSE = 200
+# maximum number of values gathered at once by BandwidthScore.evaluate_batch
+DENSE_BATCH_VALUES = 2 ** 22
+
+
+class BandwidthScore(object):
+    """
+    Bandwidth (see Scaffolds.bw) of the arrangements of a set of paths. An arrangement is
+    an order of the paths plus the orientation of each path (reverse[p] is True if the path p is flipped).
+
+    The bandwidth is \sum_{pos(a) < pos(b)} M(a,b) * (pos(b) - pos(a)). Instead of slicing the matrix for
+    each arrangement, the contacts between each pair of paths are summed once as blocks: for path p
+    placed before path q (at offsets o_p and o_q), the contacts M(a,b), a in p, b in q, contribute
+
+        S[p,q] * (o_q - o_p) + C[p,q] - R[p,q]
+
+    where S[p,q] is the sum of the contacts and R[p,q], C[p,q] their first moments, i.e. the contacts
+    weighted by the position of a within p and of b within q. Flipping a path of length L changes
+    its first moments to S * (L - 1) - R. The contacts within a path only depend on the orientation of the path.
+
+    Thus, an arrangement is scored in O(k^2) for k paths, and flipping or swapping two
+    consecutive paths updates the score in O(k).
+
+    Examples
+    --------
+    >>> A = csr_matrix(np.array([[0, 5, 3, 1],
+    ...                          [5, 0, 4, 2],
+    ...                          [3, 4, 0, 6],
+    ...                          [1, 2, 6, 0]]))
+    >>> score = BandwidthScore(A, [[0, 1], [2], [3]])
+    >>> score.evaluate([0, 1, 2], [False, False, False])
+    28.0
+    >>> score.flip(0)
+    30.0
+    >>> score.swap(1)
+    34.0
+    >>> score.get_paths()
+    [[1, 0], [3], [2]]
+    >>> from hicassembler.Scaffolds import Scaffolds
+    >>> Scaffolds.bw(A[[1, 0, 3, 2], :][:, [1, 0, 3, 2]])
+    34.0
+    """
+
+    def __init__(self, matrix, paths):
+        """
+        Parameters
+        ----------
+        matrix : sparse matrix (usually symmetric). The diagonal is not used.
+        paths : list of paths (lists of bins)
+        """
+        self.paths = paths
+        self.num_paths = len(paths)
+        self.length = np.array([len(x) for x in paths], dtype=np.int64)
+        indices = np.concatenate([np.asarray(x, dtype=np.int64) for x in paths])
+        path_id = np.repeat(np.arange(self.num_paths), self.length)
+        rank = np.concatenate([np.arange(x) for x in self.length]).astype(np.float64)
+
+        row, col, data = BandwidthScore.get_submatrix(matrix, indices)
+        keep = row != col
+        row, col = row[keep], col[keep]
+        data = data[keep].astype(np.float64)
+        self.num_bins = len(indices)
+        self._contacts = (row, col, data)
+        self._dense = None
+        row_path, col_path = path_id[row], path_id[col]
+        k = self.num_paths
+
+        # contacts within each path. For the forward orientation, only the values with
+        # rank(b) > rank(a) are counted, for the reverse orientation, the values with rank(b) < rank(a).
+        within = row_path == col_path
+        distance = rank[col[within]] - rank[row[within]]
+        self.within = np.zeros((k, 2))
+        self.within[:, 0] = np.bincount(row_path[within], weights=np.where(distance > 0, data[within] * distance, 0),
+                                        minlength=k)
+        self.within[:, 1] = np.bincount(row_path[within], weights=np.where(distance < 0, -data[within] * distance, 0),
+                                        minlength=k)
+
+        # contact blocks between paths and their first moments
+        between = ~within
+        pair = row_path[between] * k + col_path[between]
+        self.sum = np.bincount(pair, weights=data[between], minlength=k * k).reshape(k, k)
+        self.row_moment = np.bincount(pair, weights=data[between] * rank[row[between]],
+                                      minlength=k * k).reshape(k, k)
+        self.col_moment = np.bincount(pair, weights=data[between] * rank[col[between]],
+                                      minlength=k * k).reshape(k, k)
+
+        # change of the first moments when a path is flipped
+        self._row_flip = self.sum * (self.length[:, None] - 1) - 2 * self.row_moment
+        self._col_flip = self.sum * (self.length[None, :] - 1) - 2 * self.col_moment
+
+        self.order = None
+        self.reverse = None
+        self.position = None
+        self.offset = None
+        self.value = None
+
+        # the lower bounds used by best_arrangement are only valid for non negative contacts
+        self._non_negative = len(data) == 0 or data.min() >= 0
+
+    @staticmethod
+    def get_submatrix(matrix, indices):
+        """
+        Returns the rows, cols and values of the submatrix matrix[indices, :][:, indices] as coo arrays.
+        The values are taken directly from the csr arrays, which for a few bins of a large
+        matrix is faster than slicing the matrix.
+
+        >>> A = csr_matrix(np.array([[1, 2, 0], [2, 0, 3], [0, 3, 4]]))
+        >>> row, col, data = BandwidthScore.get_submatrix(A, np.array([2, 0]))
+        >>> csr_matrix((data, (row, col)), shape=(2, 2)).todense()
+        matrix([[4, 0],
+                [0, 1]])
+        """
+        if not isinstance(matrix, csr_matrix):
+            matrix = csr_matrix(matrix)
+        starts = matrix.indptr[indices]
+        counts = matrix.indptr[indices + 1] - starts
+        # position in matrix.indices and matrix.data of the values of the selected rows
+        position = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        row = np.repeat(np.arange(len(indices)), counts)
+        col = matrix.indices[position]
+
+        # map the cols to their index in `indices` and keep the ones that are selected
+        order = np.argsort(indices, kind='mergesort')
+        sorted_indices = indices[order]
+        col_position = np.minimum(np.searchsorted(sorted_indices, col), len(indices) - 1)
+        keep = sorted_indices[col_position] == col
+        return row[keep], order[col_position[keep]], matrix.data[position[keep]]
+
+    def _set(self, order, reverse):
+        """
+        Sets the current arrangement and computes its score from the blocks.
+        """
+        self.order = list(order)
+        self.reverse = np.array(reverse, dtype=bool)
+        self.position = np.empty(self.num_paths, dtype=np.int64)
+        self.position[self.order] = np.arange(self.num_paths)
+        self.offset = np.empty(self.num_paths, dtype=np.int64)
+        self.offset[self.order] = np.cumsum(self.length[self.order]) - self.length[self.order]
+
+        rev = self.reverse
+        row_moment = np.where(rev[:, None], self.sum * (self.length[:, None] - 1) - self.row_moment, self.row_moment)
+        col_moment = np.where(rev[None, :], self.sum * (self.length[None, :] - 1) - self.col_moment, self.col_moment)
+        before = self.position[:, None] < self.position[None, :]
+        block = self.sum * (self.offset[None, :] - self.offset[:, None]) + col_moment - row_moment
+        self.value = self.within[np.arange(self.num_paths), rev.astype(int)].sum() + block[before].sum()
+        return self.value
+
+    def flip(self, path):
+        """
+        Flips the path (index of the path in `paths`) of the current arrangement
+        and returns the new score.
+        """
+        sign = -1 if self.reverse[path] else 1
+        after = self.position > self.position[path]
+        before = self.position < self.position[path]
+        delta = self.within[path, int(not self.reverse[path])] - self.within[path, int(self.reverse[path])]
+        delta += sign * (self._col_flip[before, path].sum() - self._row_flip[path, after].sum())
+        self.reverse[path] = not self.reverse[path]
+        self.value += delta
+        return self.value
+
+    def swap(self, position):
+        """
+        Swaps the paths at `position` and `position` + 1 of the current arrangement
+        and returns the new score.
+        """
+        p, q = self.order[position], self.order[position + 1]
+        before = self.position < position
+        after = self.position > position + 1
+        len_p, len_q = self.length[p], self.length[q]
+
+        # the paths before p and q (and after p and q) are now further from p and closer to q
+        delta = len_q * (self.sum[before, p].sum() - self.sum[p, after].sum()) - \
+            len_p * (self.sum[before, q].sum() - self.sum[q, after].sum())
+        delta += self._pair_value(q, p, len_q) - self._pair_value(p, q, len_p)
+
+        self.order[position], self.order[position + 1] = q, p
+        self.position[p], self.position[q] = position + 1, position
+        self.offset[q], self.offset[p] = self.offset[p], self.offset[p] + len_q
+        self.value += delta
+        return self.value
+
+    def _pair_value(self, p, q, distance):
+        """
+        Contribution of the contacts from path p to path q when q is `distance` bins after p.
+        """
+        row_moment = self.row_moment[p, q]
+        if self.reverse[p]:
+            row_moment = self.sum[p, q] * (self.length[p] - 1) - row_moment
+        col_moment = self.col_moment[p, q]
+        if self.reverse[q]:
+            col_moment = self.sum[p, q] * (self.length[q] - 1) - col_moment
+        return self.sum[p, q] * distance + col_moment - row_moment
+
+    def evaluate(self, order, reverse):
+        """
+        Returns the score of the arrangement. If the order is the same as the
+        current order, the score is updated by flipping the paths whose orientation changed.
+
+        Parameters
+        ----------
+        order : list of path indices
+        reverse : list of booleans, one per path (indexed by path and not by position)
+        """
+        if self.order is None or list(order) != self.order:
+            return self._set(order, reverse)
+        for path in np.flatnonzero(self.reverse != np.asarray(reverse, dtype=bool)):
+            self.flip(path)
+        return self.value
+
+    def evaluate_batch(self, arrangements):
+        """
+        Returns the scores of a list of (order, reverse) arrangements.
+
+        For up to MAX_BINS_DENSE bins, the contacts are kept as a dense array and
+        each arrangement is expressed as the index array of its bins. The scores of a batch of
+        arrangements are then computed at once, by gathering the contacts of each arrangement and
+        summing them weighted by the distance between the bins (j - i for j > i).
+        For more bins, each arrangement is scored using the contact blocks (see evaluate).
+
+        >>> A = csr_matrix(np.array([[0, 5, 3, 1],
+        ...                          [5, 0, 4, 2],
+        ...                          [3, 4, 0, 6],
+        ...                          [1, 2, 6, 0]]))
+        >>> score = BandwidthScore(A, [[0, 1], [2], [3]])
+        >>> score.evaluate_batch([([0, 1, 2], [False, False, False]), ([0, 2, 1], [True, False, False])])
+        array([28., 34.])
+        """
+        if self.num_bins > MAX_BINS_DENSE:
+            return np.array([self.evaluate(order, reverse) for order, reverse in arrangements], dtype=np.float64)
+
+        if self._dense is None:
+            row, col, data = self._contacts
+            self._dense = np.zeros((self.num_bins, self.num_bins))
+            np.add.at(self._dense, (row, col), data)
+            distance = np.arange(self.num_bins)[None, :] - np.arange(self.num_bins)[:, None]
+            self._distance = np.maximum(distance, 0).astype(np.float64)
+            start = np.cumsum(self.length) - self.length
+            self._path_bins = [np.arange(x, x + y) for x, y in zip(start, self.length)]
+
+        index = np.array([np.concatenate([self._path_bins[x][::-1] if reverse[x] else self._path_bins[x]
+                                          for x in order]) for order, reverse in arrangements], dtype=np.int64)
+        scores = np.zeros(len(index))
+        batch_size = max(1, DENSE_BATCH_VALUES // (self.num_bins ** 2))
+        for start in range(0, len(index), batch_size):
+            batch = index[start:start + batch_size]
+            contacts = self._dense[batch[:, :, None], batch[:, None, :]]
+            scores[start:start + batch_size] = (contacts * self._distance).sum(axis=(1, 2))
+        return scores
+
+    def best_orientation(self, order):
+        """
+        Returns the orientation of the paths that minimizes the score for the given order.
+
+        For a fixed order, the offsets of the paths do not change and each first moment only
+        depends on the orientation of one path. Thus, the score is a sum of one term per path
+        that only depends on the orientation of that path, and each path is oriented
+        independently by comparing both orientations (see `flip`). This is exact and
+        replaces the evaluation of the 2^k orientations of k paths.
+        If both orientations have the same score, the path is not flipped.
+
+        Parameters
+        ----------
+        order : list of path indices
+
+        Returns
+        -------
+        list of booleans, True if the path should be flipped (indexed by path)
+
+        >>> A = csr_matrix(np.array([[0, 1, 0, 0, 0],
+        ...                          [1, 0, 6, 0, 0],
+        ...                          [0, 6, 0, 1, 3],
+        ...                          [0, 0, 1, 0, 0],
+        ...                          [0, 0, 3, 0, 0]]))
+        >>> score = BandwidthScore(A, [[1, 0], [3, 2], [4]])
+        >>> score.best_orientation([0, 1, 2])
+        [True, True, False]
+        >>> min([(score.evaluate([0, 1, 2], reverse), reverse) for order, reverse
+        ...      in score.get_arrangement_flips([0, 1, 2])])
+        (14.0, [True, True, False])
+        """
+        position = np.empty(self.num_paths, dtype=np.int64)
+        position[list(order)] = np.arange(self.num_paths)
+        before = position[:, None] < position[None, :]
+        # change of the score when each path is flipped (with respect to the forward orientation)
+        flip_delta = self.within[:, 1] - self.within[:, 0] + \
+            (self._col_flip * before).sum(axis=0) - (self._row_flip * before).sum(axis=1)
+        return (flip_delta < 0).tolist()
+
+    def best_arrangement(self, max_evaluations=MAX_SEARCH_EVALUATIONS):
+        """
+        Searches the order and orientation of the paths with the minimum score using
+        branch and bound. The paths are placed one after the other and a partial arrangement
+        is discarded if a lower bound of its score is not better than the best arrangement found.
+
+        The lower bound adds to the score of the placed paths: the contacts of the remaining paths with the
+        placed paths as if the remaining paths were placed right after them in their best orientation,
+        and, for each pair of remaining paths, the contacts between them as if they
+        were next to each other in their best order and orientation.
+
+        As in Scaffolds.find_best_permutation, an order and its opposite order are not both
+        evaluated: the first path should have a lower index than the last path.
+
+        Parameters
+        ----------
+        max_evaluations : maximum number of (partial) arrangements that are scored. If reached, the best
+                          arrangement found so far is returned.
+
+        Returns
+        -------
+        order, reverse, is_optimal : is_optimal is True if the search was complete, thus, the arrangement
+                                     has the minimum score.
+
+        >>> A = csr_matrix(np.array([[0, 1, 0, 9, 0, 0],
+        ...                          [1, 0, 0, 0, 0, 3],
+        ...                          [0, 0, 0, 5, 0, 0],
+        ...                          [9, 0, 5, 0, 0, 0],
+        ...                          [0, 0, 0, 0, 0, 2],
+        ...                          [0, 3, 0, 0, 2, 0]]))
+        >>> score = BandwidthScore(A, [[0, 1], [2], [3], [4, 5]])
+        >>> score.best_arrangement()
+        ([1, 2, 0, 3], [False, False, False, True], True)
+        >>> score.value
+        20.0
+        >>> min([score.evaluate(order, reverse) for order in itertools.permutations(range(4))
+        ...      for order, reverse in score.get_arrangement_flips(order)])
+        20.0
+        """
+        k = self.num_paths
+        length = self.length
+        if k < 2:
+            reverse = self.best_orientation(range(k))
+            self.evaluate(range(k), reverse)
+            return range(k), reverse, True
+
+        # moments for each orientation of the paths
+        row_moment = [self.row_moment, self.sum * (length[:, None] - 1) - self.row_moment]
+        col_moment = [self.col_moment, self.sum * (length[None, :] - 1) - self.col_moment]
+        orientations = [[False] if length[x] == 1 else [False, True] for x in range(k)]
+
+        # lower bound of the contribution of each pair of paths
+        pair_bound = self.sum * length[:, None] + np.minimum(*col_moment) - np.maximum(*row_moment)
+        pair_bound = np.minimum(pair_bound, pair_bound.T)
+        np.fill_diagonal(pair_bound, 0)
+
+        # the initial best arrangement keeps the order of the paths
+        order = range(k)
+        reverse = self.best_orientation(order)
+        best = {'value': self.evaluate(order, reverse), 'order': order, 'reverse': reverse}
+        num_evaluations = [0]
+        stopped = [False]
+        can_flip = length > 1
+
+        def search(placed, reverse, unplaced, end, value, placed_sum, placed_offset, placed_row, placed_col,
+                   unplaced_pairs):
+            """
+            Recursively places the unplaced paths after the placed paths (ending at offset `end`).
+            placed_sum, placed_offset, placed_row and placed_col contain for each path q the sum
+            over the placed paths p of S[p,q], S[p,q] * o_p, R[p,q] and C[p,q] (one for each orientation of q).
+            The score and the lower bound of all children are computed at once.
+            """
+            idx = np.array(unplaced)
+            ix = np.ix_(idx, idx)
+            block = self.sum[ix]
+            # contribution of the contacts with the placed paths of each path placed next
+            cost = [self.within[idx, x] + placed_sum[idx] * end - placed_offset[idx] + placed_col[x][idx] -
+                    placed_row[idx] for x in (0, 1)]
+
+            # lower bound for the paths that remain unplaced after placing q (rows) for each path u (cols)
+            remaining = (placed_sum[idx][None, :] + block) * (end + length[idx])[:, None] - \
+                placed_offset[idx][None, :] - block * end - placed_row[idx][None, :] + \
+                np.minimum((self.within[idx, 0] + placed_col[0][idx])[None, :] + col_moment[0][ix],
+                           (self.within[idx, 1] + placed_col[1][idx])[None, :] + col_moment[1][ix]) - \
+                pair_bound[ix]
+            np.fill_diagonal(remaining, 0)
+
+            first = placed[0] if len(placed) else None
+            children = []
+            for pos, path in enumerate(unplaced):
+                rest = unplaced[:pos] + unplaced[pos + 1:]
+                # the last path should have a higher index than the first
+                if len(rest) == 0 and path < first:
+                    continue
+                if len(rest) and max(rest) < (path if first is None else first):
+                    continue
+                for is_reverse in (False, True) if can_flip[path] else (False,):
+                    row = row_moment[int(is_reverse)][path, idx]
+                    child_value = value + cost[int(is_reverse)][pos]
+                    if len(unplaced) == 1:
+                        bound = child_value
+                    elif self._non_negative:
+                        bound = child_value + remaining[pos].sum() - row.sum() + row[pos] + unplaced_pairs
+                    else:
+                        bound = -np.inf
+                    children.append((bound, child_value, pos, path, is_reverse))
+            num_evaluations[0] += len(children)
+
+            for bound, child_value, pos, path, is_reverse in sorted(children, key=lambda x: x[0]):
+                if bound >= best['value']:
+                    break
+                rest = unplaced[:pos] + unplaced[pos + 1:]
+                child_reverse = reverse[:]
+                child_reverse[path] = is_reverse
+                if len(rest) == 0:
+                    best.update(value=child_value, order=placed + [path], reverse=child_reverse)
+                    continue
+                if num_evaluations[0] >= max_evaluations:
+                    stopped[0] = True
+                    return
+                search(placed + [path], child_reverse, rest, end + length[path], child_value,
+                       placed_sum + self.sum[path], placed_offset + self.sum[path] * end,
+                       placed_row + row_moment[int(is_reverse)][path],
+                       [placed_col[0] + col_moment[0][path], placed_col[1] + col_moment[1][path]],
+                       unplaced_pairs - pair_bound[path, rest].sum())
+
+        zeros = np.zeros(k)
+        search([], [False] * k, range(k), 0, 0.0, zeros, zeros, zeros, [zeros, zeros], pair_bound.sum() / 2)
+
+        is_optimal = not stopped[0]
+        log.debug("best arrangement after {} evaluations (optimal: {})".format(num_evaluations[0], is_optimal))
+        self.evaluate(best['order'], best['reverse'])
+        return best['order'], best['reverse'], is_optimal
+
+    def get_arrangement_flips(self, order):
+        """
+        Returns all the orientations of the paths for the given order as (order, reverse) tuples.
+        Only the paths with more than one bin are flipped. The orientations are in
+        the same order as Scaffolds.permute_paths.
+
+        >>> score = BandwidthScore(csr_matrix((5, 5)), [[0, 1], [2], [3, 4]])
+        >>> [reverse for order, reverse in score.get_arrangement_flips([2, 1, 0])]
+        [[False, False, False], [True, False, False], [False, False, True], [True, False, True]]
+        """
+        to_flip = [x for x in order if self.length[x] > 1]
+        arrangements = []
+        for prod in itertools.product(*[(False, True)] * len(to_flip)):
+            reverse = [False] * self.num_paths
+            for path, is_reverse in zip(to_flip, prod):
+                reverse[path] = is_reverse
+            arrangements.append((list(order), reverse))
+        return arrangements
+
+    def get_arrangement(self, paths):
+        """
+        Returns the order and orientation of an arrangement given as a list of (possibly flipped)
+        paths.
+
+        >>> score = BandwidthScore(csr_matrix((5, 5)), [[0, 1], [2], [3, 4]])
+        >>> score.get_arrangement([[4, 3], [0, 1], [2]])
+        ([2, 0, 1], [False, False, True])
+        """
+        if not hasattr(self, '_start'):
+            self._start = {}
+            for idx, path in enumerate(self.paths):
+                self._start[path[0]] = (idx, False)
+                if len(path) > 1:
+                    self._start[path[-1]] = (idx, True)
+        order = []
+        reverse = [False] * self.num_paths
+        for path in paths:
+            idx, is_reverse = self._start[path[0]]
+            expected = self.paths[idx][::-1] if is_reverse else self.paths[idx]
+            if list(path) != list(expected):
+                raise ValueError("{} is not one of the paths (or its flip)".format(path))
+            order.append(idx)
+            reverse[idx] = is_reverse
+        return order, reverse
+
+    def get_paths(self, order=None, reverse=None):
+        """
+        Returns the arrangement (by default the current one) as a list of paths
+        """
+        if order is None:
+            order, reverse = self.order, self.reverse
+        return [self.paths[x][::-1] if reverse[x] else self.paths[x] for x in order]
+
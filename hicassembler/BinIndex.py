@@ -0,0 +1,99 @@
+import numpy as np
+from hicassembler.IntervalTable import IntervalTable
+
+import logging
+log = logging.getLogger("BinIndex")
+
+
+class BinIndex(object):
+    """
+    Index to find the bins overlapping genomic positions. It replaces the
+    per scaffold interval trees of HiCMatrix for the case in which the bins of each
+    scaffold are consecutive, sorted and not overlapping, as in the cut intervals of a
+    Hi-C matrix. The bin starts and ends are kept in arrays and the
+    positions are searched in batch using `np.searchsorted`.
+
+    To search all scaffolds at once, the coordinates are shifted by an offset
+    per scaffold such that the positions of all bins are increasing.
+
+    Examples
+    --------
+    >>> index = BinIndex([('a', 0, 10, 1), ('a', 10, 20, 1), ('a', 20, 30, 1), ('b', 0, 10, 1)])
+    >>> 'a' in index, 'c' in index
+    (True, False)
+    >>> index.overlapping('a', 5, 15)
+    array([0, 1])
+    >>> index.overlapping('b', 0, 5)
+    array([3])
+    """
+
+    def __init__(self, cut_intervals):
+        """
+        cut_intervals : list of (name, start, end, coverage) tuples or IntervalTable
+        """
+        table = IntervalTable.from_intervals(cut_intervals)
+        self.starts = table.start
+        self.ends = table.end
+
+        # first and last + 1 bin of each scaffold
+        self.chrom_bin_boundaries = table.chrom_bin_boundaries()
+        self.chrom_code = dict([(name, idx) for idx, name in enumerate(self.chrom_bin_boundaries)])
+        chrom_code = np.repeat(np.arange(len(self.chrom_code), dtype=np.int64),
+                               [end - start for start, end in self.chrom_bin_boundaries.values()])
+
+        self.offset = int(self.ends.max()) + 1 if len(table) else 1
+        self.shifted_starts = chrom_code * self.offset + self.starts
+        self.shifted_ends = chrom_code * self.offset + self.ends
+
+    def __contains__(self, chrom):
+        return chrom in self.chrom_code
+
+    def _shift(self, chroms, positions):
+        codes = np.array([self.chrom_code[x] for x in chroms], dtype=np.int64)
+        # positions outside of the scaffold are clipped such that they
+        # do not reach the bins of other scaffolds
+        return codes * self.offset + np.clip(np.asarray(positions, dtype=np.int64), 0, self.offset - 1)
+
+    def find_overlaps(self, chroms, starts, ends):
+        """
+        Finds, for several regions at once, the bins that overlap with each region.
+        All chroms should be part of the index.
+
+        Parameters
+        ----------
+        chroms, starts, ends : lists with the scaffold name, start and end of the regions
+
+        Returns
+        -------
+        first, last : arrays with the first and the last bin overlapping each region. If
+                      no bin overlaps the region, first > last.
+
+        Examples
+        --------
+        >>> index = BinIndex([('a', 0, 10, 1), ('a', 10, 20, 1), ('a', 20, 30, 1), ('b', 0, 10, 1)])
+        >>> index.find_overlaps(['a', 'a', 'b', 'a'], [5, 12, 5, 40], [15, 13, 50, 50])
+        (array([0, 1, 3, 3]), array([1, 1, 3, 2]))
+        """
+        first = np.searchsorted(self.shifted_ends, self._shift(chroms, starts), side='right')
+        last = np.searchsorted(self.shifted_starts, self._shift(chroms, ends), side='left') - 1
+        return first, last
+
+    def find_last_bin_before(self, chroms, ends):
+        """
+        Returns, for each position, the last bin of the scaffold starting before the position
+        or -1 if there is no such bin.
+
+        >>> index = BinIndex([('a', 0, 10, 1), ('a', 20, 30, 1), ('b', 5, 10, 1)])
+        >>> index.find_last_bin_before(['a', 'a', 'b'], [15, 40, 5])
+        array([ 0,  1, -1])
+        """
+        last = np.searchsorted(self.shifted_starts, self._shift(chroms, ends), side='left') - 1
+        first_bin = np.array([self.chrom_bin_boundaries[x][0] for x in chroms], dtype=np.int64)
+        return np.where(last >= first_bin, last, -1)
+
+    def overlapping(self, chrom, start, end):
+        """
+        Returns the ids of the bins of `chrom` that overlap with the region start, end.
+        """
+        first, last = self.find_overlaps([chrom], [start], [end])
+        return np.arange(first[0], last[0] + 1)
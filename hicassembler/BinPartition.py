@@ -0,0 +1,145 @@
+import numpy as np
+from scipy.sparse import csr_matrix, coo_matrix, triu, dia_matrix
+
+import logging
+log = logging.getLogger("BinPartition")
+
+
+class BinPartition(object):
+    """
+    Partition of the bins of a Hi-C matrix into groups, for example the bins
+    of each path or the consecutive bins that are merged into a lower resolution bin.
+
+    The partition keeps the group id of each bin. Per bin values (e.g. the coverage) are
+    aggregated into per group values with a sparse indicator matrix R of size number of bins x number
+    of groups (R[i, g] = 1 if bin i belongs to group g) that is only built once per partition.
+    Matrices are reduced by summing the values of each pair of groups (see reduce_matrix).
+
+    Examples
+    --------
+    >>> partition = BinPartition.from_paths([[0, 1], [3], [2, 4]], 6)
+    >>> partition.group_id
+    array([ 0,  0,  2,  1,  2, -1])
+    >>> partition.counts
+    array([2, 1, 2])
+    >>> partition.aggregate(np.array([10, 20, 30, 40, 50, 60]))
+    array([30, 40, 80])
+    >>> partition.expand(np.array([1., 2., 3.]))
+    array([1., 1., 3., 2., 3., 0.])
+    """
+
+    def __init__(self, group_id, num_groups=None):
+        """
+        Parameters
+        ----------
+        group_id : array with the group of each bin or -1 if the bin is not part of any group
+        num_groups : number of groups. By default max(group_id) + 1
+        """
+        self.group_id = np.asarray(group_id, dtype=np.int64)
+        self.num_bins = len(self.group_id)
+        if num_groups is None:
+            num_groups = int(self.group_id.max()) + 1 if self.num_bins else 0
+        self.num_groups = num_groups
+        self._operator = {}
+        self._counts = None
+
+    @classmethod
+    def from_paths(cls, paths, num_bins):
+        """
+        Creates the partition in which each path (list of bin ids) is a group.
+        """
+        group_id = np.full(num_bins, -1, dtype=np.int64)
+        if len(paths):
+            group_id[np.concatenate([np.asarray(x, dtype=np.int64) for x in paths])] = \
+                np.repeat(np.arange(len(paths)), [len(x) for x in paths])
+        return cls(group_id, len(paths))
+
+    def operator(self, dtype=np.float64):
+        """
+        Returns the sparse indicator matrix R (bins x groups) of the given dtype.
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in self._operator:
+            bins = np.flatnonzero(self.group_id > -1)
+            self._operator[dtype] = csr_matrix((np.ones(len(bins), dtype=dtype), (bins, self.group_id[bins])),
+                                               shape=(self.num_bins, self.num_groups))
+        return self._operator[dtype]
+
+    @property
+    def counts(self):
+        """ number of bins in each group """
+        if self._counts is None:
+            self._counts = np.bincount(self.group_id[self.group_id > -1], minlength=self.num_groups)
+        return self._counts
+
+    def aggregate(self, values):
+        """
+        Sums the values of the bins of each group.
+        """
+        values = np.asarray(values)
+        result = self.operator(values.dtype).T.dot(values)
+        return np.asarray(result).flatten()
+
+    def mean(self, values):
+        """
+        Mean of the values of the bins of each group.
+        """
+        return self.aggregate(np.asarray(values, dtype=np.float64)) / self.counts
+
+    def expand(self, group_values):
+        """
+        Returns for each bin the value of its group (0 for bins not in any group).
+        """
+        group_values = np.asarray(group_values)
+        return np.asarray(self.operator(group_values.dtype).dot(group_values)).flatten()
+
+    def reduce_matrix(self, matrix):
+        """
+        Reduces the symmetric matrix by summing the values of the bins of each group
+        as in hicexplorer.reduceMatrix.reduce_matrix(matrix, paths, diagonal=True): only the upper
+        triangle of the matrix is used, thus the contacts between the bins of a group are counted
+        once. The values are summed as float64 and returned in the dtype of the matrix, unless
+        the sums of an integer matrix do not fit into its dtype, in which case int64 is used.
+
+        Parameters
+        ----------
+        matrix : sparse symmetric matrix of size number of bins
+
+        Returns
+        -------
+        csr matrix of size number of groups
+
+        Examples
+        --------
+        >>> A = csr_matrix(np.array([[2, 2, 1], [2, 2, 1], [1, 1, 1]]), dtype=np.int32)
+        >>> BinPartition(np.array([0, 0, 1])).reduce_matrix(A).todense()
+        matrix([[6, 2],
+                [2, 1]], dtype=int32)
+        >>> BinPartition(np.array([-1, 0, 0]), 1).reduce_matrix(A).todense()
+        matrix([[4]], dtype=int32)
+        >>> BinPartition(np.array([0, 0, 1])).reduce_matrix(A * (2 ** 29)).dtype
+        dtype('int64')
+        """
+        # R^T triu(A) R is computed by adding each value of the upper triangle to
+        # its (group, group) pair. np.bincount adds the values in the same order as
+        # hicexplorer's reduce_matrix, thus, floating point results are identical.
+        num_groups = self.num_groups
+        ma = triu(matrix, k=0, format='coo')
+        new_row = self.group_id[ma.row]
+        new_col = self.group_id[ma.col]
+        keep = (new_row > -1) & (new_col > -1)
+        uniq, pair_id = np.unique(new_row[keep] * num_groups + new_col[keep], return_inverse=True)
+        sum_array = np.bincount(pair_id, weights=ma.data[keep], minlength=len(uniq))
+
+        dtype = ma.dtype
+        if np.issubdtype(dtype, np.integer) and len(sum_array) and \
+                np.abs(sum_array).max() > np.iinfo(dtype).max:
+            # the sums of the counts do not fit into the integer type of the matrix
+            dtype = np.int64
+        reduced = coo_matrix((sum_array, (uniq // num_groups, uniq % num_groups)),
+                             shape=(num_groups, num_groups), dtype=dtype)
+        # make the result symmetric
+        diagonal = dia_matrix(([reduced.diagonal()], [0]), shape=reduced.shape, dtype=dtype)
+        reduced = (reduced + reduced.T - diagonal).tocsr()
+        reduced.eliminate_zeros()
+        return reduced
@@ -4,12 +4,23 @@ import time
 import os.path
 import copy
 import sys
+import json
+import multiprocessing
 
 import hicexplorer.HiCMatrix as HiCMatrix
 import hicexplorer.hicMergeMatrixBins
 import hicexplorer.hicFindTADs as hicFindTADs
+from hicexplorer.utilities import toString
+from scipy.sparse import csr_matrix, coo_matrix, triu
+import tables
 from functools import wraps
 from hicassembler.Scaffolds import Scaffolds
+from hicassembler.MatrixCache import MatrixCache, MAX_CACHE_ENTRIES
+from hicassembler.BinIndex import BinIndex
+from hicassembler.IntervalTable import IntervalTable
+from hicassembler.BinPartition import BinPartition
+import hicassembler.multiResolution as multiResolution
+import hicassembler.misassemblyScore as misassemblyScore
 
 import logging
 log = logging.getLogger("HiCAssembler")
@@ -21,6 +32,7 @@ MIN_LENGTH = 400000  # minimum contig or PE_scaffold length to consider
 ZSCORE_THRESHOLD = -1  # zscore threshold to declare a boundary a misassembly
 MIN_MAD = -0.5  # minimum zscore row contacts to filter low scoring bins
 MAX_MAD = 50  # maximum zscore row contacts
+ROW_BLOCK_SIZE = 100000  # number of matrix rows read at once when the matrix is reduced while reading
 
 
 def timeit(fn):
@@ -37,13 +49,63 @@ def timeit(fn):
     return with_profiling
 
 
+# Hi-C matrix from which the misassembly scores are computed. To avoid pickling the matrix
+# for each process, the matrix is set as a global variable before the processes are started
+# (same approach as in hicFindTADs).
+misassembly_hic = None
+
+
+def compute_misassembly_scores(scaffolds, min_depth, max_depth, step, num_processors=1):
+    """
+    Computes the TAD-score (misassembly score) for the given scaffolds of the
+    global `misassembly_hic` matrix. Because the scores are computed per scaffold,
+    the scaffolds can be processed independently of each other.
+
+    Parameters
+    ----------
+    scaffolds : list of scaffold names, in matrix order
+    min_depth, max_depth, step : window sizes in bp for the TAD-score
+    num_processors : processors used by hicFindTADs
+
+    Returns
+    -------
+    bedgraph matrix (as computed by hicFindTADs) containing the scores of each bin. The
+    transformed (log obs/exp) matrix is not returned to avoid pickling it back to the parent process.
+    """
+    hic = misassembly_hic
+    if len(scaffolds) == len(hic.chrBinBoundaries):
+        # the matrix already loaded is reused. Only the matrix values are copied
+        # because they are transformed in place to compute the scores.
+        hic_ma = copy.copy(hic)
+        hic_ma.matrix = hic.matrix.copy()
+    else:
+        hic_ma = HiCAssembler.get_scaffolds_submatrix(hic, scaffolds)
+
+    ft = hicFindTADs.HicFindTads(hic_ma, num_processors=num_processors, use_zscore=False)
+    ft.max_depth = max_depth
+    ft.min_depth = min_depth
+    ft.step = step
+
+    ft.hic_ma.matrix.data = np.log1p(ft.hic_ma.matrix.data)
+    ft.hic_ma.matrix = ft.hic_ma.convert_to_obs_exp_matrix(perchr=True)
+    ft.hic_ma.matrix.data = np.log2(ft.hic_ma.matrix.data)
+    ft.compute_spectra_matrix(perchr=True)
+    return ft.bedgraph_matrix
+
+
+def compute_misassembly_scores_wrapper(args):
+    return compute_misassembly_scores(*args)
+
+
 class HiCAssembler:
     def __init__(self, hic_file_name, fasta_file, out_folder,
                  min_mad=MIN_MAD, max_mad=MAX_MAD, split_misassemblies=True,
                  split_positions_file=None,
                  min_scaffold_length=MIN_LENGTH, matrix_bin_size=25000, use_log=False,
                  num_processors=5, misassembly_zscore_threshold=ZSCORE_THRESHOLD,
-                 num_iterations=2, scaffolds_to_ignore=None):
+                 num_iterations=2, scaffolds_to_ignore=None, cache_dir=None,
+                 max_cache_entries=MAX_CACHE_ENTRIES, misassembly_detector='hicFindTADs',
+                 dtype='float64', save_graphml=False):
         """
         Prepares a hic matrix for assembly.
         It is expected that initial contigs or scaffolds contain bins
@@ -54,6 +116,15 @@ class HiCAssembler:
         hic_file_name : hic file name or a HiCMatrix object
         min_mad : minimum MAD score value per bin
         max_mad : maximum MAD score value per bin
+        cache_dir : folder to keep the reduced matrices. By default `out_folder`/matrix_cache
+        max_cache_entries : maximum number of reduced matrices to keep in the cache
+        misassembly_detector : 'hicFindTADs' (default) to use the hicFindTADs TAD-score or 'native' to
+                               compute the misassembly score from the contacts close to the diagonal.
+                               Both scores are similar but not equal, thus, some misassemblies differ.
+        dtype : 'float64' or 'float32'. With 'float32' the raw counts are kept as int32 and all
+                derived (normalized) matrices as float32 to reduce the memory used (see cast_matrix).
+        save_graphml : if True, the graphs used to join the scaffolds in each iteration and to put back
+                       the small scaffolds are saved as graphml files in out_folder.
         Returns
         -------
 
@@ -74,9 +145,13 @@ class HiCAssembler:
         self.min_scaffold_length = min_scaffold_length
         self.num_processors = num_processors
         self.misassembly_threshold = misassembly_zscore_threshold
+        self.misassembly_detector = misassembly_detector
+        self.dtype = np.dtype(dtype)
         self.merged_paths = None
         self.num_iterations = num_iterations
         self.iteration = 0
+        # digest of the input matrix file, used to check that previously computed scores belong to it
+        self.matrix_digest = None
 
         if not isinstance(hic_file_name, str):
             # assume that the hic given is already a HiCMatrix object
@@ -84,15 +159,22 @@ class HiCAssembler:
             self.hic = hic_file_name
         else:
             log.info("Loading Hi-C matrix ... ")
+            if cache_dir is None:
+                cache_dir = os.path.join(self.out_folder, "matrix_cache")
+            self.matrix_cache = MatrixCache(cache_dir, max_entries=max_cache_entries)
             # check if a lower resolution matrix is available
             self.load_hic_matrix(hic_file_name, split_misassemblies, split_positions_file, matrix_bin_size)
 
         if use_log:
             self.hic.matrix.data = np.log1p(self.hic.matrix.data)
+        self.hic.matrix = HiCAssembler.cast_matrix(self.hic.matrix, self.dtype)
+        # keep the bins as a table instead of the list of tuples loaded by HiCMatrix
+        IntervalTable.from_hic(self.hic)
 
         # build scaffolds graph. Bins on the same contig are
         # put together into a path (a type of graph with max degree = 2)
-        self.scaffolds_graph = Scaffolds(copy.deepcopy(self.hic), self.out_folder)
+        self.scaffolds_graph = Scaffolds(copy.deepcopy(self.hic), self.out_folder, dtype=self.dtype,
+                                         save_graphml=save_graphml)
 
         if scaffolds_to_ignore is not None:
             for scaffold in scaffolds_to_ignore:
@@ -114,14 +196,19 @@ class HiCAssembler:
 
     def load_hic_matrix(self, hic_file_name, split_misassemblies, split_positions_file, matrix_bin_size):
         """
-        Checks if a already processed matrix is present and loads it. If not
+        Checks if a already processed matrix is present in the cache and loads it. If not
         the high resolution matrix is loaded, the misasemblies are
-        split and the lower resolution matrix is saved.
+        split and the lower resolution matrix is saved into the cache.
+        The cache key is computed from the content of the input matrix, the content of
+        the split positions file and all parameters that affect the reduced matrix.
 
         Parameters
         ----------
-        hic_file_name name of a hic file or a HiCMatrix object
-        split_misassemblies bool If true, the TAD calling algorithm is used to identify misassemblies
+        hic_file_name name of a hic file or a HiCMatrix object. For multi-resolution cooler
+                      files (.mcool), see load_mcool_matrix.
+        split_misassemblies bool If true, the TAD calling algorithm is used to identify misassemblies. If
+                            false and the matrix is in h5 format, the matrix is not loaded into memory
+                            but reduced while reading it (see load_reduced_h5_matrix).
         split_positions_file file containing manual split positions in bed format
         matrix_bin_size bin size of matrix
         Returns
@@ -129,28 +216,135 @@ class HiCAssembler:
 
         """
 
-        merged_bins_matrix_file = self.out_folder + "/hic_merged_bins_matrix.h5"
-        if os.path.isfile(merged_bins_matrix_file):
-            log.info("Found reduced matrix file {}".format(merged_bins_matrix_file))
-            self.hic = HiCMatrix.hiCMatrix(merged_bins_matrix_file)
+        # for cooler URIs (file.mcool::/resolutions/1000) the hash is computed on the file
+        cache_params = {'matrix': MatrixCache.file_digest(hic_file_name.split("::")[0]),
+                        'matrix_group': hic_file_name.split("::")[1] if "::" in hic_file_name else None,
+                        'matrix_bin_size': matrix_bin_size,
+                        'split_misassemblies': bool(split_misassemblies),
+                        'split_positions_file': None if split_positions_file is None
+                        else MatrixCache.file_digest(split_positions_file),
+                        'misassembly_threshold': self.misassembly_threshold,
+                        'misassembly_detector': self.misassembly_detector,
+                        # the matrix is cast to the given dtype before it is cached (see below)
+                        'dtype': str(self.dtype)}
+        self.matrix_digest = cache_params['matrix']
+        cache_key = MatrixCache.make_key(cache_params)
+        cached_file = self.matrix_cache.get(cache_key)
+        if cached_file is not None:
+            log.info("Found reduced matrix in cache {}".format(cached_file))
+            self.hic = HiCMatrix.hiCMatrix(cached_file)
         else:
-            self.hic = HiCMatrix.hiCMatrix(hic_file_name)
+            log.info("No cached reduced matrix found for the given parameters (key: {})".format(cache_key))
+            if multiResolution.is_mcool(hic_file_name):
+                self.load_mcool_matrix(hic_file_name, split_misassemblies, split_positions_file, matrix_bin_size)
+            elif not split_misassemblies and hic_file_name.endswith(".h5"):
+                # the full resolution matrix is only needed to detect misassemblies. Otherwise,
+                # the matrix is read in blocks of rows and directly reduced to the target bin size.
+                self.hic = HiCAssembler.load_reduced_h5_matrix(hic_file_name, matrix_bin_size,
+                                                               split_positions_file=split_positions_file)
+            else:
+                self.hic = HiCMatrix.hiCMatrix(hic_file_name)
+                self.hic.matrix = HiCAssembler.cast_matrix(self.hic.matrix, self.dtype)
+
+                if split_misassemblies:
+                    # try to find contigs that probably should be separated
+                    self.split_misassemblies(hic_file_name, split_positions_file)
+                elif split_positions_file is not None:
+                    self.split_misassemblies(hic_file_name, split_positions_file, detect_misassemblies=False)
+
+                log.info("Merging bins of file to reduce resolution")
+                binsize = self.hic.getBinSize()
+                if binsize < matrix_bin_size:
+                    # make an smaller matrix having bins of around 25.000 bp
+                    num_bins = matrix_bin_size / binsize
+
+                    log.info("Reducing matrix size to {:,} bp (number of bins merged: {})".format(binsize, num_bins))
+                    self.hic = HiCAssembler.merge_bins(self.hic, num_bins)
+
+            # the matrices are loaded with the dtype of the input file, thus, the dtype
+            # of the cached matrix does not depend on the method used to load it
+            self.hic.matrix = HiCAssembler.cast_matrix(self.hic.matrix, self.dtype)
+            cached_file = self.matrix_cache.save(cache_key, self.hic, cache_params)
+            self.hic = HiCMatrix.hiCMatrix(cached_file)
+
+    @staticmethod
+    def cast_matrix(matrix, dtype):
+        """
+        Changes the precision of the matrix. For 'float64' the matrix is returned unchanged.
+        For 'float32', raw counts (all values are integers) are stored as int32, as long as the largest
+        count fits into an int32. Otherwise, the values are stored as float32. Merged bins whose
+        counts do not fit into an int32 are stored as int64 (see BinPartition.reduce_matrix).
+
+        Parameters
+        ----------
+        matrix : sparse matrix
+        dtype : 'float64' or 'float32'
+
+        Returns
+        -------
+        sparse matrix
 
-            if split_misassemblies:
-                # try to find contigs that probably should be separated
-                self.split_misassemblies(hic_file_name, split_positions_file)
+        Examples
+        --------
+        >>> from scipy.sparse import csr_matrix
+        >>> A = csr_matrix(np.array([[2., 1.], [1., 0.]]))
+        >>> HiCAssembler.cast_matrix(A, 'float64') is A
+        True
+        >>> HiCAssembler.cast_matrix(A, 'float32').dtype
+        dtype('int32')
+        >>> HiCAssembler.cast_matrix(A / 2, 'float32').dtype
+        dtype('float32')
+        >>> HiCAssembler.cast_matrix(A * 2 ** 29, 'float32').dtype
+        dtype('int32')
+        >>> HiCAssembler.cast_matrix(A * 2 ** 30, 'float32').dtype
+        dtype('float32')
+        """
+        dtype = np.dtype(dtype)
+        if dtype == np.float64:
+            return matrix
+        if dtype != np.float32:
+            raise HiCAssemblerException("Unsupported matrix dtype {}. Use float64 or float32".format(dtype))
+
+        data = matrix.data
+        if np.issubdtype(data.dtype, np.integer) or np.all(np.mod(data, 1) == 0):
+            if len(data) == 0 or np.abs(data).max() <= np.iinfo(np.int32).max:
+                return matrix.astype(np.int32, copy=False)
+            log.info("The largest count does not fit into int32. The matrix is stored as float32")
+        return matrix.astype(np.float32, copy=False)
+
+    def load_mcool_matrix(self, mcool_file, split_misassemblies, split_positions_file, matrix_bin_size):
+        """
+        Loads the matrix from a multi-resolution cooler file. The misassemblies are detected using
+        the highest resolution available while the resolution closest to `matrix_bin_size` is used
+        for the assembly, thus the bins do not need to be merged.
 
-            log.info("Merging bins of file to reduce resolution")
-            binsize = self.hic.getBinSize()
-            if binsize < matrix_bin_size:
-                # make an smaller matrix having bins of around 25.000 bp
-                num_bins = matrix_bin_size / binsize
+        Parameters
+        ----------
+        mcool_file : name of the .mcool file
+        split_misassemblies bool If true, the TAD calling algorithm is used to identify misassemblies
+        split_positions_file file containing manual split positions in bed format
+        matrix_bin_size bin size of matrix
 
-                log.info("Reducing matrix size to {:,} bp (number of bins merged: {})".format(binsize, num_bins))
-                self.hic = HiCAssembler.merge_bins(self.hic, num_bins)
+        Returns
+        -------
 
-            self.hic.save(merged_bins_matrix_file)
-            self.hic = HiCMatrix.hiCMatrix(merged_bins_matrix_file)
+        """
+        resolutions = multiResolution.get_resolutions(mcool_file)
+        log.info("Resolutions available in {}: {}".format(mcool_file, ", ".join(["{:,}".format(x[0])
+                                                                                  for x in resolutions])))
+        misassembly_positions = None
+        if split_misassemblies:
+            resolution, uri = resolutions[0]
+            log.info("Detecting misassemblies using resolution {:,}".format(resolution))
+            misassembly_positions = self.get_misassembly_positions(multiResolution.load_matrix(uri))
+
+        resolution, uri = multiResolution.closest_resolution(resolutions, matrix_bin_size)
+        log.info("Using resolution {:,} for the assembly".format(resolution))
+        self.hic = multiResolution.load_matrix(uri)
+
+        if misassembly_positions is not None or split_positions_file is not None:
+            self.split_misassemblies(uri, split_positions_file, detect_misassemblies=False,
+                                     misassembly_positions=misassembly_positions)
 
     def assemble_contigs(self):
         """
@@ -271,46 +465,28 @@ class HiCAssembler:
         >>> shutil.rmtree(dirpath)
 
         """
-        nxG = nx.Graph()
-        for node_id, node in orig_scaff.scaffold.node.iteritems():
-            nn = node.copy()
-            for attr, value in nn.iteritems():
-                if isinstance(value, np.int64):
-                    nn[attr] = int(value)
-                elif isinstance(value, np.float64):
-                    nn[attr] = float(value)
-                elif isinstance(value, list):
-                    nn[attr] = ", ".join([str(x) for x in value])
-                elif isinstance(value, np.string_):
-                    nn[attr] = str(value)
-
+        nodes = Scaffolds.sanitize_node_attributes(orig_scaff.scaffold.node.iteritems())
+        for node_id, nn in nodes:
             if node_id in self.scaffolds_graph.scaffold.node:
                 nn['is_backbone'] = 1
-            nxG.add_node(node_id, **nn)
+        nxG = nx.Graph()
+        nxG.add_nodes_from(nodes)
 
         matrix = orig_scaff.matrix.tocoo()
-        matrix.setdiag(0)
-
-        max_weight = float(orig_scaff.matrix.max() * 1.5)
-        for u, v, weight in zip(matrix.row, matrix.col, matrix.data):
-            if u == v:
-                continue
-            if weight < confidence_score:
-                continue
-            scaff_u = orig_scaff.pg_base.node[u]['name']
-            scaff_v = orig_scaff.pg_base.node[v]['name']
-            nxG.add_edge(scaff_u, scaff_v, weight=float(weight))
-            if scaff_u in self.scaffolds_graph.scaffold.node and \
-               scaff_v in self.scaffolds_graph.scaffold.node and \
-               scaff_u in self.scaffolds_graph.scaffold.adj[scaff_v]:
-                # u and v are directly joined
-                nxG.add_edge(scaff_u, scaff_v, weight=float(max_weight))
-
-        # add all contacts between assembled nodes that may not have been
+        keep = matrix.row != matrix.col
+        if confidence_score is not None:
+            keep &= matrix.data >= confidence_score
+        bin_name = np.array([orig_scaff.pg_base.node[x]['name'] for x in range(matrix.shape[0])], dtype=object)
+        nxG.add_weighted_edges_from(zip(bin_name[matrix.row[keep]], bin_name[matrix.col[keep]],
+                                        matrix.data[keep].astype(np.float64).tolist()))
+
+        # the scaffolds that are directly joined get the maximum weight. This
+        # also adds the contacts between assembled nodes that may not have been
         # present in the graph
-        for path in self.scaffolds_graph.scaffold.get_all_paths():
-            for scaff_u, scaff_v in zip(path[:-1], path[1:]):
-                nxG.add_edge(scaff_u, scaff_v, weight=float(max_weight))
+        max_weight = float(orig_scaff.matrix.max() * 1.5)
+        nxG.add_weighted_edges_from([(scaff_u, scaff_v, max_weight)
+                                     for path in self.scaffolds_graph.scaffold.get_all_paths()
+                                     for scaff_u, scaff_v in zip(path[:-1], path[1:])])
 
         return nxG
 
@@ -596,21 +772,31 @@ class HiCAssembler:
 
         # create orig_scaff once using a min_scaffold length as size target to
         # compute confidence scores
-        orig_scaff = Scaffolds(self.hic)
-        orig_scaff.split_and_merge_contigs(num_splits=1, target_size=self.min_scaffold_length, normalize_method=normalize_method)
+        orig_scaff = Scaffolds(self.hic, dtype=self.dtype)
+        orig_scaff.split_and_merge_contigs(num_splits=1, target_size=self.min_scaffold_length,
+                                           normalize_method=normalize_method)
         orig_stats = orig_scaff.get_stats_per_split()
-        conf_score = orig_stats[1]['median']
 
-        # re make orig_scaff a second time without splitting the scaffolds
-        # as this is the structure needed for rest of the program
-        orig_scaff = Scaffolds(self.hic)
-        orig_scaff.split_and_merge_contigs(num_splits=1, normalize_method=normalize_method)
+        # merge orig_scaff a second time without splitting the scaffolds
+        # as this is the structure needed for rest of the program. The whole
+        # matrix is reduced again, thus the result is the same as for a new Scaffolds object.
+        orig_scaff.split_and_merge_contigs(num_splits=1, normalize_method=normalize_method, incremental=False)
+
+        try:
+            conf_score = orig_stats[1]['median']
+            log.debug("Confidence score set to {}".format(conf_score))
+        except KeyError:
+            # the scaffolds are too small to be split into parts of min_scaffold_length
+            conf_score = np.percentile(orig_scaff.matrix.data, 5)
+            log.info("No contacts between parts of {:,} bp were found. Confidence score set to "
+                     "the 5th percentile of the scaffold contacts: {}".format(self.min_scaffold_length, conf_score))
         # reset pb_base
         self.scaffolds_graph.pg_base = copy.deepcopy(self.scaffolds_graph.matrix_bins)
         nxG = self.make_scaffold_network(orig_scaff, confidence_score=conf_score)
 
         nxG = nx.maximum_spanning_tree(nxG, weight='weight')
-        nx.write_graphml(nxG, self.out_folder + "/mst_for_small_Scaff_integration.graphml".format())
+        if self.scaffolds_graph.save_graphml:
+            nx.write_graphml(nxG, self.out_folder + "/mst_for_small_Scaff_integration.graphml".format())
 
         # 1. Identify branches
 
@@ -629,7 +815,8 @@ class HiCAssembler:
             if 'is_backbone' in nxG.node[u] and 'is_backbone' in nxG.node[v]:
                 nxG.remove_edge(u, v)
 
-        nx.write_graphml(nxG, "{}/backbone_put_back_scaffolds.graphml".format(self.out_folder))
+        if self.scaffolds_graph.save_graphml:
+            nx.write_graphml(nxG, "{}/backbone_put_back_scaffolds.graphml".format(self.out_folder))
         # now each connected component should only have a backbone node
         # and all the connected scaffolds that belong to that node.
         for branch in list(nx.connected_component_subgraphs(nxG)):
@@ -814,7 +1001,8 @@ class HiCAssembler:
         integrated_paths = [(x, self.scaffolds_graph.scaffold.node[x]['length']) for x in path[1:]]
         log.info("Scaffolds {} successfully integrated into the network".format(integrated_paths))
 
-    def split_misassemblies(self, hic_file_name, split_positions_file=None):
+    def split_misassemblies(self, hic_file_name, split_positions_file=None, detect_misassemblies=True,
+                            misassembly_positions=None):
         """
         Mis assemblies are commonly found in the data. To remove them, we use
         a simple metric to identify empty contacts.
@@ -822,126 +1010,446 @@ class HiCAssembler:
         Parameters
         ----------
         hic_file_name : Name of the file
+        split_positions_file : bed file with positions to split
+        detect_misassemblies : if False, only the positions from the `split_positions_file` are split
+        misassembly_positions : list of (scaffold, start, end) tuples. If given, these positions are
+                                split instead of detecting the misassemblies on self.hic. This is used
+                                when the misassemblies are detected on a higher resolution matrix.
 
         Returns
         -------
 
+        """
+        bins_to_remove = []
+        if misassembly_positions is None and detect_misassemblies:
+            misassembly_positions = self.get_misassembly_positions(self.hic)
+        bin_index = BinIndex(IntervalTable.from_hic(self.hic))
+        bin_ids = HiCAssembler.get_bins_overlapping_positions(misassembly_positions or [], bin_index)
+
+        # split scaffolds based on input file from user
+        if split_positions_file is not None:
+            file_bin_ids, bins_to_remove = HiCAssembler.get_split_file_bins(split_positions_file, bin_index)
+            for scaff_name, scaff_bin_ids in file_bin_ids.iteritems():
+                bin_ids.setdefault(scaff_name, []).extend(scaff_bin_ids)
+
+        # rename cut intervals
+        new_cut_intervals, num_removed_misassemblies = \
+            HiCAssembler.split_cut_intervals(self.hic.cut_intervals, self.hic.chrBinBoundaries, bin_ids)
+
+        self.hic.setCutIntervals(new_cut_intervals)
+        log.info("{} misassemblies were removed".format(num_removed_misassemblies))
+
+        if len(bins_to_remove) > 0:
+            log.info("{} bins will be removed from the matrix because they are contained within the split regions.".
+                     format(len(bins_to_remove)))
+            self.hic.removeBins(bins_to_remove)
+            IntervalTable.from_hic(self.hic)
+
+    def get_misassembly_positions(self, hic):
+        """
+        Uses an insulation score (similar to the hicFindTADs TAD-score) to find boundaries
+        that are likely misassemblies.
+
+        Parameters
+        ----------
+        hic : HiCMatrix object used to compute the score.
+
+        Returns
+        -------
+        list of (scaffold, start, end) tuples of the boundaries that are likely misassemblies.
         """
         log.info("Detecting misassemblies")
 
+        # adjust window sizes to compute misassembly score (aka tad-score)
+        binsize = hic.getBinSize()
+        max_depth = max(800000, binsize * 500)
+        min_depth = min(200000, binsize * 200)
+        step = binsize * 50
+        log.debug("zscore window sizes set by hicassembler: ")
+        log.debug("max depth:\t{}".format(max_depth))
+        log.debug("min depth:\t{}".format(min_depth))
+        log.debug("step:\t{}".format(step))
+        log.debug("bin size:\t{}".format(binsize))
+
+        if self.misassembly_detector == 'hicFindTADs':
+            boundaries = self.get_tad_score_boundaries(hic, min_depth, max_depth, step)
+        else:
+            boundaries = self.get_band_score_boundaries(hic, min_depth, max_depth, step)
+
+        scaffold, start, end, tad_score = zip(*boundaries)
+        tad_score = np.array(tad_score)
+        # compute a zscore of the tad_score to select the lowest ranking boundaries.
+        zscore = (tad_score - np.mean(tad_score)) / np.std(tad_score)
+
+        # select as misassemblies all boundaries that have a zscore lower than 1.64 (p-value 0.05)
+        log.info("Splitting scaffolds using threshold = {}".format(self.misassembly_threshold))
+        return [(scaffold[idx], start[idx], end[idx]) for idx in np.flatnonzero(zscore < self.misassembly_threshold)]
+
+    def get_band_score_boundaries(self, hic, min_depth, max_depth, step):
+        """
+        Computes the misassembly score using only the contacts close to the diagonal
+        (see misassemblyScore) and returns the local minima of the score.
+
+        Parameters
+        ----------
+        hic : HiCMatrix object used to compute the score.
+        min_depth, max_depth, step : window sizes in bp
+
+        Returns
+        -------
+        list of (scaffold, start, end, mean score) tuples
+        """
+        score_file = self.out_folder + "/misassembly_band_score.bm"
+        # for mcool files the scores are computed on the highest resolution, which is
+        # identified by the bin size
+        params = {'minDepth': min_depth, 'maxDepth': max_depth, 'step': step, 'binsize': hic.getBinSize(),
+                  'matrix': self.matrix_digest}
+
+        # check if the computation for the misassembly score was already done
+        if not os.path.isfile(score_file) or misassemblyScore.load_scores(score_file)[0] != params:
+            chrom, start, end, scores = misassemblyScore.compute_scores(hic, min_depth, max_depth, step)
+            misassemblyScore.save_scores(score_file, chrom, start, end, scores, params)
+        else:
+            log.info("Using previously computed scores: {}".format(score_file))
+
+        # the scores are always read from the saved file such that the values (which are
+        # rounded when saved) are the same regardless of whether the scores were just computed.
+        _, chrom, start, end, scores = misassemblyScore.load_scores(score_file)
+        mean_score = scores.mean(axis=1)
+        min_idx = misassemblyScore.find_minima(mean_score, chrom, lookahead=4)
+        if len(min_idx) == 0:
+            raise HiCAssemblerException("No boundaries were found to detect misassemblies.")
+
+        return [(chrom[idx], start[idx], end[idx], mean_score[idx]) for idx in min_idx]
+
+    def get_tad_score_boundaries(self, hic, min_depth, max_depth, step):
+        """
+        Uses hicFindTADs to compute the TAD-score and returns the boundaries found as
+        the local minima of the TAD-score (see hicFindTADs.HicFindTads.find_boundaries).
+
+        Parameters
+        ----------
+        hic : HiCMatrix object used to compute the TAD-score.
+        min_depth, max_depth, step : window sizes in bp
+
+        Returns
+        -------
+        list of (scaffold, start, end, mean tad score) tuples
+        """
         tad_score_file = self.out_folder + "/misassembly_score.txt"
-        zscore_matrix_file = self.out_folder + "/zscore_matrix.h5"
+        # the bedgraph matrix saved by hicFindTADs has no header, thus, the parameters
+        # used to compute the scores are saved in a separate file
+        params_file = self.out_folder + "/misassembly_score.json"
+        params = {'minDepth': min_depth, 'maxDepth': max_depth, 'step': step, 'binsize': hic.getBinSize(),
+                  'matrix': self.matrix_digest}
+        saved_params = None
+        if os.path.isfile(tad_score_file) and os.path.isfile(params_file):
+            with open(params_file) as fh:
+                saved_params = json.load(fh)
+
+        ft = hicFindTADs.HicFindTads(hic, num_processors=self.num_processors, use_zscore=False)
         # check if the computation for the misassembly score was already done
-        if not os.path.isfile(tad_score_file) or not os.path.isfile(zscore_matrix_file):
-            ft = hicFindTADs.HicFindTads(hic_file_name, num_processors=self.num_processors, use_zscore=False)
-            # adjust window sizes to compute misassembly score (aka tad-score)
-            ft.max_depth = max(800000, ft.binsize * 500)
-            ft.min_depth = min(200000, ft.binsize * 200)
-            ft.step = ft.binsize * 50
-            log.debug("zscore window sizes set by hicassembler: ")
-            log.debug("max depth:\t{}".format(ft.max_depth))
-            log.debug("min depth:\t{}".format(ft.min_depth))
-            log.debug("step:\t{}".format(ft.step))
-            log.debug("bin size:\t{}".format(ft.binsize))
-
-            ft.hic_ma.matrix.data = np.log1p(ft.hic_ma.matrix.data)
-            ft.hic_ma.matrix = ft.hic_ma.convert_to_obs_exp_matrix(perchr=True)
-            ft.hic_ma.matrix.data = np.log2(ft.hic_ma.matrix.data)
-            ft.compute_spectra_matrix(perchr=True)
+        if saved_params != params:
+            # the scores are computed per scaffold, thus, the scaffolds are split into groups
+            # of similar number of bins that are processed in parallel.
+            shards = HiCAssembler.get_scaffold_shards(hic.chrBinBoundaries, self.num_processors)
+            global misassembly_hic
+            misassembly_hic = hic
+            try:
+                if len(shards) == 1:
+                    results = [compute_misassembly_scores(shards[0], min_depth, max_depth, step,
+                                                          self.num_processors)]
+                else:
+                    log.info("Computing misassembly scores for {} groups of scaffolds using {} processors".
+                             format(len(shards), self.num_processors))
+                    tasks = [(shard, min_depth, max_depth, step) for shard in shards]
+                    pool = multiprocessing.Pool(self.num_processors)
+                    try:
+                        results = pool.map(compute_misassembly_scores_wrapper, tasks)
+                    finally:
+                        pool.close()
+                        pool.join()
+            finally:
+                misassembly_hic = None
+
+            ft.bedgraph_matrix = HiCAssembler.merge_misassembly_scores(results, list(hic.chrBinBoundaries))
             ft.save_bedgraph_matrix(tad_score_file)
-            ft.hic_ma.save(zscore_matrix_file)
+            with open(params_file, 'w') as fh:
+                json.dump(params, fh, sort_keys=True)
+        else:
+            log.info("Using previously computed scores: {}".format(tad_score_file))
 
-        log.info("Using previously computed scores: {}\t{}".format(tad_score_file, zscore_matrix_file))
-        # TODO here the hic_file is loaded unnecessarily. A way to remove this step would be good
-        ft = hicFindTADs.HicFindTads(hic_file_name, num_processors=self.num_processors, use_zscore=False)
-        ft.hic_ma = HiCMatrix.hiCMatrix(zscore_matrix_file)
+        # the scores are always read from the saved file such that the values (which are
+        # rounded when saved) are the same regardless of whether the scores were just computed.
         ft.load_bedgraph_matrix(tad_score_file)
-        ft.find_boundaries()
+        bedgraph_matrix = ft.bedgraph_matrix
+
+        # same boundaries as HicFindTads.find_boundaries, whose p-values are not used
+        # but require the transformed matrix. The default min_boundary_distance
+        # of hicFindTADs is 4 bins.
+        min_idx, _ = hicFindTADs.HicFindTads.find_consensus_minima(bedgraph_matrix['matrix'], lookahead=4,
+                                                                   chrom=bedgraph_matrix['chrom'])
+        if len(min_idx) == 0:
+            raise HiCAssemblerException("No boundaries were found to detect misassemblies.")
+
+        boundaries = []
+        for idx in min_idx:
+            if hic.getRegionBinRange(bedgraph_matrix['chrom'][idx], bedgraph_matrix['chr_start'][idx],
+                                     bedgraph_matrix['chr_end'][idx]) is None:
+                continue
+            boundaries.append((bedgraph_matrix['chrom'][idx],
+                               bedgraph_matrix['chr_start'][idx],
+                               bedgraph_matrix['chr_end'][idx],
+                               np.mean(bedgraph_matrix['matrix'][idx])))
+        return boundaries
 
-        tuple_ = []
-        # find the tad score and position of boundaries with significant pvalues
-        for idx, pval in ft.boundaries['pvalues'].iteritems():
-            tuple_.append((ft.bedgraph_matrix['chrom'][idx],
-                           ft.bedgraph_matrix['chr_start'][idx],
-                           ft.bedgraph_matrix['chr_end'][idx],
-                           np.mean(ft.bedgraph_matrix['matrix'][idx])))
+    @staticmethod
+    def get_scaffold_shards(chr_bin_boundaries, num_shards):
+        """
+        Splits the scaffolds into at most `num_shards` groups having a similar
+        number of bins. The scaffolds are assigned, from the largest
+        to the smallest, to the group having the fewest bins. Within each group
+        the scaffolds keep the matrix order.
 
-        scaffold, start, end, tad_score = zip(*tuple_)
-        tad_score = np.array(tad_score)
-        # compute a zscore of the tad_score to select the lowest ranking boundaries.
-        zscore = (tad_score - np.mean(tad_score)) / np.std(tad_score)
+        Parameters
+        ----------
+        chr_bin_boundaries : OrderedDict of scaffold name: (start bin, end bin)
+        num_shards : maximum number of groups
+
+        Returns
+        -------
+        list of lists of scaffold names
+
+        Examples
+        --------
+        >>> from collections import OrderedDict
+        >>> bounds = OrderedDict([('a', (0, 2)), ('b', (2, 10)), ('c', (10, 13)), ('d', (13, 17))])
+        >>> HiCAssembler.get_scaffold_shards(bounds, 2)
+        [['b'], ['a', 'c', 'd']]
+        >>> HiCAssembler.get_scaffold_shards(bounds, 1)
+        [['a', 'b', 'c', 'd']]
+        """
+        scaffolds = list(chr_bin_boundaries)
+        num_shards = max(1, min(num_shards, len(scaffolds)))
+        if num_shards == 1:
+            return [scaffolds]
+
+        order = dict([(scaff, idx) for idx, scaff in enumerate(scaffolds)])
+        shards = [[] for _ in range(num_shards)]
+        shard_bins = np.zeros(num_shards, dtype=int)
+        by_size = sorted(scaffolds, key=lambda x: (-(chr_bin_boundaries[x][1] - chr_bin_boundaries[x][0]), order[x]))
+        for scaff in by_size:
+            shard_idx = np.argmin(shard_bins)
+            shards[shard_idx].append(scaff)
+            shard_bins[shard_idx] += chr_bin_boundaries[scaff][1] - chr_bin_boundaries[scaff][0]
+
+        return [sorted(shard, key=lambda x: order[x]) for shard in shards if len(shard)]
+
+    @staticmethod
+    def get_scaffolds_submatrix(hic, scaffolds):
+        """
+        Returns a new HiCMatrix object containing only the given scaffolds. The
+        bin size of the new object is that of the whole matrix.
+        """
+        bin_ids = np.concatenate([np.arange(*hic.chrBinBoundaries[scaff]) for scaff in scaffolds])
+        sub_hic = HiCMatrix.hiCMatrix()
+        sub_hic.setMatrix(hic.matrix[bin_ids, :][:, bin_ids], IntervalTable.from_hic(hic)[bin_ids])
+        # map the nan bins to the new bin ids
+        new_id = np.full(len(hic.cut_intervals), -1, dtype=int)
+        new_id[bin_ids] = np.arange(len(bin_ids))
+        nan_bins = new_id[np.asarray(hic.nan_bins, dtype=int)]
+        sub_hic.nan_bins = nan_bins[nan_bins >= 0]
+        # keep the bin size estimated for the whole matrix, otherwise
+        # the window sizes in bins used for the scores may differ
+        sub_hic.bin_size = hic.getBinSize()
+        return sub_hic
+
+    @staticmethod
+    def merge_misassembly_scores(results, scaffold_order):
+        """
+        Merges the bedgraph matrices computed for groups of scaffolds
+        (see `compute_misassembly_scores`) following the given order of the scaffolds.
+
+        Parameters
+        ----------
+        results : list of bedgraph matrices
+        scaffold_order : list of scaffold names
+
+        Returns
+        -------
+        merged bedgraph matrix
+
+        Examples
+        --------
+        >>> res_a = {'chrom': np.array(['b', 'b']), 'chr_start': np.array([0, 10]), 'chr_end': np.array([10, 20]),
+        ...          'matrix': np.array([[1.0], [2.0]])}
+        >>> res_b = {'chrom': np.array(['a', 'c']), 'chr_start': np.array([0, 0]), 'chr_end': np.array([10, 10]),
+        ...          'matrix': np.array([[3.0], [4.0]])}
+        >>> merged = HiCAssembler.merge_misassembly_scores([res_a, res_b], ['a', 'b', 'c'])
+        >>> merged['chrom'].tolist(), merged['chr_start'].tolist(), merged['matrix'].flatten().tolist()
+        (['a', 'b', 'b', 'c'], [0, 0, 10, 0], [3.0, 1.0, 2.0, 4.0])
+        """
+        if len(results) == 1:
+            return results[0]
+
+        rows = {}
+        for res_idx, bedgraph_matrix in enumerate(results):
+            chrom = bedgraph_matrix['chrom']
+            # the rows of each scaffold are consecutive
+            starts = np.concatenate([[0], np.flatnonzero(chrom[1:] != chrom[:-1]) + 1])
+            ends = np.append(starts[1:], len(chrom))
+            for start, end in zip(starts, ends):
+                rows[chrom[start]] = (res_idx, start, end)
+
+        merged = {'chrom': [], 'chr_start': [], 'chr_end': [], 'matrix': []}
+        for scaff in scaffold_order:
+            if scaff in rows:
+                res_idx, start, end = rows[scaff]
+                for key in merged.keys():
+                    merged[key].append(results[res_idx][key][start:end])
+
+        merged['matrix'] = np.vstack(merged['matrix'])
+        for key in ['chrom', 'chr_start', 'chr_end']:
+            merged[key] = np.concatenate(merged[key])
+
+        return merged
+
+    @staticmethod
+    def get_bins_overlapping_positions(positions, bin_index):
+        """
+        Finds the bins that overlap with the given positions.
+
+        Parameters
+        ----------
+        positions : list of (scaffold, start, end) tuples
+        bin_index : BinIndex object of the matrix bins
+
+        Returns
+        -------
+        dictionary of scaffold name -> list of bins that overlap a position.
+
+        >>> bin_index = BinIndex([('a', 0, 10, 1), ('a', 10, 20, 1), ('a', 20, 30, 1), ('b', 0, 10, 1)])
+        >>> HiCAssembler.get_bins_overlapping_positions([('a', 5, 15), ('c', 0, 10)], bin_index)
+        {'a': [0, 1]}
+        """
+        # the scaffold key may not be present in the matrix because
+        # of the reduction of the matrix, which removes some scaffolds
+        positions = [x for x in positions if x[0] in bin_index]
+        bin_ids = {}
+        if len(positions) == 0:
+            return bin_ids
+
+        scaffolds, starts, ends = zip(*positions)
+        first, last = bin_index.find_overlaps(scaffolds, starts, ends)
+        for scaffold, first_bin, last_bin in zip(scaffolds, first, last):
+            bin_ids.setdefault(scaffold, []).extend(range(first_bin, last_bin + 1))
+
+        return bin_ids
+
+    @staticmethod
+    def get_split_file_bins(split_positions_file, bin_index):
+        """
+        Reads the bed file containing the positions to split and finds the bins that overlap
+        with each position.
+
+        Parameters
+        ----------
+        split_positions_file : bed file name
+        bin_index : BinIndex object of the matrix bins
+
+        Returns
+        -------
+        tuple (bin_ids, bins_to_remove). bin_ids is a dictionary of scaffold name -> list of bins
+        after which the scaffold should be split and bins_to_remove is a list of bins that are contained
+        within the split regions.
+        """
+        log.debug("loading positions to split from {}".format(split_positions_file))
+        from hicexplorer import readBed
 
-        # select as misassemblies all boundaries that have a zscore lower than 1.64 (p-value 0.05)
         bin_ids = {}
         bins_to_remove = []
-        log.info("Splitting scaffolds using threshold = {}".format(self.misassembly_threshold))
-        for idx in np.flatnonzero(zscore < self.misassembly_threshold):
-            # find the bins that overlap with the misassembly
-            if scaffold[idx] not in self.hic.interval_trees:
-                # the scaffold[idx] key may not be present
-                # in the self.hic because of the reduction of the matrix, which removes some scaffolds
+        bed_list = []
+        bed_file_h = readBed.ReadBed(open(split_positions_file, 'r'))
+        for bed in bed_file_h:
+            if bed.chromosome not in bin_index:
+                log.info("split position {} not found in hic matrix".format(bed))
                 continue
-            if scaffold[idx] not in bin_ids:
-                bin_ids[scaffold[idx]] = []
-            to_split_intervals = sorted(self.hic.interval_trees[scaffold[idx]][start[idx]:end[idx]])
-            bin_ids[scaffold[idx]].extend(sorted([interval_bin.data for interval_bin in to_split_intervals]))
-
-        # split scaffolds based on input file from user
-        if split_positions_file is not None:
-            log.debug("loading positions to split from {}".format(split_positions_file))
-            from hicexplorer import readBed
-
-            bed_file_h = readBed.ReadBed(open(split_positions_file, 'r'))
-            for bed in bed_file_h:
-                # find the bins that overlap with the misassembly
-                if bed.chromosome not in self.hic.interval_trees:
-                    log.info("split position {} not found in hic matrix".format(bed))
+            bed_list.append(bed)
+        if len(bed_list) == 0:
+            return bin_ids, bins_to_remove
+
+        # find the bins that overlap with the misassemblies
+        chroms = [bed.chromosome for bed in bed_list]
+        first, last = bin_index.find_overlaps(chroms, [bed.start for bed in bed_list], [bed.end for bed in bed_list])
+        nearest = bin_index.find_last_bin_before(chroms, [bed.end for bed in bed_list])
+        for idx, bed in enumerate(bed_list):
+            if bed.chromosome not in bin_ids:
+                bin_ids[bed.chromosome] = []
+            to_split_intervals = range(first[idx], last[idx] + 1)
+            if len(to_split_intervals) == 0:
+                # it could be that there is not bin nearby so the nearest bin is taken
+                log.info('split position from split list {} does not match any bin. Using nearest bin'.format(bed))
+                if nearest[idx] < 0:
+                    log.info('No bin found before split position {}. Skipping it.'.format(bed))
                     continue
-                if bed.chromosome not in bin_ids:
-                    bin_ids[bed.chromosome] = []
-                to_split_intervals = sorted(self.hic.interval_trees[bed.chromosome][bed.start:bed.end])
-                if len(to_split_intervals) == 0:
-                    # it could be that there is not bin nearby so the nearest bin is taken
-                    log.info('split position from split list {} does not match any bin. Using nearest bin'.format(bed))
-                    to_split_intervals = [sorted(self.hic.interval_trees[bed.chromosome][0:bed.end])[-1]]
-                    log.info('split position used is {}.'.format(to_split_intervals[0]))
-
-                to_split_intervals = sorted([interval_bin.data for interval_bin in to_split_intervals])
-                if len(to_split_intervals) > 1:
-                    # if the split contains several bins, the region should be removed from the matrix.
-                    # All the bins, except the last one, are marked for deletion. The last one is marked
-                    # for split.
-                    bins_to_remove.extend(to_split_intervals[:-1])
-                    to_split_intervals = [to_split_intervals[-1]]
-
-                bin_ids[bed.chromosome].extend(to_split_intervals)
+                to_split_intervals = [nearest[idx]]
+                log.info('split position used is bin {}.'.format(to_split_intervals[0]))
 
-        # rename cut intervals
+            if len(to_split_intervals) > 1:
+                # if the split contains several bins, the region should be removed from the matrix.
+                # All the bins, except the last one, are marked for deletion. The last one is marked
+                # for split.
+                bins_to_remove.extend(to_split_intervals[:-1])
+                to_split_intervals = [to_split_intervals[-1]]
+
+            bin_ids[bed.chromosome].extend(to_split_intervals)
+
+        return bin_ids, bins_to_remove
+
+    @staticmethod
+    def split_cut_intervals(cut_intervals, chr_bin_boundaries, bin_ids):
+        """
+        Renames the cut intervals of the scaffolds that are split. Each part
+        of a split scaffold is named as 'name/part_number'.
+
+        Parameters
+        ----------
+        cut_intervals : list of (name, start, end, extra) tuples or IntervalTable
+        chr_bin_boundaries : dictionary of scaffold name -> (first bin, last bin + 1)
+        bin_ids : dictionary of scaffold name -> list of bins after which the scaffold is split
+
+        Returns
+        -------
+        tuple (new_cut_intervals, num_splits). new_cut_intervals is an IntervalTable.
+
+        >>> cut_intervals = [('a', 0, 10, 1), ('a', 10, 20, 1), ('a', 20, 30, 1), ('a', 30, 40, 1), ('b', 0, 10, 1)]
+        >>> new_intervals, num_splits = HiCAssembler.split_cut_intervals(cut_intervals, {'a': (0, 4), 'b': (4, 5)},
+        ...                                                              {'a': [1, 3]})
+        >>> new_intervals.to_list(), num_splits
+        ([('a/1', 0, 10, 1.0), ('a/1', 10, 20, 1.0), ('a/2', 20, 30, 1.0), ('a/2', 30, 40, 1.0), ('b', 0, 10, 1.0)], 1)
+        """
+        table = IntervalTable.from_intervals(cut_intervals)
         num_removed_misassemblies = 0
-        new_cut_intervals = self.hic.cut_intervals[:]
+        chrom = None
         for scaff_name in bin_ids:
-            scaff_bins = self.hic.getChrBinRange(scaff_name)
+            scaff_bins = chr_bin_boundaries[scaff_name]
             # remove splits at the start or end of chromosome as they are most likely
             # false positives
-            id_list = set(sorted([x for x in bin_ids[scaff_name] if x not in [scaff_bins[0], scaff_bins[1] - 1]]))
-            part_number = 1
+            id_list = set([x for x in bin_ids[scaff_name] if x not in [scaff_bins[0], scaff_bins[1] - 1]])
             if len(id_list) > 0:
                 log.info("Removing {} misassemblies for {} ".format(len(id_list), scaff_name))
-                for matrix_bin in range(scaff_bins[0], scaff_bins[1]):
-                    name, cut_start, cut_end, extra = new_cut_intervals[matrix_bin]
-                    new_name = "{}/{}".format(name, part_number)
-                    new_cut_intervals[matrix_bin] = (new_name, cut_start, cut_end, extra)
-                    if matrix_bin in id_list:
-                        part_number += 1
-                        num_removed_misassemblies += 1
-
-        self.hic.setCutIntervals(new_cut_intervals)
-        log.info("{} misassemblies were removed".format(num_removed_misassemblies))
-
-        if len(bins_to_remove) > 0:
-            log.info("{} bins will be removed from the matrix because they are contained within the split regions.".
-                     format(len(bins_to_remove)))
-            self.hic.removeBins(bins_to_remove)
+                if chrom is None:
+                    chrom = table.chrom
+                # the part number increases after each bin in id_list
+                is_split = np.zeros(scaff_bins[1] - scaff_bins[0], dtype=int)
+                is_split[np.array(sorted(id_list)) - scaff_bins[0]] = 1
+                part_number = 1 + np.concatenate([[0], np.cumsum(is_split)[:-1]])
+                chrom[scaff_bins[0]:scaff_bins[1]] = ["{}/{}".format(scaff_name, x) for x in part_number]
+                num_removed_misassemblies += len(id_list)
+
+        if chrom is not None:
+            table = table.rename(chrom)
+        return table, num_removed_misassemblies
 
     def plot_matrix(self, filename, title='Assembly results',
                     cmap='RdYlBu_r', log1p=True, add_vlines=False, vmax=None, vmin=None):
@@ -1227,13 +1735,10 @@ class HiCAssembler:
                 for scaffold_name in scaff_path:
                     bin_path = self.scaffolds_graph.scaffold.node[scaffold_name]['path']
                     if map_old_to_merged is not None:
-                        new_bin_path = []
-                        seen = set()
-                        for bin_id in bin_path:
-                            map_old_to_merged[bin_id]
-                            if map_old_to_merged[bin_id] not in seen:
-                                new_bin_path.append(map_old_to_merged[bin_id])
-                            seen.add(map_old_to_merged[bin_id])
+                        # merged bins in the order in which they first appear in the path
+                        merged_path = map_old_to_merged[np.asarray(bin_path, dtype=np.int64)]
+                        _, first_idx = np.unique(merged_path, return_index=True)
+                        new_bin_path = merged_path[np.sort(first_idx)].tolist()
                     else:
                         new_bin_path = bin_path
                     order_list.extend(new_bin_path)
@@ -1248,23 +1753,270 @@ class HiCAssembler:
             hic.chromosomeBinBoundaries = scaff_boundaries
 
         if rename_scaffolds is True:
-            new_intervals = []
-            start_list = []
-            for idx, scaff_id in enumerate(hic.chromosomeBinBoundaries):
-                start_bin, end_bin = hic.chromosomeBinBoundaries[scaff_id]
-                start = 0
-                for interval in hic.cut_intervals[start_bin:end_bin]:
-                    scaff_name, int_start, int_end, cov = interval
-                    end = start + (int_end - int_start)
-                    new_intervals.append(("hic_scaffold_{}".format(idx + 1), start, end, cov))
-                    start_list.append((start, end, int_start, int_end, int_end - int_start))
+            table = IntervalTable.from_hic(hic)
+            # the bins of each scaffold are placed one after the other starting at 0
+            scaff_bins = hic.chromosomeBinBoundaries.values()
+            num_bins = [end_bin - start_bin for start_bin, end_bin in scaff_bins]
+            new_end = np.cumsum(table.end - table.start)
+            scaff_offset = np.repeat(new_end[[start_bin - 1 for start_bin, _ in scaff_bins[1:]]], num_bins[1:])
+            new_end[num_bins[0]:] -= scaff_offset
+            new_start = new_end - (table.end - table.start)
+            new_table = IntervalTable(np.repeat(np.arange(len(scaff_bins)), num_bins),
+                                      ["hic_scaffold_{}".format(idx + 1) for idx in range(len(scaff_bins))],
+                                      new_start, new_end, table.coverage)
+
+            hic.setCutIntervals(new_table)
+
+        return hic
+
+    @staticmethod
+    def read_h5_intervals(matrix_file):
+        """
+        Reads the bin intervals and the nan bins of a matrix in h5 format
+        without loading the matrix.
+
+        Returns
+        -------
+        tuple (cut_intervals, nan_bins). cut_intervals is an IntervalTable.
+        """
+        with tables.open_file(matrix_file) as f:
+            chrom_list = toString(f.root.intervals.chr_list.read())
+            start_list = f.root.intervals.start_list.read()
+            end_list = f.root.intervals.end_list.read()
+            extra_list = f.root.intervals.extra_list.read()
+            if hasattr(f.root, 'nan_bins'):
+                nan_bins = f.root.nan_bins.read().astype(int)
+            else:
+                nan_bins = np.array([], dtype=int)
+
+        return IntervalTable.from_arrays(chrom_list, start_list, end_list, extra_list), nan_bins
+
+    @staticmethod
+    def reduce_h5_matrix(matrix_file, map_, num_merged_bins, row_block_size=ROW_BLOCK_SIZE):
+        """
+        Reads the csr matrix stored in the h5 file in blocks of rows and
+        sums the values into a matrix of `num_merged_bins`. Only the upper
+        triangle of the matrix is used, thus the result is the same (up to floating point
+        rounding) as reduce_matrix_by_mapping(matrix, map_, num_merged_bins) but the full
+        matrix is never loaded into memory.
+
+        Parameters
+        ----------
+        matrix_file : h5 matrix file name
+        map_ : array containing the merged bin id for each bin or -1 if the bin is removed.
+               The merged bin ids should not decrease along the bins.
+        num_merged_bins : size of the resulting matrix
+        row_block_size : number of rows to read at once
+
+        Returns
+        -------
+        symmetric csr matrix
+        """
+        with tables.open_file(matrix_file) as f:
+            num_rows = f.root.matrix.shape.read()[0]
+            dtype = f.root.matrix.data.dtype
+            # the values are added as floats, similarly as in reduce_matrix_by_mapping
+            reduced = csr_matrix((num_merged_bins, num_merged_bins), dtype=float)
+            for block_start in range(0, num_rows, row_block_size):
+                block_end = min(block_start + row_block_size, num_rows)
+                indptr = f.root.matrix.indptr[block_start:block_end + 1]
+                indices = f.root.matrix.indices[indptr[0]:indptr[-1]]
+                data = f.root.matrix.data[indptr[0]:indptr[-1]]
+                row = np.repeat(np.arange(block_start, block_end), np.diff(indptr))
+
+                # use only the upper triangle in case the full matrix was saved
+                upper = indices >= row
+                new_row = map_[row[upper]]
+                new_col = map_[indices[upper]]
+                keep = (new_row > -1) & (new_col > -1)
+                reduced = reduced + coo_matrix((data[upper][keep].astype(float), (new_row[keep], new_col[keep])),
+                                               shape=(num_merged_bins, num_merged_bins)).tocsr()
+
+        reduced = reduced.astype(dtype)
+        # make the matrix symmetric
+        matrix = reduced + triu(reduced, k=1, format='csr').T
+        matrix = matrix.tocsr()
+        matrix.eliminate_zeros()
+        return matrix
+
+    @staticmethod
+    def load_reduced_h5_matrix(matrix_file, matrix_bin_size, split_positions_file=None,
+                               row_block_size=ROW_BLOCK_SIZE):
+        """
+        Produces the same matrix (up to floating point rounding) as loading the h5 matrix,
+        splitting the scaffolds given in the `split_positions_file` and calling merge_bins. However,
+        only the bin intervals are loaded into memory while the matrix
+        values are read in blocks of rows and summed directly into the
+        reduced matrix. Thus, the memory depends on the size of the reduced matrix
+        and not on the size of the input matrix.
 
-                    start = end
+        Parameters
+        ----------
+        matrix_file : h5 matrix file name
+        matrix_bin_size : target bin size
+        split_positions_file : bed file with positions to split
+        row_block_size : number of rows to read at once
 
-            hic.setCutIntervals(new_intervals)
+        Returns
+        -------
+        HiCMatrix object
+        """
+        log.info("Reading matrix {} by blocks of {} rows".format(matrix_file, row_block_size))
+        cut_intervals, nan_bins = HiCAssembler.read_h5_intervals(matrix_file)
+        keep_bins = np.ones(len(cut_intervals), dtype=bool)
 
+        if split_positions_file is not None:
+            bin_index = BinIndex(cut_intervals)
+            bin_ids, bins_to_remove = HiCAssembler.get_split_file_bins(split_positions_file, bin_index)
+            cut_intervals, num_splits = HiCAssembler.split_cut_intervals(cut_intervals, bin_index.chrom_bin_boundaries,
+                                                                         bin_ids)
+            del bin_index
+            log.info("{} misassemblies were removed".format(num_splits))
+            if len(bins_to_remove) > 0:
+                log.info("{} bins will be removed from the matrix because they are contained within the split "
+                         "regions.".format(len(bins_to_remove)))
+                keep_bins[bins_to_remove] = False
+
+        # same as HiCMatrix.getBinSize after the bins within the split regions are removed
+        binsize = int(np.median(np.diff(cut_intervals.start[keep_bins])))
+        num_bins = max(1, matrix_bin_size / binsize)
+        if binsize < matrix_bin_size:
+            log.info("Reducing matrix size to {:,} bp (number of bins merged: {})".format(binsize, num_bins))
+            # nan bins are removed before merging the bins (see hicMergeMatrixBins.remove_nans_if_needed)
+            keep_bins[nan_bins] = False
+            kept_bin_ids = np.flatnonzero(keep_bins)
+            new_bins, kept_map = HiCAssembler.get_merged_bins(cut_intervals[kept_bin_ids], num_bins)
+        else:
+            kept_bin_ids = np.flatnonzero(keep_bins)
+            new_bins = cut_intervals[kept_bin_ids]
+            kept_map = np.arange(len(kept_bin_ids))
+        del cut_intervals
+
+        map_ = np.repeat(-1, len(keep_bins))
+        map_[kept_bin_ids] = kept_map
+
+        hic = HiCMatrix.hiCMatrix()
+        hic.setMatrix(HiCAssembler.reduce_h5_matrix(matrix_file, map_, len(new_bins), row_block_size=row_block_size),
+                      new_bins)
+        if binsize < matrix_bin_size:
+            hic.nan_bins = np.flatnonzero(hic.matrix.sum(0).A == 0)
+        else:
+            is_nan_bin = np.zeros(len(keep_bins), dtype=bool)
+            is_nan_bin[nan_bins] = True
+            hic.nan_bins = np.flatnonzero(is_nan_bin[kept_bin_ids])
         return hic
 
+    @staticmethod
+    def get_bins_to_merge(chrom_list, num_bins, skip_small=True):
+        """
+        Groups consecutive bins that belong to the same chromosome (or scaffold)
+        into groups of `num_bins`. The grouping is computed using run-length logic
+        over the chromosome codes, thus no python loop over the bins is needed.
+
+        Parameters
+        ----------
+        chrom_list : list or array with the chromosome name (or chromosome code) of each bin
+        num_bins : number of consecutive bins to merge
+        skip_small : if True, groups having less than num_bins / 2 bins are skipped.
+
+        Returns
+        -------
+        tuple: (group_start, group_end, keep) where group_start and group_end are the
+        start (inclusive) and end (exclusive) indices of each group and keep is a
+        boolean array that is False for skipped groups.
+
+        >>> start, end, keep = HiCAssembler.get_bins_to_merge(['a', 'a', 'a', 'a', 'a', 'b', 'c', 'c'], 2)
+        >>> start
+        array([0, 2, 4, 5, 6])
+        >>> end
+        array([2, 4, 5, 6, 8])
+        >>> keep
+        array([ True,  True,  True,  True,  True])
+        >>> start, end, keep = HiCAssembler.get_bins_to_merge(['a', 'a', 'a', 'a', 'a', 'b', 'c', 'c'], 4)
+        >>> start
+        array([0, 4, 5, 6])
+        >>> keep
+        array([ True, False, False,  True])
+        """
+        num_total = len(chrom_list)
+        # find the positions where the chromosome changes. Those are the
+        # start of each run of bins belonging to the same chromosome
+        chrom_list = np.asarray(chrom_list)
+        run_start = np.concatenate([[0], np.flatnonzero(chrom_list[1:] != chrom_list[:-1]) + 1])
+        run_end = np.concatenate([run_start[1:], [num_total]])
+
+        # each run (same chromosome) is split into chunks of num_bins
+        num_chunks = (run_end - run_start + num_bins - 1) // num_bins
+        run_idx = np.repeat(np.arange(len(run_start)), num_chunks)
+        chunk_idx = np.arange(num_chunks.sum()) - np.repeat(np.cumsum(num_chunks) - num_chunks, num_chunks)
+        group_start = run_start[run_idx] + chunk_idx * num_bins
+        group_end = np.minimum(group_start + num_bins, run_end[run_idx])
+
+        if skip_small is True:
+            keep = (group_end - group_start) >= num_bins / 2
+        else:
+            keep = np.ones(len(group_start), dtype=bool)
+
+        return group_start, group_end, keep
+
+    @staticmethod
+    def reduce_matrix_by_mapping(matrix, map_, num_merged_bins):
+        """
+        Equivalent to hicexplorer.reduceMatrix.reduce_matrix(matrix, bins_to_merge, diagonal=True)
+        but using an array that maps each bin to its merged bin id (or -1 to
+        remove the bin) instead of a list of lists (see BinPartition.reduce_matrix).
+
+        >>> from scipy.sparse import csr_matrix
+        >>> A = csr_matrix(np.array([[2, 2, 1], [2, 2, 1], [1, 1, 1]]), dtype=np.int32)
+        >>> HiCAssembler.reduce_matrix_by_mapping(A, np.array([0, 0, 1]), 2).todense()
+        matrix([[6, 2],
+                [2, 1]], dtype=int32)
+        >>> HiCAssembler.reduce_matrix_by_mapping(A, np.array([-1, 0, 0]), 1).todense()
+        matrix([[4]], dtype=int32)
+        """
+        if num_merged_bins == matrix.shape[0] and np.all(map_ == np.arange(matrix.shape[0])):
+            return matrix
+        return BinPartition(map_, num_merged_bins).reduce_matrix(matrix)
+
+    @staticmethod
+    def get_merged_bins(cut_intervals, num_bins, skip_small=True):
+        """
+        Computes the intervals of the merged bins and the mapping
+        from the original bins to the merged bins.
+
+        Parameters
+        ----------
+        cut_intervals : list of (name, start, end, coverage) tuples or IntervalTable
+        num_bins : number of consecutive bins to merge.
+        skip_small : if True, groups of bins having less than num_bins / 2 bins are removed.
+
+        Returns
+        -------
+        tuple (new_bins, mapping) where new_bins is an IntervalTable and mapping is an integer array
+        containing the merged bin id for each of the original bins (-1 for removed bins).
+
+        >>> cut_intervals = [('a', 0, 10, 0.5), ('a', 10, 20, 1), ('a', 20, 30, 1.5), ('b', 30, 40, 1)]
+        >>> new_bins, mapping = HiCAssembler.get_merged_bins(cut_intervals, 4)
+        >>> new_bins.to_list(), mapping
+        ([('a', 0, 30, 1.0)], array([ 0,  0,  0, -1]))
+        """
+        table = IntervalTable.from_intervals(cut_intervals)
+        group_start, group_end, keep = HiCAssembler.get_bins_to_merge(table.chrom_codes, num_bins,
+                                                                      skip_small=skip_small)
+        for idx in np.flatnonzero(~keep):
+            sys.stderr.write("{} has few bins ({}). Skipping it\n".format(table[group_start[idx]][0],
+                                                                          group_end[idx] - group_start[idx]))
+
+        mapping = np.repeat(np.where(keep, np.cumsum(keep) - 1, -1), group_end - group_start)
+        coverage = BinPartition(mapping, np.sum(keep)).mean(table.coverage)
+
+        group_start = group_start[keep]
+        group_end = group_end[keep]
+        new_bins = IntervalTable(table.chrom_codes[group_start], table.chrom_names, table.start[group_start],
+                                 table.end[group_end - 1], coverage)
+
+        return new_bins, mapping
+
     @staticmethod
     def merge_bins(hic, num_bins, skip_small=True, return_bin_id_mapping=False):
         """
@@ -1278,6 +2030,12 @@ class HiCAssembler:
 
         num_bins : number of consecutive bins to merge.
 
+        skip_small : if True, groups of bins at the end of a scaffold that
+                     have less than num_bins / 2 bins are removed.
+
+        return_bin_id_mapping : if True, an integer array mapping each
+                      old bin id to the merged bin id is also returned. Removed
+                      bins are mapped to -1.
         Returns
         -------
 
@@ -1306,64 +2064,26 @@ class HiCAssembler:
 
         run merge_matrix
         >>> merge_matrix, map_id = HiCAssembler.merge_bins(hic, 2, return_bin_id_mapping=True)
-        >>> merge_matrix.cut_intervals
-        [('a', 0, 20, 0.75), ('a', 20, 40, 0.55000000000000004), ('b', 40, 50, 1.0)]
+        >>> [x[:3] for x in merge_matrix.cut_intervals.to_list()]
+        [('a', 0, 20), ('a', 20, 40), ('b', 40, 50)]
+
+        the coverage of the merged bins is the mean coverage of the bins
+        >>> np.allclose(merge_matrix.cut_intervals.coverage, [0.75, 0.55, 1.0])
+        True
         >>> merge_matrix.matrix.todense()
         matrix([[120,  28,   1],
                 [ 28, 177,   4],
                 [  1,   4, 100]], dtype=int32)
         >>> map_id
-        {0: 0, 1: 0, 2: 1, 3: 1, 4: 2}
+        array([0, 0, 1, 1, 2])
         """
 
         hic = hicexplorer.hicMergeMatrixBins.remove_nans_if_needed(hic)
-        # get the bins to merge
-        ref_name_list, start_list, end_list, coverage_list = zip(*hic.cut_intervals)
-        new_bins = []
-        bins_to_merge = []
-        prev_ref = ref_name_list[0]
-
-        # prepare new intervals
-        idx_start = 0
-        new_start = start_list[0]
-        count = 0
-        merge_bin_id = 0
-        mapping_old_to_merged_bin_ids = {}
-        for idx, ref in enumerate(ref_name_list):
-            if (count > 0 and count % num_bins == 0) or ref != prev_ref:
-                if skip_small is True and count < num_bins / 2:
-                    sys.stderr.write("{} has few bins ({}). Skipping it\n".format(prev_ref, count))
-                else:
-                    coverage = np.mean(coverage_list[idx_start:idx])
-                    new_end = end_list[idx - 1]
-                    if new_start > new_end:
-                        sys.stderr.write("end of new merged bin is smaller than start")
-                    new_bins.append((ref_name_list[idx_start], new_start, end_list[idx - 1], coverage))
-                    bins_to_merge.append(list(range(idx_start, idx)))
-                    for old_bin_id in list(range(idx_start, idx)):
-                        mapping_old_to_merged_bin_ids[old_bin_id] = merge_bin_id
-                    merge_bin_id += 1
-                idx_start = idx
-                new_start = start_list[idx]
-                count = 0
-
-            prev_ref = ref
-            count += 1
-
-        if skip_small is True and count < num_bins / 2:
-            sys.stderr.write("{} has few bins ({}). Skipping it\n".format(prev_ref, count))
-        else:
-            coverage = np.mean(coverage_list[idx_start:])
-            new_end = end_list[idx - 1]
-            if new_start > new_end:
-                sys.stderr.write("end of new merged bin is smaller than start")
-            new_bins.append((ref, new_start, end_list[idx], coverage))
-            bins_to_merge.append(list(range(idx_start, idx + 1)))
-            for old_bin_id in list(range(idx_start, idx + 1)):
-                mapping_old_to_merged_bin_ids[old_bin_id] = merge_bin_id
-            merge_bin_id += 1
-
-        hic.matrix = hicexplorer.hicMergeMatrixBins.reduce_matrix(hic.matrix, bins_to_merge, diagonal=True)
+        new_bins, mapping_old_to_merged_bin_ids = HiCAssembler.get_merged_bins(IntervalTable.from_hic(hic), num_bins,
+                                                                               skip_small=skip_small)
+
+        hic.matrix = HiCAssembler.reduce_matrix_by_mapping(hic.matrix, mapping_old_to_merged_bin_ids,
+                                                           len(new_bins))
         hic.matrix.eliminate_zeros()
         hic.setCutIntervals(new_bins)
         hic.nan_bins = np.flatnonzero(hic.matrix.sum(0).A == 0)
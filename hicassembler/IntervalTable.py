@@ -0,0 +1,163 @@
+import numpy as np
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger("IntervalTable")
+
+
+class IntervalTable(object):
+    """
+    Columnar representation of the bins of a Hi-C matrix (the `cut_intervals` of a
+    HiCMatrix object). Instead of a list of (name, start, end, coverage) tuples,
+    the bins are kept as arrays: an integer code per bin for the scaffold name (the names
+    are stored only once in `chrom_names`), and start, end and coverage arrays.
+
+    The table is kept as the `cut_intervals` of the HiCMatrix objects (see `from_hic`). For
+    code that expects the list of tuples (e.g. the HiCMatrix methods), the table can be indexed and
+    iterated as the list (an integer index returns a tuple) and `to_list()` returns the list of tuples.
+
+    Examples
+    --------
+    >>> table = IntervalTable.from_intervals([('a', 0, 10, 1), ('a', 10, 20, 0.5), ('b', 0, 10, 1)])
+    >>> len(table)
+    3
+    >>> table[1]
+    ('a', 10, 20, 0.5)
+    >>> table.chrom_names, table.chrom_codes
+    (['a', 'b'], array([0, 0, 1], dtype=int32))
+    >>> table[1:].to_list()
+    [('a', 10, 20, 0.5), ('b', 0, 10, 1.0)]
+    >>> [x[0] for x in table]
+    ['a', 'a', 'b']
+    """
+
+    def __init__(self, chrom_codes, chrom_names, start, end, coverage=None):
+        self.chrom_codes = np.asarray(chrom_codes, dtype=np.int32)
+        self.chrom_names = list(chrom_names)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        if coverage is None:
+            coverage = np.ones(len(self.start))
+        self.coverage = np.asarray(coverage, dtype=float)
+
+    @classmethod
+    def from_arrays(cls, chrom, start, end, coverage=None):
+        """
+        Creates a table from the scaffold name of each bin and the start, end
+        and coverage arrays.
+
+        >>> IntervalTable.from_arrays(['b', 'b', 'a', 'b'], [0, 10, 0, 20], [10, 20, 10, 30]).chrom_codes
+        array([0, 0, 1, 0], dtype=int32)
+        """
+        chrom_codes, chrom_names = IntervalTable.encode(chrom)
+        return cls(chrom_codes, chrom_names, start, end, coverage)
+
+    @classmethod
+    def from_intervals(cls, cut_intervals):
+        """
+        Creates a table from a list of (name, start, end, coverage) tuples. If
+        `cut_intervals` is already an IntervalTable, the same object is returned.
+        """
+        if isinstance(cut_intervals, IntervalTable):
+            return cut_intervals
+        # list comprehensions are used because zip(*cut_intervals) is slow for millions of bins
+        return cls.from_arrays([x[0] for x in cut_intervals],
+                               np.fromiter((x[1] for x in cut_intervals), dtype=np.int64, count=len(cut_intervals)),
+                               np.fromiter((x[2] for x in cut_intervals), dtype=np.int64, count=len(cut_intervals)),
+                               np.fromiter((x[3] for x in cut_intervals), dtype=float, count=len(cut_intervals)))
+
+    @classmethod
+    def from_hic(cls, hic):
+        """
+        Returns the `cut_intervals` of the HiCMatrix object as a table. If they are a list
+        of tuples (as loaded by HiCMatrix or after HiCMatrix methods that remove or reorder bins),
+        the list is replaced by the table in the HiCMatrix object, such that only the table is kept.
+
+        >>> from hicexplorer import HiCMatrix
+        >>> from scipy.sparse import csr_matrix
+        >>> hic = HiCMatrix.hiCMatrix()
+        >>> hic.setMatrix(csr_matrix(np.eye(2)), [('a', 0, 10, 1), ('a', 10, 20, 1)])
+        >>> table = IntervalTable.from_hic(hic)
+        >>> hic.cut_intervals is table, IntervalTable.from_hic(hic) is table
+        (True, True)
+        """
+        if not isinstance(hic.cut_intervals, IntervalTable):
+            # the bins do not change, thus, the interval trees of hic are still valid
+            hic.cut_intervals = cls.from_intervals(hic.cut_intervals)
+        return hic.cut_intervals
+
+    @staticmethod
+    def encode(chrom):
+        """
+        Returns an integer code per name and the list of names (in order of appearance).
+        Only the positions where the name changes are looked up, thus, this is fast
+        when the bins of each scaffold are consecutive.
+
+        >>> IntervalTable.encode(['a', 'a', 'c', 'c', 'a'])
+        (array([0, 0, 1, 1, 0], dtype=int32), ['a', 'c'])
+        """
+        chrom = np.asarray(chrom)
+        if len(chrom) == 0:
+            return np.array([], dtype=np.int32), []
+        run_start = np.concatenate([[0], np.flatnonzero(chrom[1:] != chrom[:-1]) + 1])
+        names = []
+        name_to_code = {}
+        run_code = np.zeros(len(run_start), dtype=np.int32)
+        for idx, name in enumerate(chrom[run_start].tolist()):
+            if name not in name_to_code:
+                name_to_code[name] = len(names)
+                names.append(name)
+            run_code[idx] = name_to_code[name]
+        return np.repeat(run_code, np.diff(np.append(run_start, len(chrom)))), names
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, long, np.integer)):
+            return (self.chrom_names[self.chrom_codes[idx]], int(self.start[idx]), int(self.end[idx]),
+                    float(self.coverage[idx]))
+        return IntervalTable(self.chrom_codes[idx], self.chrom_names, self.start[idx], self.end[idx],
+                             self.coverage[idx])
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    @property
+    def chrom(self):
+        """ array with the scaffold name of each bin """
+        return np.array(self.chrom_names, dtype=object)[self.chrom_codes]
+
+    def to_list(self):
+        """
+        Returns the list of (name, start, end, coverage) tuples used by HiCMatrix.
+        """
+        names = self.chrom_names
+        return [(names[code], start, end, cov) for code, start, end, cov in
+                zip(self.chrom_codes.tolist(), self.start.tolist(), self.end.tolist(), self.coverage.tolist())]
+
+    def rename(self, chrom):
+        """
+        Returns a new table with the given scaffold name for each bin.
+        """
+        return IntervalTable.from_arrays(chrom, self.start, self.end, self.coverage)
+
+    def chrom_bin_boundaries(self):
+        """
+        Returns an OrderedDict of scaffold name: (first bin, last bin + 1). The bins of
+        each scaffold should be consecutive.
+
+        >>> table = IntervalTable.from_intervals([('a', 0, 10, 1), ('a', 10, 20, 1), ('b', 0, 10, 1)])
+        >>> table.chrom_bin_boundaries()
+        OrderedDict([('a', (0, 2)), ('b', (2, 3))])
+        """
+        codes = self.chrom_codes
+        run_start = np.concatenate([[0], np.flatnonzero(codes[1:] != codes[:-1]) + 1]) if len(codes) else []
+        run_end = np.append(run_start[1:], len(codes)) if len(codes) else []
+        boundaries = OrderedDict()
+        for start, end in zip(run_start, run_end):
+            name = self.chrom_names[codes[start]]
+            if name in boundaries:
+                raise ValueError("The bins of {} are not consecutive".format(name))
+            boundaries[name] = (int(start), int(end))
+        return boundaries
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import hashlib
+
+import logging
+log = logging.getLogger("MatrixCache")
+
+# bump this value whenever the preparation of the reduced matrix or the
+# parameters of the cache key change such that previously cached matrices are no longer valid.
+CACHE_VERSION = 3
+MAX_CACHE_ENTRIES = 5
+
+
+class MatrixCache(object):
+    """
+    Content addressed cache for the reduced (misassemblies split and bins merged)
+    Hi-C matrices. Each entry is keyed on the hash of the input matrix file and
+    all parameters that affect the reduced matrix. A small json manifest keeps
+    track of the entries and the least recently used entries are evicted once
+    more than `max_entries` are stored.
+
+    Examples
+    --------
+    >>> import tempfile, shutil
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> cache = MatrixCache(cache_dir, max_entries=2)
+    >>> key = cache.make_key({'bin_size': 25000, 'matrix': 'abc'})
+    >>> cache.get(key) is None
+    True
+
+    At least one entry (the matrix that was just saved) needs to be kept
+    >>> MatrixCache(cache_dir, max_entries=0)
+    Traceback (most recent call last):
+    ...
+    ValueError: The cache needs to keep at least one matrix (max_entries=0)
+    >>> shutil.rmtree(cache_dir)
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, cache_dir, max_entries=MAX_CACHE_ENTRIES):
+        if max_entries < 1:
+            raise ValueError("The cache needs to keep at least one matrix (max_entries={})".format(max_entries))
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.manifest_file = os.path.join(self.cache_dir, self.MANIFEST)
+        self.manifest = self._load_manifest()
+
+    @staticmethod
+    def file_digest(file_name, chunk_size=1 << 20):
+        """
+        Returns the sha1 hex digest of the content of the given file.
+
+        Examples
+        --------
+        >>> import tempfile
+        >>> fh = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+        >>> fh.write("chr1\\t10\\t20\\n")
+        >>> fh.close()
+        >>> MatrixCache.file_digest(fh.name)
+        'b721f9a11d2e462f27cd48dffb85c09599cf4b65'
+        >>> os.unlink(fh.name)
+        """
+        sha1 = hashlib.sha1()
+        with open(file_name, 'rb') as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    @staticmethod
+    def make_key(params):
+        """
+        Computes the cache key for a dictionary of parameters. The
+        key does not depend on the order of the dictionary entries.
+
+        Examples
+        --------
+        >>> MatrixCache.make_key({'a': 1, 'b': None}) == MatrixCache.make_key({'b': None, 'a': 1})
+        True
+        >>> MatrixCache.make_key({'a': 1}) == MatrixCache.make_key({'a': 2})
+        False
+        """
+        params = dict(params)
+        params['cache_version'] = CACHE_VERSION
+        return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+    def _load_manifest(self):
+        if not os.path.isfile(self.manifest_file):
+            return {}
+        try:
+            with open(self.manifest_file) as fh:
+                return json.load(fh)
+        except ValueError:
+            log.warn("Cache manifest {} is corrupted. Starting an empty cache.".format(self.manifest_file))
+            return {}
+
+    def _save_manifest(self):
+        # write to a temporary file first such that an interrupted run
+        # does not leave a truncated manifest behind
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, 'w') as fh:
+            json.dump(self.manifest, fh, indent=1, sort_keys=True)
+        os.rename(tmp_file, self.manifest_file)
+
+    def _entry_file(self, key):
+        return os.path.join(self.cache_dir, "{}.h5".format(key))
+
+    def get(self, key):
+        """
+        Returns the file name of the cached matrix for the given key, or None if
+        the key is not in the cache. The access time of the entry is updated.
+
+        Examples
+        --------
+        >>> import tempfile, shutil
+        >>> cache_dir = tempfile.mkdtemp()
+        >>> cache = MatrixCache(cache_dir)
+        >>> open(cache._entry_file('k1'), 'w').close()
+        >>> cache.add('k1', {'bin_size': 100})
+        >>> cache.get('k1') == cache._entry_file('k1')
+        True
+
+        If the file was removed, the entry is discarded
+        >>> os.unlink(cache._entry_file('k1'))
+        >>> cache.get('k1') is None
+        True
+        >>> shutil.rmtree(cache_dir)
+        """
+        if key not in self.manifest:
+            return None
+        entry_file = self._entry_file(key)
+        if not os.path.isfile(entry_file):
+            del self.manifest[key]
+            self._save_manifest()
+            return None
+        self.manifest[key]['last_used'] = time.time()
+        self._save_manifest()
+        return entry_file
+
+    def add(self, key, params):
+        """
+        Registers the file for the given key (which should already
+        be saved under `self._entry_file(key)`) and evicts the least recently used
+        entries if the cache is full.
+
+        Examples
+        --------
+        >>> import tempfile, shutil
+        >>> cache_dir = tempfile.mkdtemp()
+        >>> cache = MatrixCache(cache_dir, max_entries=2)
+        >>> for key in ['k1', 'k2', 'k3']:
+        ...     open(cache._entry_file(key), 'w').close()
+        ...     cache.add(key, {})
+        >>> sorted(cache.manifest.keys())
+        ['k2', 'k3']
+        >>> os.path.isfile(cache._entry_file('k1'))
+        False
+        >>> shutil.rmtree(cache_dir)
+        """
+        now = time.time()
+        self.manifest[key] = {'file': os.path.basename(self._entry_file(key)),
+                              'params': params,
+                              'created': now,
+                              'last_used': now}
+        self._evict()
+        self._save_manifest()
+
+    def save(self, key, hic, params):
+        """
+        Saves the given HiCMatrix object into the cache and returns the
+        file name of the entry.
+        """
+        entry_file = self._entry_file(key)
+        hic.save(entry_file)
+        self.add(key, params)
+        return entry_file
+
+    def _evict(self):
+        if len(self.manifest) <= self.max_entries:
+            return
+        # sort by access time, the ones used less recently first
+        # break ties using the key to keep the order stable
+        by_access = sorted(self.manifest.keys(), key=lambda k: (self.manifest[k]['last_used'], k))
+        for key in by_access[:len(self.manifest) - self.max_entries]:
+            log.info("Evicting cached matrix {} from {}".format(key, self.cache_dir))
+            entry_file = self._entry_file(key)
+            if os.path.isfile(entry_file):
+                os.unlink(entry_file)
+            del self.manifest[key]
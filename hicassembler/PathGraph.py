@@ -21,6 +21,10 @@ class PathGraph(object):
         self.path = {}
         self.path_id = {}  # maps nodes to paths
         self.adj = {}  # to store the edges
+        # sum of the 'length' attribute of the nodes of each path. It is
+        # updated when paths are added or deleted such that the length of the
+        # paths is available without iterating over their nodes
+        self.path_length = {}
 
     def __iter__(self):
         """Iterate over the nodes. Use the expression 'for n in S'.
@@ -169,6 +173,7 @@ class PathGraph(object):
             except AttributeError:
                 raise PathGraphException("The attr_dict argument must be a dictionary.")
 
+        prev_length = self.node[n].get('length', 0) if n in self.node else 0
         if n not in self.node:
             self.node[n] = attr_dict
             self.adj[n] = {}
@@ -186,6 +191,10 @@ class PathGraph(object):
 
             self.path_id[n] = path_id
 
+        # keep the length of the path updated
+        if 'length' in attr_dict and n in self.path_id and self.path_id[n] in self.path_length:
+            self.path_length[self.path_id[n]] += self.node[n]['length'] - prev_length
+
     def delete_node(self, n):
         """
         Remove node n.
@@ -311,6 +320,7 @@ class PathGraph(object):
         # add nodes
         for node in nlist:
             self.add_node(node, path_id=path_id)
+        self.path_length[path_id] = sum([self.node[node].get('length', 0) for node in nlist])
 
         for i in range(len(nlist)-1):
             u = nlist[i]
@@ -536,6 +546,7 @@ class PathGraph(object):
         if len(self.path[path_id]) == 1:
             assert self.adj[n] == {}
             del self.path[n]
+            self.path_length.pop(n, None)
             return
 
         idx_n = self.path[path_id].index(n)
@@ -686,6 +697,7 @@ class PathGraph(object):
                     del self.node[_n]
                     del self.adj[_n]
             del self.path[path_id]
+            del self.path_length[path_id]
 
     def merge_paths(self, paths):
         """
@@ -708,6 +720,52 @@ class PathGraph(object):
 
         self.add_path(merged_path)
 
+    def get_path_length(self, n):
+        """
+        Returns the length of the path containing node n, which is
+        the sum of the 'length' attribute of its nodes.
+
+        >>> S = PathGraph()
+        >>> S.add_node(0, length=10, name='a')
+        >>> S.add_node(1, length=20, name='a')
+        >>> S.add_node(2, length=5, name='b')
+        >>> S.get_path_length(0)
+        10
+        >>> S.add_path([0, 1])
+        >>> S.get_path_length(0)
+        30
+        >>> S.add_edge(1, 2)
+        >>> S.get_path_length(2)
+        35
+        >>> S.delete_edge(0, 1)
+        >>> S.get_path_length(0), S.get_path_length(1)
+        (10, 25)
+        >>> S.add_node(1, length=40)
+        >>> S.get_path_length(2)
+        45
+        """
+        if n in self.path_id:
+            return self.path_length[self.path_id[n]]
+        return self.node[n].get('length', 0)
+
+    def get_paths_length(self):
+        """
+        Returns a list with the length of all paths. Nodes that
+        do not belong to a path are considered as paths of one node.
+
+        >>> S = PathGraph()
+        >>> S.add_node(0, length=10)
+        >>> S.add_node(1, length=20)
+        >>> S.add_node(2, length=5)
+        >>> S.add_path([0, 1])
+        >>> sorted(S.get_paths_length())
+        [5, 30]
+        """
+        lengths = self.path_length.values()
+        if len(self.path_id) < len(self.node):
+            lengths += [attr.get('length', 0) for node, attr in self.node.iteritems() if node not in self.path_id]
+        return lengths
+
     def get_all_paths(self):
         """Returns all paths in the graph.
         This is similar to get connected components in networkx
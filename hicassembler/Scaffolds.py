@@ -1,13 +1,17 @@
 from collections import OrderedDict
 import copy
 import numpy as np
-from scipy.sparse import csr_matrix, lil_matrix, triu
+from scipy.sparse import csr_matrix, coo_matrix, lil_matrix, triu
 import logging
 import time
 import hicexplorer.HiCMatrix as HiCMatrix
 from hicassembler.PathGraph import PathGraph, PathGraphEdgeNotPossible, PathGraphException
+from hicassembler.IntervalTable import IntervalTable
+from hicassembler.BinPartition import BinPartition
+from hicassembler.SpanningTree import SpanningTree
+from hicassembler.BandwidthScore import BandwidthScore, MAX_PATHS_EXHAUSTIVE_ORIENTATION, MAX_PATHS_EXHAUSTIVE_ORDER, \
+    MAX_SEARCH_EVALUATIONS
 
-from hicexplorer.reduceMatrix import reduce_matrix
 from hicexplorer.iterativeCorrection import iterativeCorrection
 from functools import wraps
 import itertools
@@ -52,12 +56,16 @@ class Scaffolds(object):
 
 
     """
-    def __init__(self, hic_matrix, out_folder=None):
+    def __init__(self, hic_matrix, out_folder=None, dtype=np.float64, save_graphml=False):
         """
 
         Parameters
         ----------
         cut_intervals
+        dtype : floating point type of the matrices derived from hic_matrix (e.g. the normalized
+                reduced matrices). Use np.float32 to halve the memory used.
+        save_graphml : if True, the graph and the maximum spanning tree of each iteration are saved
+                       as graphml files in out_folder.
 
         Returns
         -------
@@ -71,6 +79,10 @@ class Scaffolds(object):
         # initialize the list of contigs as a graph with no edges
         self.hic = hic_matrix
         self.matrix = None  # will contain the reduced matrix
+        self.dtype = np.dtype(dtype)
+        self.save_graphml = save_graphml
+        # last reduced matrix computed by split_and_merge_contigs (see reduce_hic_matrix)
+        self.reduced = None
         self.total_length = None
         self.out_folder = '/tmp/' if out_folder is None else out_folder
         # three synchronized PathGraphs are used
@@ -139,54 +151,40 @@ class Scaffolds(object):
         {'direction': '+', 'end': 20, 'name': 'c-0', 'start': 0, 'length': 20, 'path': [0, 1]}
         """
 
-        def add_scaffold_node(name, path, length):
-            # prepare scaffold information
-            scaff_start = self.hic.cut_intervals[contig_path[0]][1]
-            scaff_end = self.hic.cut_intervals[contig_path[-1]][2]
-            #length = scaff_end - scaff_start
-            attr = {'name': prev_label,
-                    'path': contig_path[:],
-                    'length': length,
-                    'start': scaff_start,
-                    'end': scaff_end,
-                    'direction': "+"}
-            self.scaffold.add_node(prev_label, **attr)
-
-        contig_path = []
-        prev_label = None
         self.matrix = self.hic.matrix.copy()
         self.matrix_bins = PathGraph()
         self.scaffold = PathGraph()
         self.bin_id_to_scaff = OrderedDict()
-        self.total_length = 0
-        scaff_length = 0
-        for idx, interval in enumerate(self.hic.cut_intervals):
-            label, start, end, coverage = interval
-            length = end - start
-            if prev_label is not None and prev_label != label:
-                self.matrix_bins.add_path(contig_path, name=prev_label)
-                add_scaffold_node(prev_label, contig_path, scaff_length)
-                contig_path = []
-                scaff_length = 0
-
-            scaff_length += length
-            attr = {'name': label,
-                    'start': start,
-                    'end': end,
-                    'coverage': coverage,
-                    'length': length}
-
-            self.matrix_bins.add_node(idx, **attr)
-            self.bin_id_to_scaff[idx] = label
-            self.total_length += length
-            contig_path.append(idx)
-            prev_label = label
-        if prev_label is not None:
-            add_scaffold_node(prev_label, contig_path, scaff_length)
-
-        if len(contig_path) > 1:
+
+        table = IntervalTable.from_hic(self.hic)
+        starts = table.start.tolist()
+        ends = table.end.tolist()
+        coverages = table.coverage.tolist()
+        lengths = (table.end - table.start).tolist()
+        self.total_length = sum(lengths)
+        for label, (first_bin, last_bin) in table.chrom_bin_boundaries().iteritems():
+            contig_path = range(first_bin, last_bin)
+            for idx in contig_path:
+                attr = {'name': label,
+                        'start': starts[idx],
+                        'end': ends[idx],
+                        'coverage': coverages[idx],
+                        'length': lengths[idx]}
+
+                self.matrix_bins.add_node(idx, **attr)
+                self.bin_id_to_scaff[idx] = label
+
             self.matrix_bins.add_path(contig_path, name=label)
 
+            # prepare scaffold information
+            attr = {'name': label,
+                    'path': contig_path[:],
+                    'length': sum(lengths[first_bin:last_bin]),
+                    'start': starts[first_bin],
+                    'end': ends[last_bin - 1],
+                    'direction': "+"}
+            self.scaffold.add_node(label, **attr)
+
         # before any merge is done, pg_base == pg_matrix.bins
         self.pg_base = copy.deepcopy(self.matrix_bins)
 
@@ -233,14 +231,8 @@ class Scaffolds(object):
         >>> S.get_assembly_length()
         (60, 3)
         """
-        assembly_length = 0
-        paths_total = 0
-        for path in self.scaffold.get_all_paths():
-            paths_total += 1
-            length = sum([self.scaffold.node[x]['length'] for x in path])
-            assembly_length += length
-
-        return assembly_length, paths_total
+        paths_length = self.scaffold.get_paths_length()
+        return sum(paths_length), len(paths_length)
 
     def remove_small_paths(self, min_length, split_scaffolds=False):
         """
@@ -282,7 +274,7 @@ class Scaffolds(object):
         >>> list(S.removed_bins.get_all_paths())
         [[3, 4], [5]]
         >>> S.removed_bins.node[5]
-        {'end': 10, 'name': 'c-3', 'start': 0, 'length': 10, 'coverage': 1}
+        {'end': 10, 'name': 'c-3', 'start': 0, 'length': 10, 'coverage': 1.0}
 
         Test removal of bins and scaffold when two scaffolds are already merged
         >>> cut_intervals = [('c-0', 0, 10, 1), ('c-0', 10, 20, 1), ('c-0', 20, 50, 1),
@@ -314,10 +306,10 @@ class Scaffolds(object):
         paths_list = list(self.matrix_bins.get_all_paths())
         for path in paths_list:
             paths_total += 1
-            length = (sum([self.matrix_bins.node[x]['length'] for x in path]))
+            length = self.matrix_bins.get_path_length(path[0])
 
             if length <= min_length:
-                log.debug("Removing path {}, length {}".format(self.matrix_bins.get_path_name_of_node(x), length))
+                log.debug("Removing path {}, length {}".format(self.matrix_bins.get_path_name_of_node(path[0]), length))
                 self._remove_bin_path(path, split_scaffolds=split_scaffolds)
                 to_remove.extend(path)
                 to_remove_paths.append(path)
@@ -520,11 +512,11 @@ class Scaffolds(object):
 
         for path in self.get_all_paths():
             paths_total += 1
-            length = (sum([self.matrix_bins.node[x]['length'] for x in path]))
+            length = self.matrix_bins.get_path_length(path[0])
             length_total += length
 
             if length <= min_length:
-                log.debug("Removing path {}, length {}".format(self.matrix_bins.get_path_name_of_node(x), length))
+                log.debug("Removing path {}, length {}".format(self.matrix_bins.get_path_name_of_node(path[0]), length))
                 to_remove.extend(path)
                 to_remove_paths.append(path)
                 removed_length_total += length
@@ -541,8 +533,12 @@ class Scaffolds(object):
             self._init_path_graph()
 
     def get_paths_length(self):
-        for path in self.get_all_paths():
-            yield (sum([self.matrix_bins.node[x]['length'] for x in path]))
+        """
+        Yields the length of all paths. The lengths are kept
+        updated by the matrix_bins PathGraph (see PathGraph.get_paths_length).
+        """
+        for length in self.matrix_bins.get_paths_length():
+            yield length
 
     def get_paths_stats(self):
         import matplotlib.pyplot as plt
@@ -614,7 +610,8 @@ class Scaffolds(object):
 
         return length[i]
 
-    def split_and_merge_contigs(self, num_splits=3, target_size=None,  normalize_method=['mean', 'ice', 'none'][0]):
+    def split_and_merge_contigs(self, num_splits=3, target_size=None,  normalize_method=['mean', 'ice', 'none'][0],
+                                incremental=True):
         """
         Splits each contig/scaffold into `num_splits` parts and creates
         a new reduced matrix with the slitted paths. The merge data is kept
@@ -626,6 +623,8 @@ class Scaffolds(object):
         target_size overrides num_splits. Instead, the num_splits is computed based on the target size.
         normalize_method after the contigs are split, the individual bins that constitute each split are merged and
                         subsequently normalized using the given method. Default is 'mean'
+        incremental if True, the values of the splits that did not change since the previous call are
+                    taken from the previous reduced matrix (see reduce_hic_matrix).
 
         Returns
         -------
@@ -745,7 +744,7 @@ class Scaffolds(object):
         for path in self.get_all_paths():
             if target_size is not None:
                 # define the number of splits based on the target size
-                length = sum([self.matrix_bins.node[x]['length'] for x in path])
+                length = self.matrix_bins.get_path_length(path[0])
                 if target_size <= length:
                     num_splits = length / target_size
                 else:
@@ -808,35 +807,180 @@ class Scaffolds(object):
 
         reduce_paths = paths_flatten[:]
 
-        reduced_matrix = reduce_matrix(self.hic.matrix, reduce_paths, diagonal=True)
+        reduced_matrix = self.reduce_hic_matrix(reduce_paths, incremental=incremental)
 
         if normalize_method == 'mean':
-            self.matrix = Scaffolds.normalize_by_mean(reduced_matrix, reduce_paths)
+            self.matrix = Scaffolds.normalize_by_mean(reduced_matrix, reduce_paths, dtype=self.dtype)
         elif normalize_method == 'ice':
-            self.matrix = Scaffolds.normalize_by_ice(reduced_matrix, reduce_paths)
+            self.matrix = Scaffolds.normalize_by_ice(reduced_matrix, reduce_paths, dtype=self.dtype)
         else:
-            self.matrix = reduced_matrix
+            # the matrix is modified by other methods while the reduced matrix is kept
+            self.matrix = reduced_matrix.copy()
 
         assert len(self.pg_base.node.keys()) == self.matrix.shape[0], "inconsistency error"
 
+    def reduce_hic_matrix(self, paths, incremental=True):
+        """
+        Reduces self.hic.matrix by merging the bins of each path as
+        hicexplorer.reduceMatrix.reduce_matrix(matrix, paths, diagonal=True).
+
+        The reduced matrix and the partition of the bins into paths are kept for the next call.
+        If `incremental` is True, only the paths that are not part of the previous reduced
+        matrix (e.g. because they were joined or split) are reduced from the rows of self.hic.matrix.
+        The values between the other paths are taken from the previous reduced matrix. If the
+        paths did not change, the previous reduced matrix is returned.
+
+        Parameters
+        ----------
+        paths : list of lists of bin ids
+        incremental : bool
+
+        Returns
+        -------
+        reduced matrix
+
+        Examples
+        --------
+        >>> hic = get_test_matrix()
+        >>> S = Scaffolds(hic)
+        >>> S.reduce_hic_matrix([[0], [1], [2], [3, 4]]).todense()
+        matrix([[ 2,  8,  5,  3],
+                [ 8,  8, 15,  6],
+                [ 5, 15,  0,  9],
+                [ 3,  6,  9,  1]])
+
+        Only the path (0, 1) needs to be reduced from the hic matrix
+        >>> S.reduce_hic_matrix([[3, 4], [0, 1], [2]]).todense()
+        matrix([[ 1,  9,  9],
+                [ 9, 18, 20],
+                [ 9, 20,  0]])
+        >>> from hicexplorer.reduceMatrix import reduce_matrix
+        >>> reduce_matrix(hic.matrix, [[3, 4], [0, 1], [2]], diagonal=True).todense()
+        matrix([[ 1,  9,  9],
+                [ 9, 18, 20],
+                [ 9, 20,  0]])
+        >>> S.reduce_hic_matrix([[3, 4], [0, 1], [2]]) is S.reduced['matrix']
+        True
+        """
+        paths = [tuple(x) for x in paths]
+        same_paths = self.reduced is not None and self.reduced['paths'] == paths
+        same_matrix = self.reduced is not None and self.reduced['hic_matrix'] is self.hic.matrix
+        if incremental and same_paths and same_matrix:
+            log.debug("The paths did not change. Reusing the reduced matrix")
+            return self.reduced['matrix']
+
+        prev_index = None
+        if incremental and same_matrix:
+            prev_index = np.array([self.reduced['index'].get(path, -1) for path in paths], dtype=np.int64)
+
+        if same_paths:
+            partition = self.reduced['partition']
+        else:
+            partition = BinPartition.from_paths(paths, self.hic.matrix.shape[0])
+        if prev_index is None or np.sum(prev_index >= 0) < len(paths) / 2:
+            # if most of the paths changed, is faster to reduce the whole matrix
+            reduced_matrix = partition.reduce_matrix(self.hic.matrix)
+        else:
+            log.debug("Reusing the reduced values of {} out of {} paths".format(np.sum(prev_index >= 0), len(paths)))
+            reduced_matrix = Scaffolds.update_reduced_matrix(self.hic.matrix, self.reduced['matrix'],
+                                                             partition, prev_index)
+
+        self.reduced = {'hic_matrix': self.hic.matrix,
+                        'paths': paths,
+                        'partition': partition,
+                        'matrix': reduced_matrix,
+                        'index': dict([(path, idx) for idx, path in enumerate(paths)])}
+        return reduced_matrix
+
+    @staticmethod
+    def update_reduced_matrix(matrix, prev_reduced, partition, prev_index):
+        """
+        Computes the matrix reduced by `paths` using the previous reduced matrix
+        for the paths that were already reduced. See reduce_hic_matrix.
+
+        Parameters
+        ----------
+        matrix : matrix to reduce
+        prev_reduced : previous reduced matrix
+        partition : BinPartition with a group per path
+        prev_index : the index of each path in `prev_reduced` or -1 if the path is new.
+
+        Returns
+        -------
+        reduced matrix. As in BinPartition.reduce_matrix, the sums of an integer matrix are returned
+        as int64 if they do not fit into its dtype.
+
+        >>> A = csr_matrix(np.array([[2, 2, 1, 1], [2, 2, 1, 1], [1, 1, 1, 1], [1, 1, 1, 1]]) * 2 ** 29,
+        ...                dtype=np.int32)
+        >>> prev_reduced = BinPartition.from_paths([[0, 1], [2], [3]], 4).reduce_matrix(A)
+        >>> reduced = Scaffolds.update_reduced_matrix(A, prev_reduced, BinPartition.from_paths([[0, 1], [2, 3]], 4),
+        ...                                           np.array([0, -1]))
+        >>> reduced.todense()
+        matrix([[3221225472, 2147483648],
+                [2147483648, 1610612736]])
+        """
+        num_paths = partition.num_groups
+        is_new = prev_index < 0
+        kept = np.flatnonzero(~is_new)
+
+        # values between paths already present in the previous reduced matrix
+        prev = prev_reduced[prev_index[kept], :][:, prev_index[kept]].tocoo()
+        rows = [kept[prev.row]]
+        cols = [kept[prev.col]]
+        data = [prev.data]
+
+        # reduce the rows of the bins in new paths
+        merged_id = partition.group_id
+        new_bins = np.flatnonzero(is_new[merged_id] & (merged_id > -1))
+        sub_m = matrix[new_bins, :].tocoo()
+        bin_row = new_bins[sub_m.row]
+        row = merged_id[bin_row]
+        col = merged_id[sub_m.col]
+        # as in reduce_matrix, the contacts within a path are counted once
+        keep = (col > -1) & ((row != col) | (bin_row <= sub_m.col))
+        row = row[keep]
+        col = col[keep]
+        values = sub_m.data[keep]
+        # the values between new and kept paths are added to both triangles
+        to_kept = ~is_new[col]
+        rows.extend([row, col[to_kept]])
+        cols.extend([col, row[to_kept]])
+        data.extend([values, values[to_kept]])
+
+        dtype = matrix.dtype
+        if np.issubdtype(dtype, np.integer):
+            # the previous values may already be int64, thus the sums are done as int64
+            dtype = np.int64
+        reduced = coo_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(num_paths, num_paths), dtype=dtype).tocsr()
+        if dtype != matrix.dtype and (reduced.nnz == 0 or np.abs(reduced.data).max() <= np.iinfo(matrix.dtype).max):
+            # the sums fit into the integer type of the matrix
+            reduced = reduced.astype(matrix.dtype)
+        return reduced
+
     @staticmethod
-    def normalize_by_mean(matrix, paths):
+    def normalize_by_mean(matrix, paths, dtype=np.float64):
+        """
+        Divides each value of the reduced matrix by the number of bins that were
+        merged into it, i.e. len(paths[row]) * len(paths[col]).
 
-        matrix = matrix.tocoo()
-        paths_len = [len(x) for x in paths]
-        # compute mean values for reduce matrix
-        new_data = np.zeros(len(matrix.data))
-        for index, value in enumerate(matrix.data):
-            row_len = paths_len[matrix.row[index]]
-            col_len = paths_len[matrix.col[index]]
-            new_data[index] = float(value) / (row_len * col_len)
+        >>> A = csr_matrix(np.array([[4, 2, 0], [2, 2, 3], [0, 3, 9]]))
+        >>> Scaffolds.normalize_by_mean(A, [[0, 1], [2], [3, 4, 5]]).todense().tolist()
+        [[1.0, 1.0, 0.0], [1.0, 2.0, 1.0], [0.0, 1.0, 1.0]]
+        """
+        matrix = matrix.tocsr()
+        paths_len = np.array([len(x) for x in paths], dtype=np.float64)
+        # the row of each value is obtained from the indptr array
+        row_len = np.repeat(paths_len[:matrix.shape[0]], np.diff(matrix.indptr))
+        col_len = paths_len[matrix.indices]
+        new_data = (matrix.data / (row_len * col_len)).astype(dtype, copy=False)
 
-        matrix.data = new_data
-        return matrix.tocsr()
+        return csr_matrix((new_data, matrix.indices.copy(), matrix.indptr.copy()), shape=matrix.shape)
 
     @staticmethod
-    def normalize_by_ice(matrix, paths):
-        return iterativeCorrection(matrix, M=1000, verbose=False)[0]
+    def normalize_by_ice(matrix, paths, dtype=np.float64):
+        # iterativeCorrection always returns a float64 matrix
+        return iterativeCorrection(matrix, M=1000, verbose=False)[0].astype(dtype, copy=False)
 
 #     @logit
 #     def merge_to_size(self, target_length=20000, reset_base_paths=True, normalize_method='ice'):
@@ -988,8 +1132,8 @@ class Scaffolds(object):
             return
 
         pg_base = PathGraph()
-        # this variable is to keep the hic object matrix in sync
-        cut_intervals = []
+        # these variables are to keep the hic object matrix in sync
+        names, starts, ends, coverages = [], [], [], []
         for path in self.get_all_paths():
             path_name = self.pg_base.get_path_name_of_node(path[0])
             for node in path:
@@ -1009,7 +1153,10 @@ class Scaffolds(object):
                 base_attr['initial_path'] = [node]
                 self.pg_base.add_node(node, attr_dict=base_attr)
                 pg_base.add_node(node, attr_dict=attr)
-                cut_intervals.append((attr['name'], attr['start'], attr['end'], attr['coverage']))
+                names.append(attr['name'])
+                starts.append(attr['start'])
+                ends.append(attr['end'])
+                coverages.append(attr['coverage'])
             pg_base.add_path(path, name=path_name)
 
         self.pg_base = pg_base
@@ -1017,7 +1164,7 @@ class Scaffolds(object):
 
         # reset the hic matrix object
         self.hic.matrix = self.matrix
-        self.hic.setCutIntervals(cut_intervals)
+        self.hic.setCutIntervals(IntervalTable.from_arrays(names, starts, ends, coverages))
 
     @staticmethod
     def split_path(path, num_parts):
@@ -1234,7 +1381,7 @@ class Scaffolds(object):
 
         return flanks
 
-    def get_stats_per_distance(self):
+    def get_stats_per_distance(self, max_paths=None, seed=0):
         """
         takes the information from all bins that are split
         or merged and returns two values and two vectors. The
@@ -1245,6 +1392,11 @@ class Scaffolds(object):
         The distances are 'bin' distance. Thus,
         if two bins are next to each other, they are at distance 1
 
+        Parameters
+        ----------
+        max_paths : if given, the stats are computed using a random sample of at most max_paths paths.
+        seed : seed for the random sample of paths
+
         Returns
         -------
         mean bin length, std bin length, dict containing as key the bin distance
@@ -1263,54 +1415,22 @@ class Scaffolds(object):
 
         """
         log.info("Computing stats per distance")
-
-        # get all paths (connected components) longer than 1
-        if len(self.pg_base.path) == 0:
-            raise ScaffoldException ("Print no paths found\n")
-
-        # use all paths to estimate distances
-        dist_dict = dict()
-        path_length = []
-        for count, path in enumerate(self.pg_base.path.values()):
-            if count > 200:
-                # otherwise too many computations will be made
-                # but 200 cases are enough to get
-                # an idea of the distribution of values
-                break
-            for n in path:
-                path_length.append(self.pg_base.node[n]['length'])
-
-            # take upper triangle of matrix containing selected path
-            sub_m = triu(self.matrix[path, :][:, path], k=1, format='coo')
-            # find counts that are one bin apart, two bins apart etc.
-            dist_list = sub_m.col - sub_m.row
-            # tabulate all values that correspond
-            # to distances
-            for distance in np.unique(dist_list):
-                if distance not in dist_dict:
-                    dist_dict[distance] = sub_m.data[dist_list == distance]
-                else:
-                    dist_dict[distance] = np.hstack([dist_dict[distance],
-                                                     sub_m.data[dist_list == distance]])
+        paths = self.get_paths_for_stats(max_paths, seed)
 
         # get mean and sd of the bin lengths
+        path_length = [self.pg_base.node[n]['length'] for path in paths for n in path]
         mean_path_length = np.mean(path_length)
         sd_path_length = np.std(path_length)
         log.info("Mean path length: {:.1f} sd: {:.1f}".format(mean_path_length, sd_path_length))
 
-        # consolidate data:
-        consolidated_dist_value = dict()
-        for k, v in dist_dict.iteritems():
-            consolidated_dist_value[k] = {'mean': np.mean(v),
-                                          'median': np.median(v),
-                                          'max': np.max(v),
-                                          'min': np.min(v),
-                                          'len': len(v)}
-            if len(v) < 10 and k < 15:
-                log.warn('stats for distance {} contain only {} samples'.format(k, len(v)))
+        distance, values = Scaffolds.get_contacts_per_distance(self.matrix, paths)
+        consolidated_dist_value = Scaffolds.summarize_by_distance(distance, values)
+        for k, v in consolidated_dist_value.iteritems():
+            if v['len'] < 10 and k < 15:
+                log.warn('stats for distance {} contain only {} samples'.format(k, v['len']))
         return mean_path_length, sd_path_length, consolidated_dist_value
 
-    def get_stats_per_split(self):
+    def get_stats_per_split(self, max_paths=None, seed=0):
         """
         takes the information from all bins that are split
         or merged and returns the a dictionary whose key is the distance between split bins
@@ -1319,6 +1439,11 @@ class Scaffolds(object):
         whose keys are: mean, median, max, min and len and reflect the mean, median etc number of contacts. The
         len is the number of samples that were used to derive the information.
 
+        Parameters
+        ----------
+        max_paths : if given, the stats are computed using a random sample of at most max_paths paths.
+        seed : seed for the random sample of paths
+
         Returns
         -------
         dictionary as explained previously
@@ -1342,47 +1467,109 @@ class Scaffolds(object):
 
         """
         log.info("Computing stats per distance")
+        paths = self.get_paths_for_stats(max_paths, seed)
+
+        distance, values = Scaffolds.get_contacts_per_distance(self.matrix, paths)
+        consolidated_dist_value = Scaffolds.summarize_by_distance(distance, values)
+        for k, v in consolidated_dist_value.iteritems():
+            if v['len'] < 10 and k < 10:
+                log.warn('stats for distance {} contain only {} samples'.format(k, v['len']))
+        return consolidated_dist_value
 
-        # get all paths (connected components) longer than 1
+    def get_paths_for_stats(self, max_paths=None, seed=0):
+        """
+        Returns the paths of self.pg_base used to compute the stats per distance: all paths
+        or, if max_paths is given, a random sample of max_paths paths.
+        """
         if len(self.pg_base.path) == 0:
-            raise ScaffoldException ("Print no paths found\n")
-
-        # use all paths to estimate distances
-        dist_dict = dict()
-        for count, path in enumerate(self.pg_base.path.values()):
-            if count > 200:
-                # otherwise too many computations will be made
-                # but 200 cases are enough to get
-                # an idea of the distribution of values
-                break
+            raise ScaffoldException("Print no paths found\n")
 
-            # take upper triangle of matrix containing selected path
-            sub_m = triu(self.matrix[path, :][:, path], k=1, format='coo')
-            # find counts that are one bin apart, two bins apart etc.
-            dist_list = sub_m.col - sub_m.row
-            # tabulate all values that correspond
-            # to distances
-            for distance in np.unique(dist_list):
-                if distance not in dist_dict:
-                    dist_dict[distance] = sub_m.data[dist_list == distance]
-                else:
-                    dist_dict[distance] = np.hstack([dist_dict[distance], sub_m.data[dist_list == distance]])
+        paths = self.pg_base.path.values()
+        if max_paths is not None and len(paths) > max_paths:
+            sample = np.random.RandomState(seed).choice(len(paths), max_paths, replace=False)
+            paths = [paths[idx] for idx in np.sort(sample)]
+            log.debug("Using {} out of {} paths to compute stats".format(max_paths, len(self.pg_base.path)))
+        return paths
+
+    @staticmethod
+    def get_contacts_per_distance(matrix, paths):
+        """
+        Returns, for all pairs of bins in the same path, the distance between the bins
+        (the difference of their positions in the path) and their number of contacts. Only
+        the non zero values of the matrix are considered.
+
+        All non zero values are labeled at once with the path and the position in the path
+        of their row and col, instead of slicing the matrix for each path.
+
+        Parameters
+        ----------
+        matrix : symmetric sparse matrix
+        paths : list of lists of bin ids
+
+        Returns
+        -------
+        distance, values arrays
+
+        Examples
+        --------
+        >>> from scipy.sparse import csr_matrix
+        >>> A = csr_matrix(np.array([[1, 8, 5, 3],
+        ...                          [8, 1, 0, 7],
+        ...                          [5, 0, 1, 9],
+        ...                          [3, 7, 9, 1]]))
+        >>> Scaffolds.get_contacts_per_distance(A, [[0, 2, 1], [3]])
+        (array([2, 1]), array([8, 5]))
+        """
+        partition = BinPartition.from_paths(paths, matrix.shape[0])
+        path_len = np.array([len(x) for x in paths], dtype=np.int64)
+        position = np.zeros(matrix.shape[0], dtype=np.int64)
+        if len(paths):
+            path_start = np.cumsum(path_len) - path_len
+            position[np.concatenate([np.asarray(x, dtype=np.int64) for x in paths])] = \
+                np.arange(path_len.sum()) - np.repeat(path_start, path_len)
+
+        ma = matrix.tocoo()
+        group_id = partition.group_id
+        distance = position[ma.col] - position[ma.row]
+        keep = (group_id[ma.row] > -1) & (group_id[ma.row] == group_id[ma.col]) & (distance > 0)
+        return distance[keep], ma.data[keep]
+
+    @staticmethod
+    def summarize_by_distance(distance, values):
+        """
+        Computes the mean, median, max, min and number of values for each distance
+        using a single sort of the values by distance.
+
+        >>> Scaffolds.summarize_by_distance(np.array([1, 2, 1, 1]), np.array([4, 2, 1, 2]))[1]
+        {'max': 4, 'min': 1, 'median': 2.0, 'len': 3, 'mean': 2.3333333333333335}
+        """
+        if len(distance) == 0:
+            return dict()
+        # sort by distance and then by value, such that the medians
+        # are the middle values of each distance
+        order = np.lexsort((values, distance))
+        distance = distance[order]
+        values = values[order]
+        first = np.concatenate([[0], np.flatnonzero(np.diff(distance)) + 1])
+        counts = np.diff(np.append(first, len(distance)))
+        sums = np.add.reduceat(values.astype(np.float64), first)
+        median = (values[first + (counts - 1) // 2] + values[first + counts // 2]) / 2.0
+        max_values = np.maximum.reduceat(values, first)
+        min_values = np.minimum.reduceat(values, first)
 
-        # consolidate data:
         consolidated_dist_value = dict()
-        for k, v in dist_dict.iteritems():
-            consolidated_dist_value[k] = {'mean': np.mean(v),
-                                          'median': np.median(v),
-                                          'max': np.max(v),
-                                          'min': np.min(v),
-                                          'len': len(v)}
-            if len(v) < 10 and k < 10:
-                log.warn('stats for distance {} contain only {} samples'.format(k, len(v)))
+        for idx, dist in enumerate(distance[first]):
+            consolidated_dist_value[dist] = {'mean': sums[idx] / counts[idx],
+                                             'median': median[idx],
+                                             'max': max_values[idx],
+                                             'min': min_values[idx],
+                                             'len': counts[idx]}
         return consolidated_dist_value
 
     @staticmethod
     def find_best_permutation(ma, paths, return_all_sorted_best_paths=False, list_of_permutations=None,
-                              only_expand_but_not_permute=False):
+                              only_expand_but_not_permute=False, max_evaluations=MAX_SEARCH_EVALUATIONS,
+                              search_stats=None):
         """
         Computes de bandwidth(bw) for all permutations of rows (and, because
         the matrix is symmetric of cols as well).
@@ -1397,7 +1584,16 @@ class Scaffolds(object):
         paths: list of paths, containing paths that should not be reorder
         only_expand_but_not_permute : if false, a permutation of the path is done and a expansion that
                                       flips each path direction is also carried out. Setting to false, only
-                                      the flipping is done but not the permutation
+                                      the flipping is done but not the permutation. In this case, unless
+                                      all sorted paths are requested, the best orientation of each path
+                                      is computed directly (see BandwidthScore.best_orientation) when more than
+                                      MAX_PATHS_EXHAUSTIVE_ORIENTATION paths can be flipped.
+        max_evaluations : when the paths are permuted and there are more than MAX_PATHS_EXHAUSTIVE_ORDER paths,
+                          the best permutation is searched using branch and bound (see
+                          BandwidthScore.best_arrangement) instead of evaluating all permutations.
+                          If this number of evaluations is reached, the best permutation found so far is returned.
+        search_stats : dictionary to count the number of branch and bound searches ('searches') and how many of them
+                       returned a permutation that is proven to be the best ('optimal').
         Returns
         -------
         path
@@ -1415,41 +1611,65 @@ class Scaffolds(object):
         [[2], [3, 4]]
         >>> Scaffolds.find_best_permutation(A, [[2],[3],[4]])
         [[3], [2], [4]]
-        """
-        indices = sum(paths, [])
-        ma = ma[indices, :][:, indices]
-        ma.setdiag(0)
-        # mapping from 'indices' to new matrix id
-        mapping = dict([(val, idx) for idx, val in enumerate(indices)])
-        bw_value = []
-        perm_list = []
+        >>> B = A + A.T
+        >>> Scaffolds.find_best_permutation(B, [[1, 0], [2], [4, 3]], only_expand_but_not_permute=True)
+        [[0, 1], [2], [3, 4]]
+
+        For more than MAX_PATHS_EXHAUSTIVE_ORDER paths, branch and bound is used
+        >>> C = csr_matrix(np.array(
+        ... [[0, 3, 2, 1, 0, 0],
+        ...  [3, 0, 3, 2, 1, 0],
+        ...  [2, 3, 0, 3, 2, 1],
+        ...  [1, 2, 3, 0, 3, 2],
+        ...  [0, 1, 2, 3, 0, 3],
+        ...  [0, 0, 1, 2, 3, 0]]))
+        >>> stats = {}
+        >>> Scaffolds.find_best_permutation(C, [[3], [0], [5, 4], [1], [2]], search_stats=stats)
+        [[0], [1], [2], [3], [4, 5]]
+        >>> sorted(stats.items())
+        [('optimal', 1), ('searches', 1)]
+        """
+        # the bandwidth of each candidate is computed from the contacts between the paths,
+        # which are extracted from the matrix only once (see BandwidthScore). For small sets of paths,
+        # all candidates are scored at once using a dense array of the contacts.
+        score = BandwidthScore(ma, paths)
+        if only_expand_but_not_permute and list_of_permutations is None and not return_all_sorted_best_paths and \
+                sum([1 for x in paths if len(x) > 1]) > MAX_PATHS_EXHAUSTIVE_ORIENTATION:
+            order = range(len(paths))
+            return score.get_paths(order, score.best_orientation(order))
+
+        if not only_expand_but_not_permute and list_of_permutations is None and not return_all_sorted_best_paths and \
+                len(paths) > MAX_PATHS_EXHAUSTIVE_ORDER:
+            order, reverse, is_optimal = score.best_arrangement(max_evaluations=max_evaluations)
+            if not is_optimal:
+                log.debug("The best permutation of {} paths was not found after {} evaluations. "
+                          "Using the best permutation found.".format(len(paths), max_evaluations))
+            if search_stats is not None:
+                search_stats['searches'] = search_stats.get('searches', 0) + 1
+                search_stats['optimal'] = search_stats.get('optimal', 0) + int(is_optimal)
+            return score.get_paths(order, reverse)
+
+        seen = set()
         if list_of_permutations is None:
             if only_expand_but_not_permute:
-                for expnd in Scaffolds.permute_paths(paths):
-                    if expnd[::-1] in perm_list:
-                        continue
-                    expand_indices = sum(expnd, [])
-                    mapped_perm = [mapping[x] for x in expand_indices]
-                    bw_value.append(Scaffolds.bw(ma[mapped_perm, :][:, mapped_perm]))
-                    perm_list.append(expnd)
+                orders = [range(len(paths))]
             else:
-                for perm in itertools.permutations(paths):
-                    for expnd in Scaffolds.permute_paths(perm):
-                        if expnd[::-1] in perm_list:
-                            continue
-                        expand_indices = sum(expnd, [])
-                        mapped_perm = [mapping[x] for x in expand_indices]
-                        bw_value.append(Scaffolds.bw(ma[mapped_perm, :][:, mapped_perm]))
-                        perm_list.append(expnd)
-
+                orders = itertools.permutations(range(len(paths)))
+            candidates = (score.get_arrangement_flips(order) for order in orders)
+            candidates = itertools.chain.from_iterable(candidates)
         else:
-            for expnd in list_of_permutations:
-                if expnd[::-1] in perm_list:
-                    continue
-                expand_indices = sum(expnd, [])
-                mapped_perm = [mapping[x] for x in expand_indices]
-                bw_value.append(Scaffolds.bw(ma[mapped_perm, :][:, mapped_perm]))
-                perm_list.append(expnd)
+            candidates = (score.get_arrangement(expnd) for expnd in list_of_permutations)
+
+        arrangements = []
+        for order, reverse in candidates:
+            # the candidate with the paths in the opposite order is skipped
+            if (tuple(order[::-1]), tuple(reverse)) in seen:
+                continue
+            seen.add((tuple(order), tuple(reverse)))
+            arrangements.append((order, reverse))
+
+        bw_value = score.evaluate_batch(arrangements).tolist()
+        perm_list = [score.get_paths(order, reverse) for order, reverse in arrangements]
 
         min_val = min(bw_value)
         min_indx = bw_value.index(min_val)
@@ -1499,13 +1719,10 @@ class Scaffolds(object):
         >>> Scaffolds.find_best_direction(A, [[9, 8, 7, 6], [5, 4, 3], [2, 1, 0] ])
         [[9, 8, 7, 6], [5, 4, 3], [2, 1, 0]]
         """
-        indices = sum(paths, [])
-        ma = ma[indices, :][:, indices]
-        ma.setdiag(0)
-        # mapping from 'indices' to new matrix id
-        mapping = dict([(val, idx) for idx, val in enumerate(indices)])
+        score = BandwidthScore(ma, paths)
+        order = range(len(paths))
         min_value = np.Inf
-        best_path = paths[:]
+        best_reverse = [False] * len(paths)
         seen = set()
         # the algorithm takes each part of the path (sub_path),
         # and computes the bw without flipping and with flipping.
@@ -1517,25 +1734,23 @@ class Scaffolds(object):
         # algorithm then number of combinations is at most 6. In general, for the
         # exhaustive search the combinations are 2 ** len(path), while for this
         # algorithm the number of combinations are <= 2 * len(path)
+        # Each combination differs from the previous one by the flipping of a sub_path, thus
+        # the bw is updated incrementally (see BandwidthScore).
         for idx, sub_path in enumerate(paths):
             if len(sub_path) == 1:
                 continue
-            for orientation in ['+', '-']:
-                sub_path_oriented = sub_path[:] if orientation == '+' else sub_path[::-1]
-                # best_path stores in each iteration the best orientation for the evaluated
+            for is_reverse in [False, True]:
+                # best_reverse stores in each iteration the best orientation for the evaluated
                 # sub_path
-                path_to_test = best_path[:idx] + [sub_path_oriented] + best_path[idx+1:]
-                path_indices = sum(path_to_test, [])
-                if tuple(path_indices) in seen:
+                reverse = best_reverse[:idx] + [is_reverse] + best_reverse[idx+1:]
+                if tuple(reverse) in seen:
                     continue
-                seen.add(tuple(path_indices))
-                mapped_perm = [mapping[x] for x in path_indices]
-                bw_value = Scaffolds.bw(ma[mapped_perm, :][:, mapped_perm])
+                seen.add(tuple(reverse))
+                bw_value = score.evaluate(order, reverse)
                 if bw_value < min_value:
-                    best_path = path_to_test
+                    best_reverse = reverse
                     min_value = bw_value
-                prev_path = path_to_test
-        return best_path
+        return score.get_paths(order, best_reverse)
 
     @staticmethod
     def bw(ma):
@@ -1601,7 +1816,7 @@ class Scaffolds(object):
     @logit
     def join_paths_max_span_tree(self, confidence_score,
                                  hub_solving_method=['remove weakest', 'bandwidth permute'][0],
-                                 node_degree_threshold=None):
+                                 node_degree_threshold=None, max_evaluations=MAX_SEARCH_EVALUATIONS):
         """
         Uses the maximum spanning tree to identify paths to
         merge
@@ -1610,6 +1825,8 @@ class Scaffolds(object):
         ---------
         confidence_score : Minimum contact threshold to consider. All other values are discarded
         hub_solving_method : Either 'remove weakest' or 'bandwidth permutation'
+        max_evaluations : maximum number of evaluations to find the best permutation of the paths around
+                          a hub with 'bandwidth permutation' (see find_best_permutation)
 
         Returns
         -------
@@ -1719,67 +1936,55 @@ class Scaffolds(object):
         [[0, 1, 2, 3, 4, 5]]
 
         """
-        matrix = self.matrix.copy()
-
+        # remove the diagonal and the values below the confidence score
+        ma = self.matrix.tocoo()
+        keep = (ma.row != ma.col) & (ma.data != 0)
         if confidence_score is not None:
-            matrix.data[matrix.data <= confidence_score] = 0
-        matrix.setdiag(0)
-        matrix.eliminate_zeros()
-
-        # remove all contacts that are within paths
-        internal_nodes = []
-        paths = self.get_all_paths(pg_base=True)
-        for path in paths:
-            if len(path) > 3:
-                internal_nodes.extend(path[1:-1])
+            keep &= ma.data > confidence_score
+        matrix = csr_matrix((ma.data[keep], (ma.row[keep], ma.col[keep])), shape=ma.shape)
 
         # get the node degree from the source  matrix.
-        node_degree = dict([(x, matrix[x, :].nnz) for x in range(matrix.shape[0])])
-
-        # remove hubs from internal nodes
-        for node in internal_nodes:
-            if node_degree[node] > 2:
-                # get the bin id of the other nodes that link with the query node
-                adj_nodes = np.flatnonzero(matrix[node, :].todense().A)
-                for adj_node in adj_nodes:
-                    if adj_node not in self.pg_base.adj[node].keys():
-                        # remove the contact between node and adj_node in the matrix
-                        matrix[node, adj_node] = 0
-                        matrix[adj_node, adj_node] = 0
-        matrix.eliminate_zeros()
+        node_degree = np.diff(matrix.indptr)
 
         # define node degree threshold as the degree for the 90th percentile
         if node_degree_threshold is None:
-            node_degree_threshold = np.percentile(node_degree.values(), 99)
-        len_nodes_to_remove = len([x for x in node_degree.values() if x >= node_degree_threshold])
+            node_degree_threshold = np.percentile(node_degree, 99)
+        is_hub = node_degree >= node_degree_threshold
+
+        # the contacts of internal nodes of paths (nodes that can not be
+        # joined to other paths) are removed, except with their path neighbors.
+        # Only internal nodes with degree > 2 are considered.
+        num_nodes = matrix.shape[0]
+        is_internal = np.zeros(num_nodes, dtype=bool)
+        left_neighbor = np.full(num_nodes, -1, dtype=np.int64)
+        right_neighbor = np.full(num_nodes, -1, dtype=np.int64)
+        pg_base_paths = list(self.get_all_paths(pg_base=True))
+        for path in pg_base_paths:
+            path = np.asarray(path, dtype=np.int64)
+            left_neighbor[path[1:]] = path[:-1]
+            right_neighbor[path[:-1]] = path[1:]
+            if len(path) > 3:
+                is_internal[path[1:-1]] = True
+        is_internal &= node_degree > 2
 
+        # a single mask over all non zero values is used to remove the
+        # contacts of internal nodes and the rows and cols of hubs
+        ma = matrix.tocoo()
+        is_path_edge = (left_neighbor[ma.row] == ma.col) | (right_neighbor[ma.row] == ma.col)
+        remove = ((is_internal[ma.row] | is_internal[ma.col]) & ~is_path_edge) | is_hub[ma.row] | is_hub[ma.col]
+
+        len_nodes_to_remove = np.sum(is_hub)
         if len_nodes_to_remove > 0:
+            # nodes with high degree are problematic. Their rows and cols are
+            # unset because the self.matrix is used for permutation and must not contain
+            # the hub data.
             log.info(" {} ({:.2f}%) nodes will be removed because they are above the degree "
-                     "threshold".format(len_nodes_to_remove, 100*float(len_nodes_to_remove)/matrix.shape[0]))
-            # remove from nxG nodes with degree > node_degree_threshold
-            # nodes with high degree are problematic
-            to_remove = []
-            for node, degree in node_degree.iteritems():
-                if degree >= node_degree_threshold:
-                    # unset the rows and cols of hubs
-                    # this is done in `matrix` as well
-                    # as self.matrix because the self.matrix
-                    # is used for permutation and must not contain
-                    # the hub data.
-                    log.debug("removing hub node {} with degree {} (thresh: {})"
-                              "".format(node, degree, node_degree_threshold))
-
-                    to_remove.append(node)
-
-            to_remove = np.unique(to_remove)
-            if len(to_remove) > 0:
-                self.matrix[to_remove, :] = 0
-                self.matrix[:, to_remove] = 0
-                matrix[to_remove, :] = 0
-                matrix[:, to_remove] = 0
-
-                matrix.eliminate_zeros()
-                self.matrix.eliminate_zeros()
+                     "threshold".format(len_nodes_to_remove, 100*float(len_nodes_to_remove)/num_nodes))
+            for node in np.flatnonzero(is_hub):
+                log.debug("removing hub node {} with degree {} (thresh: {})"
+                          "".format(node, node_degree[node], node_degree_threshold))
+
+        matrix = csr_matrix((ma.data[~remove], (ma.row[~remove], ma.col[~remove])), shape=ma.shape)
 
         self.matrix = matrix
 
@@ -1787,33 +1992,38 @@ class Scaffolds(object):
             # if matrix is empty after removing intra-path contacts
             # then nothing is left to do.
             return
-        nxG = self.make_nx_graph()
-        nx.write_graphml(nxG, "{}/pre_mst_iter_{}.graphml".format(self.out_folder, self.iteration))
-        # compute maximum spanning tree
-        nxG = nx.maximum_spanning_tree(nxG, weight='weight')
-        log.debug("saving maximum spanning tree network {}/mst_iter_{}.graphml".format(self.out_folder,
-                                                                                      self.iteration))
-        nx.write_graphml(nxG, "{}/mst_iter_{}.graphml".format(self.out_folder, self.iteration))
-        degree = np.array(dict(nxG.degree()).values())
-        if len(degree[degree > 2]):
+        # compute maximum spanning tree. Nodes of the same path are
+        # linked with the maximum weight.
+        tree = SpanningTree.maximum(self.matrix, paths=pg_base_paths)
+        if self.save_graphml:
+            nxG = self.make_nx_graph()
+            nx.write_graphml(nxG, "{}/pre_mst_iter_{}.graphml".format(self.out_folder, self.iteration))
+            log.debug("saving maximum spanning tree network {}/mst_iter_{}.graphml".format(self.out_folder,
+                                                                                          self.iteration))
+            mst = nx.Graph()
+            mst.add_nodes_from(nxG.nodes(data=True))
+            mst.add_weighted_edges_from(zip(*[x.tolist() for x in tree.edges()]))
+            nx.write_graphml(mst, "{}/mst_iter_{}.graphml".format(self.out_folder, self.iteration))
+
+        if np.any(tree.degree > 2):
             # count number of hubs
-            log.info("{} hubs were found".format(len(degree[degree>2])))
+            log.info("{} hubs were found".format(np.sum(tree.degree > 2)))
 
         if hub_solving_method == 'remove weakest':
-            self._remove_weakest(nxG)
+            self._remove_weakest(tree)
         else:
             log.debug("degree: {}".format(node_degree))
-            self._bandwidth_permute(nxG, node_degree, node_degree_threshold)
+            self._bandwidth_permute(tree, node_degree, node_degree_threshold, max_evaluations=max_evaluations)
 
-    def _bandwidth_permute(self, G, node_degree, node_degree_threshold):
+    def _bandwidth_permute(self, tree, node_degree, node_degree_threshold, max_evaluations=MAX_SEARCH_EVALUATIONS):
         """
         Based on the maximum spanning tree graph hubs are resolved using the
         bandwidth permutation method.
 
         Parameters
         ----------
-        G : maximum spanning tree networkx graph
-        matrix :
+        tree : maximum spanning tree (SpanningTree object)
+        max_evaluations : maximum number of evaluations to find the best permutation (see find_best_permutation)
         Returns
         -------
 
@@ -1822,10 +2032,10 @@ class Scaffolds(object):
         is_hub = set()
         # 1. based on the resulting maximum spanning tree, add the new edges to
         #    the paths graph unless any of the nodes is a hub
-        for u, v, data in G.edges(data=True):
+        for u, v, weight in zip(*[x.tolist() for x in tree.edges()]):
             edge_has_hub = False
             for node in [u, v]:
-                if G.degree(node) > 2:
+                if tree.degree[node] > 2:
                     is_hub.add(node)
                     edge_has_hub = True
             if edge_has_hub is False:
@@ -1833,7 +2043,7 @@ class Scaffolds(object):
                     # skip same path nodes
                     continue
                 else:
-                    self.add_edge(u, v, weight=data['weight'])
+                    self.add_edge(u, v, weight=weight)
 
         if len(is_hub) == 0:
             return
@@ -1841,15 +2051,16 @@ class Scaffolds(object):
         # 2. Find nodes with degree > 2 and arrange them using the bandwidth permutation
         solved_paths = []
         seen = set()
+        search_stats = {}
 
-        node_degree_mst = dict(G.degree(G.node.keys()))
-        for node, degree in sorted(node_degree_mst.iteritems(), key=lambda (k,v): v, reverse=True):
+        # nodes sorted by decreasing degree
+        for node in np.argsort(-tree.degree, kind='mergesort').tolist():
             if node in seen:
                 continue
-            if degree > 2:
+            if tree.degree[node] > 2:
                 paths_to_check = [self.pg_base[node]]
                 seen.update(self.pg_base[node])
-                for v in G.adj[node]:
+                for v in tree.neighbors(node)[0].tolist():
                     # only add paths that are not the same path
                     # already added.
                     if v not in self.pg_base[node]:
@@ -1860,9 +2071,15 @@ class Scaffolds(object):
                 if len(paths_to_check) > 1:
                     check = True
 
-                    solved_paths.append(Scaffolds.find_best_permutation(self.matrix, paths_to_check))
+                    solved_paths.append(Scaffolds.find_best_permutation(self.matrix, paths_to_check,
+                                                                        max_evaluations=max_evaluations,
+                                                                        search_stats=search_stats))
                     log.debug("best permutation: {}".format(solved_paths[-1]))
 
+        if search_stats.get('searches', 0) > 0:
+            log.info("The best permutation was proven optimal for {} of {} hubs".format(search_stats['optimal'],
+                                                                                   search_stats['searches']))
+
         for s_path in solved_paths:
             # add new edges to the paths graph
             for index, path in enumerate(s_path[:-1]):
@@ -1925,7 +2142,7 @@ class Scaffolds(object):
             path_list.append(path)
         return path_list
 
-    def _remove_weakest(self, G):
+    def _remove_weakest(self, tree):
         """
         Based on the maximum spanning tree graph hubs are resolved by removing the
         weakest links until only two edges are left
@@ -1945,19 +2162,22 @@ class Scaffolds(object):
 
         Parameters
         ----------
-        G : maximum spanning tree networkx graph
+        tree : maximum spanning tree (SpanningTree object)
 
         Returns
         -------
         None
         """
-        node_degree_mst = dict(G.degree(G.node.keys()))
-        for node, degree in sorted(node_degree_mst.iteritems(), key=lambda (k, v): v, reverse=True):
+        node_degree_mst = tree.degree.copy()
+        # nodes sorted by decreasing degree
+        for node in np.argsort(-node_degree_mst, kind='mergesort').tolist():
+            degree = node_degree_mst[node]
             if degree > 2:
                 # check if node already is inside a path
                 if len(self.pg_base.adj[node]) == 2:
                     # this could indicate a problematic case
-                    log.info("Hub node is already inside a path {},  node_id:{}".format(G.node[node]['name'], node))
+                    log.info("Hub node is already inside a path {},  node_id:{}".format(self.pg_base.node[node]['name'],
+                                                                                       node))
 
                 # prune single nodes but only on first iteration. Single nodes are defined as:
                 #            o  <- single node
@@ -1965,7 +2185,8 @@ class Scaffolds(object):
                 #  o---o---o----o---o
                 # a single node, is a node adj to a hub, whose other adj nodes have all degree 2
                 # adj_degree looks like: [(90, 2), (57, 2), (59, 1)], where is tuple is (node_id, degree)
-                adj_degree = sorted([(x, node_degree_mst[x]) for x in G.adj[node].keys()], key=lambda(k, v): v)[::-1]
+                adj_nodes, adj_weights = tree.neighbors(node)
+                adj_degree = sorted([(x, node_degree_mst[x]) for x in adj_nodes.tolist()], key=lambda(k, v): v)[::-1]
                 if self.iteration == 0 and len(adj_degree) == 3 and \
                    adj_degree[0][1] == 2 and adj_degree[1][1] == 2 and adj_degree[2][1] == 1:
                     node_to_prune = adj_degree[2][0]
@@ -1974,49 +2195,48 @@ class Scaffolds(object):
                     # what needs to be done is to check if it belongs to a path that is larger than 1.
                     # calling self.pg_base[x] will return the path containing node x
                     if len(self.pg_base[node_to_prune]) == 1:
-                        log.debug("Pruning single node: {}".format(G.node[node_to_prune]['name']))
-                        G.remove_node(node_to_prune)
+                        log.debug("Pruning single node: {}".format(self.pg_base.node[node_to_prune]['name']))
+                        tree.remove_node(node_to_prune)
                         self._remove_bin_path(self.pg_base.node[node_to_prune]['initial_path'], split_scaffolds=True)
                         continue
                 # the adj variable looks like:
-                # [(90, {'weight': 1771.3}), (57, {'weight': 2684.6}), (59, {'weight': 14943.6})]
-                adj = sorted(G.adj[node].iteritems(), key=lambda (k, v): v['weight'])
+                # [(90, 1771.3), (57, 2684.6), (59, 14943.6)]
+                adj = sorted(zip(adj_nodes.tolist(), adj_weights.tolist()), key=lambda (k, v): v)
                 # remove the weakest edges but only if either of the nodes is not a hub
-                for adj_node, attr in adj[:-2]:
-                    if len(G.adj[adj_node]) > 3:
+                for adj_node, weight in adj[:-2]:
+                    if tree.degree[adj_node] > 3:
                         log.warn("\n\nHub-hub contact for bin_id:{}\tscaffold: {}\tdegree: {}\n"
                                  "with bin_id: {}\tscaffold: {}\tdegree:{}\n\n"
                                  "##############\n"
                                  "these cases could introduce problems in the assembly.\n"
                                  "Thus, node is being removed from the graph.\n"
                                  "##############\n\n".format(node, self.pg_base.node[node]['name'],
-                                                             len(G.adj[node]), adj_node,
+                                                             tree.degree[node], adj_node,
                                                              self.pg_base.node[adj_node]['name'],
-                                                             len(G.adj[adj_node])))
+                                                             tree.degree[adj_node]))
 
                         # adj node is hub. In this case remove the node and the scaffold it belongs
                         # to from the graph
-                        path  = len(self.pg_base[node])
+                        path = self.pg_base[node]
                         # only remove if the path is not longer than 5. Otherwise
                         # a quite large scaffold can be removed.
                         if len(path) < 5:
                             for node_id in path:
-                                G.remove_node(node_id)
+                                tree.remove_node(node_id)
                             self._remove_bin_path(self.pg_base.node[node]['initial_path'], split_scaffolds=True)
                             continue
 
-                    log.debug("Removing weak edge {}-{} weight: {}".format(G.node[node]['name'],
-                                                                           G.node[adj_node]['name'],
-                                                                           attr['weight']))
-                    G.remove_edge(node, adj_node)
+                    log.debug("Removing weak edge {}-{} weight: {}".format(self.pg_base.node[node]['name'],
+                                                                           self.pg_base.node[adj_node]['name'],
+                                                                           weight))
+                    tree.remove_edge(node, adj_node)
             if degree <= 2:
                 break
 
-        # now, the G graph should contain only paths
-        for path in Scaffolds._return_paths_from_graph(G):
+        # now, the tree should contain only paths
+        for path in tree.get_paths():
             self.add_path(path)
 
-
     def add_path(self, path):
         """
         Adds all the edges to the internal PathGraphs based on the given path
@@ -2049,8 +2269,6 @@ class Scaffolds(object):
         # find best orientation
         if len(path) < 10:
             best_path = Scaffolds.find_best_permutation(self.hic.matrix, bins_path, only_expand_but_not_permute=True)
-            if best_path != Scaffolds.find_best_direction(self.hic.matrix, bins_path):
-                pass
         else:
             best_path = Scaffolds.find_best_direction(self.hic.matrix, bins_path)
 
@@ -2089,7 +2307,7 @@ class Scaffolds(object):
         >>> G.adj[0]
         AtlasView({1: {'weight': 5.0}, 2: {'weight': 2.0}, 3: {'weight': 2.0}, 4: {'weight': 2.0}, 5: {'weight': 2.0}})
         >>> G.node[0]
-        {'start': 0, 'length': 10, 'end': 10, 'name': 'c-0', 'coverage': 1}
+        {'start': 0, 'length': 10, 'end': 10, 'name': 'c-0', 'coverage': 1.0}
 
 
         The following matrix is used:
@@ -2123,39 +2341,70 @@ class Scaffolds(object):
 (4, 5, {'weight': 3.0})]
         """
 
-        nxG = nx.Graph()
         if self.pg_base is not None:
             path_graph_to_use = self.pg_base
         else:
             path_graph_to_use = self.matrix_bins
 
-        for node_id, node in path_graph_to_use.node.iteritems():
-            # when saving a networkx object, numpy number types or lists, are not accepted
-            nn = node.copy()
-            for attr, value in nn.iteritems():
-                if isinstance(value, np.int64):
-                    nn[attr] = int(value)
-                elif isinstance(value, np.float64):
-                    nn[attr] = float(value)
-                elif isinstance(value, list):
-                    nn[attr] = ", ".join([str(x) for x in value])
+        nxG = nx.Graph()
+        # when saving a networkx object, numpy number types or lists, are not accepted
+        nxG.add_nodes_from(Scaffolds.sanitize_node_attributes(path_graph_to_use.node.iteritems()))
+
+        # only the upper triangle is used, the matrix is symmetric
+        matrix = triu(self.matrix, k=1, format='coo')
+        weight = matrix.data.astype(np.float64)
+        if len(weight):
+            # the links between neighbors in the same path get the maximum weight
+            right_neighbor = np.full(self.matrix.shape[0], -1, dtype=np.int64)
+            for path in path_graph_to_use.get_all_paths():
+                right_neighbor[path[:-1]] = path[1:]
+            same_path = (right_neighbor[matrix.row] == matrix.col) | (right_neighbor[matrix.col] == matrix.row)
+            weight[same_path] = self.matrix.data.max() + 1
+
+        nxG.add_weighted_edges_from(zip(matrix.row.tolist(), matrix.col.tolist(), weight.tolist()))
 
-            nxG.add_node(node_id, **nn)
+        return nxG
 
-        matrix = self.matrix.tocoo()
-        max_weight = matrix.data.max() + 1
+    @staticmethod
+    def sanitize_node_attributes(nodes):
+        """
+        Converts the node attributes that can not be saved by networkx (numpy numbers, numpy strings and lists)
+        into python types. The conversion is decided once per attribute, thus the attributes that
+        do not need any conversion are not checked node by node.
 
-        for u, v, weight in zip(matrix.row, matrix.col, matrix.data):
-            if u == v:
-                continue
+        Parameters
+        ----------
+        nodes : iterable of (node_id, attribute dict) tuples
 
-            if u in path_graph_to_use.adj[v]:
-                # u and v are neighbors
-                nxG.add_edge(u, v, weight=float(max_weight))
-            else:
-                nxG.add_edge(u, v, weight=float(weight))
+        Returns
+        -------
+        list of (node_id, attribute dict) tuples. The attribute dicts are copies.
+
+        >>> nodes = Scaffolds.sanitize_node_attributes([(0, {'name': 'c-0', 'length': np.int64(10), 'path': [1, 2]}),
+        ...                                             (1, {'name': 'c-1', 'length': 20})])
+        >>> [(node_id, sorted(attr.items())) for node_id, attr in nodes]
+        [(0, [('length', 10), ('name', 'c-0'), ('path', '1, 2')]), (1, [('length', 20), ('name', 'c-1')])]
+        >>> type(nodes[0][1]['length'])
+        <type 'int'>
+        """
+        converters = {np.int64: int,
+                      np.float64: float,
+                      np.string_: str,
+                      list: lambda value: ", ".join([str(x) for x in value])}
+        nodes = [(node_id, attr.copy()) for node_id, attr in nodes]
+        columns = {}
+        for node_id, attr in nodes:
+            for key, value in attr.iteritems():
+                columns.setdefault(key, set()).add(type(value))
+
+        for key, types in columns.iteritems():
+            if not any(x in converters for x in types):
+                continue
+            for node_id, attr in nodes:
+                if key in attr and type(attr[key]) in converters:
+                    attr[key] = converters[type(attr[key])](attr[key])
 
-        return nxG
+        return nodes
 
     def add_scaffold_edge(self, _bin_u, _bin_v, _weight, direction):
         """
@@ -0,0 +1,174 @@
+import numpy as np
+from scipy.sparse import csr_matrix, triu
+from scipy.sparse.csgraph import minimum_spanning_tree
+
+import logging
+log = logging.getLogger("SpanningTree")
+
+
+class SpanningTree(object):
+    """
+    Spanning tree of the nodes of a contact matrix kept as edge arrays (row, col, weight)
+    plus the degree of each node. Edges and nodes can be removed, which only
+    unsets the edges, and the remaining paths can be recovered (see get_paths).
+
+    The maximum spanning tree is computed with scipy.sparse.csgraph on the sparse matrix
+    (see SpanningTree.maximum), without building a networkx graph.
+
+    Examples
+    --------
+    >>> tree = SpanningTree(5, [0, 1, 1, 3], [1, 2, 3, 4], [3., 2., 1., 5.])
+    >>> tree.degree
+    array([1, 3, 1, 2, 1])
+    >>> tree.neighbors(1)
+    (array([0, 2, 3]), array([3., 2., 1.]))
+    >>> tree.remove_edge(1, 3)
+    >>> tree.degree
+    array([1, 2, 1, 1, 1])
+    >>> tree.get_paths()
+    [[2, 1, 0], [4, 3]]
+    """
+
+    def __init__(self, num_nodes, row, col, weight):
+        """
+        Parameters
+        ----------
+        num_nodes : number of nodes. The nodes are the integers from 0 to num_nodes - 1
+        row, col, weight : arrays with the two nodes and the weight of each edge
+        """
+        self.num_nodes = num_nodes
+        self.row = np.asarray(row, dtype=np.int64)
+        self.col = np.asarray(col, dtype=np.int64)
+        self.weight = np.asarray(weight, dtype=np.float64)
+        self.active = np.ones(len(self.row), dtype=bool)
+        self.degree = np.bincount(self.row, minlength=num_nodes) + np.bincount(self.col, minlength=num_nodes)
+
+        # adjacency of each node: the neighbors and the edge ids of the node
+        # are in the range _adj_indptr[node]:_adj_indptr[node + 1]
+        node = np.concatenate([self.row, self.col])
+        other = np.concatenate([self.col, self.row])
+        order = np.lexsort((other, node))
+        self._adj_node = other[order]
+        self._adj_edge = np.tile(np.arange(len(self.row)), 2)[order]
+        self._adj_indptr = np.concatenate([[0], np.cumsum(np.bincount(node, minlength=num_nodes))])
+
+    @classmethod
+    def maximum(cls, matrix, paths=None):
+        """
+        Computes the maximum spanning tree of the graph whose edges are
+        the non zero values of the symmetric matrix. Consecutive nodes of the
+        given paths are linked with the maximum weight (max value + 1) such that
+        they are always part of the tree, as in Scaffolds.make_nx_graph.
+
+        The weights are negated to compute a minimum spanning tree using scipy.sparse.csgraph.
+
+        Parameters
+        ----------
+        matrix : sparse symmetric matrix with positive values
+        paths : list of paths (lists of nodes)
+
+        Returns
+        -------
+        SpanningTree object
+
+        Examples
+        --------
+        >>> matrix = csr_matrix(np.array([[0, 3, 0, 0, 0, 0],
+        ...                               [3, 0, 3, 2, 2.5, 0],
+        ...                               [0, 3, 0, 3, 0, 0],
+        ...                               [0, 2, 3, 0, 1, 0],
+        ...                               [0, 2.5, 0, 1, 0, 3],
+        ...                               [0, 0, 0, 0, 3, 0]]))
+        >>> tree = SpanningTree.maximum(matrix)
+        >>> zip(*tree.edges())
+        [(0, 1, 3.0), (1, 2, 3.0), (1, 4, 2.5), (2, 3, 3.0), (4, 5, 3.0)]
+
+        The link between nodes 3 and 4 has the maximum weight if they are part of the same path
+        >>> tree = SpanningTree.maximum(matrix, paths=[[3, 4]])
+        >>> zip(*tree.edges())
+        [(0, 1, 3.0), (1, 2, 3.0), (2, 3, 3.0), (3, 4, 4.0), (4, 5, 3.0)]
+        """
+        num_nodes = matrix.shape[0]
+        ma = triu(matrix, k=1, format='coo')
+        weight = ma.data.astype(np.float64)
+        if paths is not None and len(ma.data):
+            right_neighbor = np.full(num_nodes, -1, dtype=np.int64)
+            for path in paths:
+                path = np.asarray(path, dtype=np.int64)
+                right_neighbor[path[:-1]] = path[1:]
+            same_path = (right_neighbor[ma.row] == ma.col) | (right_neighbor[ma.col] == ma.row)
+            weight[same_path] = matrix.data.max() + 1
+
+        tree = minimum_spanning_tree(csr_matrix((-weight, (ma.row, ma.col)), shape=matrix.shape)).tocoo()
+        return cls(num_nodes, tree.row, tree.col, -tree.data)
+
+    def edges(self):
+        """
+        Returns the row, col and weight arrays of the edges in the tree.
+        """
+        return self.row[self.active], self.col[self.active], self.weight[self.active]
+
+    def neighbors(self, node):
+        """
+        Returns the neighbors of the node and the weights of the edges to them.
+        """
+        start, end = self._adj_indptr[node], self._adj_indptr[node + 1]
+        edges = self._adj_edge[start:end]
+        is_active = self.active[edges]
+        return self._adj_node[start:end][is_active], self.weight[edges[is_active]]
+
+    def remove_edge(self, u, v):
+        """
+        Removes the edge between u and v. Nothing is done if the edge does not exist.
+        """
+        start, end = self._adj_indptr[u], self._adj_indptr[u + 1]
+        edges = self._adj_edge[start:end][(self._adj_node[start:end] == v)]
+        edges = edges[self.active[edges]]
+        if len(edges):
+            self.active[edges] = False
+            self.degree[u] -= len(edges)
+            self.degree[v] -= len(edges)
+
+    def remove_node(self, node):
+        """
+        Removes all the edges of the node.
+        """
+        for adj_node in self.neighbors(node)[0]:
+            self.remove_edge(node, adj_node)
+
+    def get_paths(self):
+        """
+        Returns the paths formed by the edges of the tree, which should contain only
+        paths (no node with degree > 2). Nodes without edges are not returned.
+
+        The path is traversed as in Scaffolds._return_paths_from_graph, but starting from its smallest node
+        instead of the first node of the networkx connected component (whose order depends on
+        the set used by networkx), thus, some paths may have the opposite orientation. From the
+        start node, the path is traversed first through its smaller neighbor. Then, the path
+        is inverted and extended through the other neighbor.
+
+        >>> tree = SpanningTree(6, [1, 1, 2, 4], [2, 4, 3, 5], [1., 1., 1., 1.])
+        >>> tree.get_paths()
+        [[5, 4, 1, 2, 3]]
+        """
+        if np.any(self.degree > 2):
+            raise ValueError("The tree contains nodes with degree > 2")
+        seen = np.zeros(self.num_nodes, dtype=bool)
+        path_list = []
+        for source in np.flatnonzero(self.degree > 0).tolist():
+            if seen[source]:
+                continue
+            path = [source]
+            seen[source] = True
+            for next_node in sorted(self.neighbors(source)[0].tolist()):
+                prev_node = source
+                while True:
+                    path.append(next_node)
+                    seen[next_node] = True
+                    adj_list = [x for x in self.neighbors(next_node)[0].tolist() if x != prev_node]
+                    if len(adj_list) == 0:
+                        break
+                    prev_node, next_node = next_node, adj_list[0]
+                path = path[::-1]
+            path_list.append(path)
+        return path_list
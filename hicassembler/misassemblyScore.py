@@ -0,0 +1,363 @@
+"""
+Insulation-style score used to detect misassemblies. The score at each bin is the
+mean of the log2 observed/expected contacts in the 'diamond' formed by the bins
+upstream and downstream of the bin (like the hicFindTADs TAD-separation
+score). Only contacts close to the diagonal are required, thus, the matrix
+is restricted to a band of twice the largest window size and all computations
+are done on the non-zero values of the band.
+"""
+import json
+import numpy as np
+from hicassembler.IntervalTable import IntervalTable
+
+import logging
+log = logging.getLogger("misassemblyScore")
+
+ROW_BLOCK_SIZE = 100000  # number of matrix rows processed at once to select the band
+
+
+def get_window_sizes(min_depth, max_depth, step):
+    """
+    Returns the window sizes (in bp) used to compute the score. The
+    windows increase from min_depth to max_depth with increasing steps (as in hicFindTADs).
+
+    >>> get_window_sizes(200000, 800000, 100000)
+    [200000, 300000, 482842, 719615]
+    """
+    window_sizes = []
+    idx = 0
+    while True:
+        window = min_depth + int(step * (idx ** 1.5))
+        idx += 1
+        if window > max_depth:
+            break
+        if len(window_sizes) and window == window_sizes[-1]:
+            continue
+        window_sizes.append(window)
+    return window_sizes
+
+
+def get_chrom_ids(chrom_list):
+    """
+    Returns for each bin the id of its chromosome and, per bin, the first bin and the
+    last bin + 1 of the chromosome. The bins of each chromosome should be consecutive.
+
+    >>> chrom_id, chrom_start, chrom_end = get_chrom_ids(np.array(['a', 'a', 'b', 'b', 'b']))
+    >>> chrom_id
+    array([0, 0, 1, 1, 1])
+    >>> chrom_start
+    array([0, 0, 2, 2, 2])
+    >>> chrom_end
+    array([2, 2, 5, 5, 5])
+    """
+    chrom_list = np.asarray(chrom_list)
+    first = np.concatenate([[0], np.flatnonzero(chrom_list[1:] != chrom_list[:-1]) + 1])
+    chrom_id = np.zeros(len(chrom_list), dtype=int)
+    chrom_id[first[1:]] = 1
+    chrom_id = np.cumsum(chrom_id)
+    last = np.append(first[1:], len(chrom_list))
+    return chrom_id, first[chrom_id], last[chrom_id]
+
+
+def get_window_bounds(chrom_id, start, end, window):
+    """
+    For each bin, returns the first bin of the upstream window and the last bin + 1 of the
+    downstream window. As in hicFindTADs, the upstream window starts
+    at the bin overlapping `bin start - window` while the downstream window ends before the bin
+    overlapping `bin end + window`. The windows are truncated at the chromosome boundaries.
+
+    Parameters
+    ----------
+    chrom_id, start, end : chromosome id and coordinates of each bin. The bins should be sorted.
+    window : window size in bp
+
+    Returns
+    -------
+    left, right arrays
+
+    Examples
+    --------
+    >>> chrom_id = np.array([0, 0, 0, 0, 1, 1])
+    >>> start = np.array([0, 10, 20, 30, 0, 10])
+    >>> left, right = get_window_bounds(chrom_id, start, start + 10, 20)
+    >>> left
+    array([0, 0, 0, 1, 4, 4])
+    >>> right
+    array([2, 3, 3, 3, 5, 5])
+    """
+    # positions are made unique across chromosomes by
+    # adding an offset per chromosome
+    offset = (chrom_id * (end.max() + window + 1)).astype(np.int64)
+    left_start = offset + np.clip(start - window, 0, None)
+    left = np.searchsorted(offset + end, left_start, side='right')
+
+    # end of the chromosome (end of its last bin)
+    chrom_end = np.zeros(chrom_id.max() + 1, dtype=np.int64)
+    np.maximum.at(chrom_end, chrom_id, end)
+    right_end = offset + np.minimum(chrom_end[chrom_id], end + window) - 1
+    right = np.searchsorted(offset + start, right_end, side='right') - 1
+    return left, right
+
+
+def log_obs_exp(row, col, data, distance, chrom_id, chrom_len):
+    """
+    Computes log2(observed / expected) of the log1p transformed contacts. The expected
+    value is the mean, per chromosome, of the values at the same distance from
+    the diagonal (the zero values are considered). The row, col, data arrays
+    should only contain intra-chromosomal upper triangle values.
+
+    Parameters
+    ----------
+    row, col, data : coordinates and values of the non-zero values
+    distance : distance to the diagonal in number of bins of each value
+    chrom_id : chromosome id of each bin
+    chrom_len : number of bins of each chromosome
+
+    Returns
+    -------
+    array of log2 obs/exp values
+
+    Examples
+    --------
+    >>> row = np.array([0, 0, 1])
+    >>> col = np.array([1, 2, 2])
+    >>> data = np.array([3.0, 1.0, 1.0])
+    >>> log_obs_exp(row, col, data, col - row, np.array([0, 0, 0]), np.array([3])).round(2)
+    array([ 0.42,  0.  , -0.58])
+    """
+    value = np.log1p(data)
+    max_distance = distance.max() + 1
+    key = chrom_id[row] * max_distance + distance
+    sum_per_distance = np.bincount(key, weights=value, minlength=len(chrom_len) * max_distance)
+    # number of values at the given distance, i.e. the length of the diagonal. For
+    # bins of unequal size, the number of non-zero values at that distance can be larger.
+    diagonal_len = np.maximum(chrom_len[chrom_id[row]] - distance, np.bincount(key)[key])
+    expected = sum_per_distance[key] / diagonal_len
+    return np.log2(value / expected)
+
+
+def get_diamond_bins(row, col, left, right):
+    """
+    Returns for each value (row, col) the first and the last bin whose diamond contains the
+    value. The diamond of a bin is the submatrix [left, bin) x [bin, right). Because left and right
+    increase with the bin, the bins whose diamond contains (row, col) are consecutive. For
+    values that are not part of any diamond, the first bin is larger than the last bin.
+
+    >>> left = np.array([0, 0, 0, 1])
+    >>> right = np.array([2, 3, 4, 4])
+    >>> get_diamond_bins(np.array([0, 0, 1]), np.array([1, 3, 3]), left, right)
+    (array([1, 2, 2]), array([1, 2, 3]))
+    """
+    first = np.maximum(row + 1, np.searchsorted(right, col, side='right'))
+    last = np.minimum(col, np.searchsorted(left, row, side='right') - 1)
+    return first, last
+
+
+def diamond_scores(row, col, value, chrom_id, start, end, window_sizes):
+    """
+    Computes for each bin and window size the mean of the values in the
+    submatrix [left, bin) x [bin, right) (the 'diamond' when the matrix is rotated 45 degrees),
+    where left and right are the window bounds (see get_window_bounds).
+    The sums are computed by adding each value to the range of bins whose
+    diamond contains the value using a cumulative sum, which is
+    linear on the number of non-zero values. The score is nan when the diamond is empty
+    (e.g. for the first bin of each chromosome).
+
+    Parameters
+    ----------
+    row, col, value : upper triangle, intra-chromosomal non-zero values
+    chrom_id, start, end : chromosome id and coordinates of each bin
+    window_sizes : list of window sizes in bp
+
+    Returns
+    -------
+    array of shape (number of bins, number of window sizes)
+
+    Examples
+    --------
+    >>> row = np.array([0, 0, 1, 1, 2])
+    >>> col = np.array([1, 2, 2, 3, 3])
+    >>> value = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    >>> start = np.array([0, 10, 20, 30])
+    >>> diamond_scores(row, col, value, np.zeros(4, dtype=int), start, start + 10, [10, 20])
+    array([[nan, nan],
+           [1. , 1.5],
+           [3. , 2.5],
+           [nan, nan]])
+    """
+    num_bins = len(chrom_id)
+    bins = np.arange(num_bins)
+    scores = np.zeros((num_bins, len(window_sizes)))
+    for idx, window in enumerate(window_sizes):
+        left, right = get_window_bounds(chrom_id, start, end, window)
+        first, last = get_diamond_bins(row, col, left, right)
+        in_diamond = first <= last
+        diff = np.bincount(first[in_diamond], weights=value[in_diamond], minlength=num_bins + 1) - \
+            np.bincount(last[in_diamond] + 1, weights=value[in_diamond], minlength=num_bins + 1)
+        sums = np.cumsum(diff)[:num_bins]
+        num_values = (bins - left) * (right - bins)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores[:, idx] = np.where(num_values > 0, sums / num_values, np.nan)
+    return scores
+
+
+def get_band(matrix, max_offset, row_block_size=ROW_BLOCK_SIZE):
+    """
+    Returns the upper triangle values (row, col, data) whose distance to the
+    diagonal is between 1 and `max_offset` bins. The values are selected directly from
+    the csr arrays in blocks of rows, thus, no copy of the whole matrix is made.
+    The values are returned in the same order as in the csr matrix.
+
+    >>> from scipy.sparse import csr_matrix
+    >>> A = csr_matrix(np.array([[1, 2, 3, 4], [2, 1, 5, 6], [3, 5, 1, 7], [4, 6, 7, 1]]))
+    >>> row, col, data = get_band(A, 2, row_block_size=3)
+    >>> row.tolist(), col.tolist(), data.tolist()
+    ([0, 0, 1, 1, 2], [1, 2, 2, 3, 3], [2, 3, 5, 6, 7])
+    """
+    rows, cols, data = [], [], []
+    indptr = matrix.indptr
+    for block_start in range(0, matrix.shape[0], row_block_size):
+        block_end = min(block_start + row_block_size, matrix.shape[0])
+        first, last = indptr[block_start], indptr[block_end]
+        row = np.repeat(np.arange(block_start, block_end), np.diff(indptr[block_start:block_end + 1]))
+        col = matrix.indices[first:last]
+        in_band = (col > row) & (col - row <= max_offset)
+        rows.append(row[in_band])
+        cols.append(col[in_band])
+        data.append(matrix.data[first:last][in_band])
+    if len(rows) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=matrix.dtype)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(data)
+
+
+def compute_scores(hic, min_depth, max_depth, step):
+    """
+    Computes the misassembly score for all bins of the given HiCMatrix object.
+    Bins in `hic.nan_bins` are skipped. Bins for which the score can not be
+    computed (e.g. first bin of each scaffold) are not returned.
+
+    Returns
+    -------
+    chrom, start, end, scores arrays. The scores array has one column per window size.
+    """
+    num_bins = hic.matrix.shape[0]
+    keep = np.ones(num_bins, dtype=bool)
+    if hic.nan_bins is not None and len(hic.nan_bins):
+        keep[np.asarray(hic.nan_bins, dtype=int)] = False
+    keep_ids = np.flatnonzero(keep)
+    new_id = np.cumsum(keep) - 1
+
+    table = IntervalTable.from_hic(hic)
+    chrom = np.array(table.chrom[keep_ids].tolist())
+    start = table.start[keep_ids].astype(int)
+    end = table.end[keep_ids].astype(int)
+    chrom_id, _, _ = get_chrom_ids(chrom)
+    chrom_len = np.bincount(chrom_id)
+
+    bin_size = hic.getBinSize()
+    window_sizes = get_window_sizes(min_depth, max_depth, step)
+    log.debug("misassembly score window sizes: {}".format(window_sizes))
+
+    # keep only the upper triangle values that are part of the
+    # diamond of the largest window. This is a band close to the diagonal, whose width
+    # (in bins of the matrix, including the nan bins) is the largest diamond.
+    left, right = get_window_bounds(chrom_id, start, end, window_sizes[-1])
+    has_diamond = right > left
+    max_offset = (keep_ids[right[has_diamond] - 1] - keep_ids[left[has_diamond]]).max() if has_diamond.any() else 0
+    row, col, data = get_band(hic.matrix.tocsr(), max_offset)
+    in_band = keep[row] & keep[col] & (data > 0)
+    row = new_id[row[in_band]]
+    col = new_id[col[in_band]]
+    data = data[in_band].astype(float)
+    first, last = get_diamond_bins(row, col, left, right)
+    in_band = (chrom_id[row] == chrom_id[col]) & (first <= last)
+    row, col, data = row[in_band], col[in_band], data[in_band]
+
+    distance = (start[col] - start[row]) // bin_size
+    value = log_obs_exp(row, col, data, distance, chrom_id, chrom_len)
+    scores = diamond_scores(row, col, value, chrom_id, start, end, window_sizes)
+
+    valid = np.isfinite(scores).all(axis=1)
+    return chrom[valid], start[valid], end[valid], scores[valid]
+
+
+def find_minima(scores, chrom, lookahead=4):
+    """
+    Returns the indices of the local minima of the scores. A value is a local
+    minimum if it is lower than the `lookahead` values before and not
+    higher than the `lookahead` values after it, all of them on the same chromosome.
+
+    >>> scores = np.array([3, 2, 1, 2, 3, 3, 2, 1, 0.5, 1, 2, 3])
+    >>> chrom = np.array(['a'] * 5 + ['b'] * 7)
+    >>> find_minima(scores, chrom, lookahead=2)
+    array([2, 8])
+
+    The minimum of 'a' is skipped because it only has two values before it
+    >>> find_minima(scores, chrom, lookahead=3)
+    array([8])
+    """
+    is_min = np.isfinite(scores)
+    for offset in range(1, lookahead + 1):
+        same_chrom = chrom[offset:] == chrom[:-offset]
+        before = np.full(len(scores), -np.inf)
+        before[offset:] = np.where(same_chrom, scores[:-offset], -np.inf)
+        after = np.full(len(scores), -np.inf)
+        after[:-offset] = np.where(same_chrom, scores[offset:], -np.inf)
+        is_min &= (scores < before) & (scores <= after)
+    return np.flatnonzero(is_min)
+
+
+def save_scores(file_name, chrom, start, end, scores, params):
+    """
+    Saves the scores in bedgraph matrix format (the same format used by
+    hicFindTADs for the TAD-separation score). The first line
+    contains the parameters used to compute the scores.
+    """
+    with open(file_name, 'w') as fh:
+        fh.write("#" + json.dumps(params, sort_keys=True, separators=(',', ':')) + "\n")
+        for idx in range(len(chrom)):
+            fh.write("{}\t{}\t{}\t{}\n".format(chrom[idx], start[idx], end[idx],
+                                                "\t".join(np.char.mod('%f', scores[idx, :]))))
+
+
+def load_scores(file_name):
+    """
+    Loads a file saved with `save_scores`.
+
+    Returns
+    -------
+    params, chrom, start, end, scores
+
+    Examples
+    --------
+    >>> import tempfile, os
+    >>> fh = tempfile.NamedTemporaryFile(suffix=".bm", delete=False)
+    >>> fh.close()
+    >>> save_scores(fh.name, ['a', 'a'], [0, 10], [10, 20], np.array([[0.5, 1], [0.25, 2]]), {'step': 10})
+    >>> params, chrom, start, end, scores = load_scores(fh.name)
+    >>> params
+    {u'step': 10}
+    >>> chrom, start, end
+    (array(['a', 'a'], dtype='|S1'), array([ 0, 10]), array([10, 20]))
+    >>> scores
+    array([[0.5 , 1.  ],
+           [0.25, 2.  ]])
+    >>> os.unlink(fh.name)
+    """
+    params = {}
+    chrom = []
+    start = []
+    end = []
+    scores = []
+    with open(file_name) as fh:
+        for line in fh:
+            if line.startswith("#"):
+                params = json.loads(line[1:])
+                continue
+            fields = line.rstrip("\n").split("\t")
+            chrom.append(fields[0])
+            start.append(int(fields[1]))
+            end.append(int(fields[2]))
+            scores.append([float(x) for x in fields[3:]])
+
+    return params, np.array(chrom), np.array(start, dtype=int), np.array(end, dtype=int), np.array(scores)
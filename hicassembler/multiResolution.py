@@ -0,0 +1,119 @@
+"""
+Helper functions to work with multi-resolution cooler files (.mcool).
+A .mcool file contains the same Hi-C matrix stored at several resolutions,
+usually under the groups /resolutions/<bin size>.
+"""
+import numpy as np
+import cooler
+import hicexplorer.HiCMatrix as HiCMatrix
+from hicexplorer.utilities import toString
+from hicassembler.IntervalTable import IntervalTable
+
+import logging
+log = logging.getLogger("multiResolution")
+
+
+def is_mcool(file_name):
+    """
+    Returns True if the file name refers to a multi-resolution cooler
+    file. URIs pointing to one of the resolutions (file.mcool::/resolutions/1000)
+    are single resolution matrices.
+
+    >>> is_mcool("matrix.mcool")
+    True
+    >>> is_mcool("matrix.mcool::/resolutions/1000")
+    False
+    >>> is_mcool("matrix.h5")
+    False
+    """
+    return file_name.endswith(".mcool") and "::" not in file_name
+
+
+def get_resolutions(file_name):
+    """
+    Returns a list of (resolution, uri) tuples sorted from the highest to
+    the lowest resolution (smallest to largest bin size).
+    """
+    resolutions = []
+    for group in cooler.io.ls(file_name):
+        uri = "{}::{}".format(file_name, group)
+        bin_size = cooler.Cooler(uri).binsize
+        if bin_size is None:
+            # cooler returns None for bins of variable size
+            # In this case, the bin size is taken from the group name
+            try:
+                bin_size = int(group.rstrip("/").split("/")[-1])
+            except ValueError:
+                log.warn("Resolution of {} could not be determined. Skipping it.".format(uri))
+                continue
+        resolutions.append((bin_size, uri))
+
+    if len(resolutions) == 0:
+        raise ValueError("No matrices found in {}".format(file_name))
+    return sorted(resolutions)
+
+
+def load_matrix(uri):
+    """
+    Loads the matrix of a cooler URI (e.g. file.mcool::/resolutions/10000) into
+    a HiCMatrix object. Contrary to HiCMatrix.hiCMatrix(uri), the
+    balancing weights stored in the file are not applied because the
+    assembly uses the raw counts. Bins without contacts are marked as
+    nan bins, as done by HiCAssembler.merge_bins.
+    """
+    clr = cooler.Cooler(uri)
+    matrix = clr.matrix(balance=False, sparse=True)[:].tocsr()
+    bins = clr.bins()[['chrom', 'start', 'end']][:]
+    cut_intervals = IntervalTable.from_arrays([toString(chrom) for chrom in bins['chrom'].values],
+                                              bins['start'].values, bins['end'].values)
+
+    hic = HiCMatrix.hiCMatrix()
+    hic.setMatrix(HiCMatrix.hiCMatrix.fillLowerTriangle(matrix), cut_intervals)
+    hic.nan_bins = np.flatnonzero(hic.matrix.sum(0).A == 0)
+    return hic
+
+
+def closest_resolution(resolutions, bin_size):
+    """
+    Returns the (resolution, uri) tuple whose resolution is the closest to bin_size.
+    Ties are resolved in favour of the higher resolution.
+
+    >>> res = [(1000, 'a::/resolutions/1000'), (10000, 'a::/resolutions/10000'), (50000, 'a::/resolutions/50000')]
+    >>> closest_resolution(res, 25000)
+    (10000, 'a::/resolutions/10000')
+    >>> closest_resolution(res, 40000)
+    (50000, 'a::/resolutions/50000')
+    """
+    return min(resolutions, key=lambda res_uri: (abs(res_uri[0] - bin_size), res_uri[0]))
+
+
+def resolution_for_max_bins(resolutions, max_num_bins):
+    """
+    Returns the (resolution, uri) tuple of the highest resolution having no more
+    than max_num_bins bins. If all resolutions have more bins, the lowest
+    resolution is returned.
+    """
+    for resolution, uri in resolutions:
+        if cooler.Cooler(uri).info['nbins'] <= max_num_bins:
+            return resolution, uri
+    return resolutions[-1]
+
+
+def get_plot_uri(file_name, resolution=None, max_num_bins=None):
+    """
+    Selects the matrix of a .mcool file that should be used for plotting.
+    If a resolution is given, the closest resolution available is used. Otherwise,
+    the highest resolution with no more than max_num_bins is used, or the highest
+    resolution if max_num_bins is None. For any other file, the file name is returned.
+    """
+    if not is_mcool(file_name):
+        return file_name
+    resolutions = get_resolutions(file_name)
+    if resolution is not None:
+        resolution, uri = closest_resolution(resolutions, resolution)
+    elif max_num_bins is not None:
+        resolution, uri = resolution_for_max_bins(resolutions, max_num_bins)
+    else:
+        resolution, uri = resolutions[0]
+    log.info("Using matrix with resolution {:,} from {}".format(resolution, file_name))
+    return uri
@@ -4,7 +4,9 @@ def getParentArgParse(args=None):
     parser = argparse.ArgumentParser(add_help=False)
 
     parser.add_argument('--matrix', '-m',
-                        help = 'path of the  Hi-C matrix.',
+                        help = 'path of the  Hi-C matrix. For multi-resolution cooler files (.mcool) the highest '
+                               'resolution is used to detect misassemblies and the resolution closest to '
+                               '--bin_size is used for the assembly.',
                         required = True)
 
     return parser
@@ -17,3 +19,14 @@ def writableFile(string):
         msg = "{} file can be opened for writting".format(string)
         raise argparse.ArgumentTypeError(msg)
     return string
+
+
+def positiveInt(string):
+    try:
+        value = int(string)
+    except ValueError:
+        value = 0
+    if value < 1:
+        msg = "{} is not a positive integer".format(string)
+        raise argparse.ArgumentTypeError(msg)
+    return value
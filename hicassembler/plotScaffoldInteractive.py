@@ -21,6 +21,7 @@ from future.utils import itervalues
 
 import cooler
 import argparse
+import hicassembler.multiResolution as multiResolution
 import matplotlib.cm as cm
 import matplotlib.gridspec as gridspec
 from mpl_toolkits.axes_grid1 import make_axes_locatable
@@ -71,6 +72,11 @@ def parse_arguments(args=None):
                         type=float,
                         default=None)
 
+    parser.add_argument('--resolution',
+                        help='If the matrix is a multi-resolution cooler file (.mcool), the stored resolution '
+                             'closest to this value is plotted. By default, the highest resolution is used.',
+                        type=int)
+
     parser.add_argument('--dpi',
                         help='Resolution for the image in case the'
                              'ouput is a raster graphics image (e.g png, jpg)',
@@ -142,6 +148,7 @@ def getRegion(args, ma):
 def main(args=None):
     args = parse_arguments().parse_args(args)
 
+    args.matrix = multiResolution.get_plot_uri(args.matrix, resolution=args.resolution)
     ma = HiCMatrix.hiCMatrix(args.matrix)
     if args.clearMaskedBins:
         ma.maskBins(ma.nan_bins)
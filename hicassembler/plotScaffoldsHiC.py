@@ -21,6 +21,7 @@ from future.utils import itervalues
 
 import cooler
 import argparse
+import hicassembler.multiResolution as multiResolution
 import matplotlib.cm as cm
 import matplotlib.gridspec as gridspec
 from mpl_toolkits.axes_grid1 import make_axes_locatable
@@ -33,6 +34,8 @@ log = logging.getLogger(__name__)
 import warnings
 warnings.simplefilter(action="ignore", category=RuntimeWarning)
 
+MAX_NUM_BINS = 4000  # maximum number of bins to plot from a .mcool file if no --resolution is given
+
 
 def parse_arguments(args=None):
     parser = argparse.ArgumentParser(description='Creates a Heatmap of a HiC matrix')
@@ -107,6 +110,13 @@ def parse_arguments(args=None):
                         type=float,
                         default=None)
 
+    parser.add_argument('--resolution',
+                        help='If the matrix is a multi-resolution cooler file (.mcool), the stored resolution '
+                             'closest to this value is plotted. By default, the highest resolution is used for '
+                             '--region plots and the highest resolution having at most {} bins is used '
+                             'otherwise.'.format(MAX_NUM_BINS),
+                        type=int)
+
     parser.add_argument('--dpi',
                         help='Resolution for the image in case the'
                              'ouput is a raster graphics image (e.g png, jpg)',
@@ -346,9 +356,7 @@ def getRegion(args, ma):
             exit("Chromosome name {} in --region not in matrix".format(change_chrom_names(chrom)))
 
     args.region = [chrom, region_start, region_end]
-    is_cooler = False
-    if args.matrix.endswith('.cool') or cooler.io.is_cooler(args.matrix):
-        is_cooler = True
+    is_cooler = HiCMatrix.check_cooler(args.matrix)
     if is_cooler:
         idx1, start_pos1 = zip(*[(idx, x[1]) for idx, x in enumerate(ma.cut_intervals) if x[0] == chrom and
                                  ((x[1] >= region_start and x[2] < region_end) or
@@ -397,9 +405,10 @@ def main(args=None):
                   'compatible.')
         exit(1)
 
-    is_cooler = False
-    if args.matrix.endswith('.cool') or cooler.io.is_cooler(args.matrix):
-        is_cooler = True
+    # for multi-resolution files, a coarser resolution is read directly
+    args.matrix = multiResolution.get_plot_uri(args.matrix, resolution=args.resolution,
+                                               max_num_bins=None if args.region else MAX_NUM_BINS)
+    is_cooler = HiCMatrix.check_cooler(args.matrix)
     if is_cooler and not args.region2:
         log.debug("Retrieve data from cooler format and use its benefits.")
         regionsToRetrieve = None
@@ -0,0 +1,206 @@
+import itertools
+import numpy as np
+from scipy.sparse import csr_matrix
+from hicassembler.Scaffolds import Scaffolds
+from hicassembler.BandwidthScore import BandwidthScore
+
+
+def _bw(ma, paths):
+    """
+    Bandwidth of the paths computed by slicing the matrix, as done
+    before BandwidthScore was used.
+    """
+    indices = sum(paths, [])
+    ma = ma[indices, :][:, indices]
+    ma.setdiag(0)
+    return Scaffolds.bw(ma)
+
+
+def _exhaustive_permutation(ma, paths, return_all_sorted_best_paths=False, list_of_permutations=None,
+                            only_expand_but_not_permute=False):
+    """
+    Scaffolds.find_best_permutation before BandwidthScore was used: each
+    candidate is scored by slicing the matrix.
+    """
+    indices = sum(paths, [])
+    ma = ma[indices, :][:, indices]
+    ma.setdiag(0)
+    mapping = dict([(val, idx) for idx, val in enumerate(indices)])
+    bw_value = []
+    perm_list = []
+    if list_of_permutations is None:
+        if only_expand_but_not_permute:
+            candidates = Scaffolds.permute_paths(paths)
+        else:
+            candidates = itertools.chain.from_iterable(Scaffolds.permute_paths(perm)
+                                                       for perm in itertools.permutations(paths))
+    else:
+        candidates = list_of_permutations
+    for expnd in candidates:
+        if expnd[::-1] in perm_list:
+            continue
+        mapped_perm = [mapping[x] for x in sum(expnd, [])]
+        bw_value.append(Scaffolds.bw(ma[mapped_perm, :][:, mapped_perm]))
+        perm_list.append(expnd)
+
+    if return_all_sorted_best_paths is True:
+        order = np.argsort(bw_value)
+        return [(perm_list[x], bw_value[x]) for x in order]
+    return perm_list[bw_value.index(min(bw_value))]
+
+
+def _exhaustive_direction(ma, paths):
+    """
+    Scaffolds.find_best_direction before BandwidthScore was used.
+    """
+    min_value = np.Inf
+    best_path = paths[:]
+    seen = set()
+    for idx, sub_path in enumerate(paths):
+        if len(sub_path) == 1:
+            continue
+        for orientation in ['+', '-']:
+            sub_path_oriented = sub_path[:] if orientation == '+' else sub_path[::-1]
+            path_to_test = best_path[:idx] + [sub_path_oriented] + best_path[idx + 1:]
+            if tuple(sum(path_to_test, [])) in seen:
+                continue
+            seen.add(tuple(sum(path_to_test, [])))
+            bw_value = _bw(ma, path_to_test)
+            if bw_value < min_value:
+                best_path = path_to_test
+                min_value = bw_value
+    return best_path
+
+
+def _random_case(rs, kind, num_paths, max_path_len=3):
+    """
+    Returns a random matrix and a random split of its shuffled bins into `num_paths` paths.
+    kind is 'symmetric', 'asymmetric' or 'ties' (a symmetric matrix with few distinct
+    integer values, such that many arrangements have the same bandwidth)
+    """
+    lengths = rs.randint(1, max_path_len + 1, num_paths)
+    num_bins = lengths.sum()
+    if kind == 'ties':
+        matrix = rs.randint(0, 3, (num_bins, num_bins)) * (rs.rand(num_bins, num_bins) < 0.3)
+    else:
+        matrix = rs.rand(num_bins, num_bins) * (rs.rand(num_bins, num_bins) < 0.6)
+    if kind != 'asymmetric':
+        matrix = np.triu(matrix) + np.triu(matrix, 1).T
+    bins = [int(x) for x in rs.permutation(num_bins)]
+    paths = [bins[start:start + length] for start, length in zip(np.cumsum(lengths) - lengths, lengths)]
+    return csr_matrix(matrix.astype(float)), paths
+
+
+KINDS = ['symmetric', 'asymmetric', 'ties']
+
+
+def test_evaluate_flip_swap():
+    rs = np.random.RandomState(1)
+    for kind in KINDS:
+        for num_paths in range(1, 8):
+            ma, paths = _random_case(rs, kind, num_paths)
+            score = BandwidthScore(ma, paths)
+            order = [int(x) for x in rs.permutation(num_paths)]
+            reverse = (rs.rand(num_paths) < 0.5).tolist()
+            assert np.isclose(score.evaluate(order, reverse), _bw(ma, score.get_paths(order, reverse)))
+            for _ in range(10):
+                if num_paths == 1 or rs.rand() < 0.5:
+                    value = score.flip(rs.randint(num_paths))
+                else:
+                    value = score.swap(rs.randint(num_paths - 1))
+                assert np.isclose(value, _bw(ma, score.get_paths()))
+
+            arrangements = score.get_arrangement_flips(order)
+            values = [_bw(ma, score.get_paths(x, y)) for x, y in arrangements]
+            assert np.allclose(score.evaluate_batch(arrangements), values)
+            assert np.allclose([score.evaluate(x, y) for x, y in arrangements], values)
+            assert score.get_arrangement(score.get_paths(order, reverse)) == \
+                (order, [x and len(paths[idx]) > 1 for idx, x in enumerate(reverse)])
+
+
+def test_find_best_permutation_exhaustive():
+    """
+    Up to MAX_PATHS_EXHAUSTIVE_ORDER paths, the same candidates are evaluated
+    in the same order, thus, the same best permutation should be returned, also for ties.
+    """
+    rs = np.random.RandomState(2)
+    for kind in KINDS:
+        for num_paths in range(1, 5):
+            for _ in range(5):
+                ma, paths = _random_case(rs, kind, num_paths)
+                assert Scaffolds.find_best_permutation(ma, paths) == _exhaustive_permutation(ma, paths)
+
+
+def test_find_best_permutation_all_sorted():
+    rs = np.random.RandomState(3)
+    for kind in KINDS:
+        for num_paths in range(1, 5):
+            ma, paths = _random_case(rs, kind, num_paths)
+            result = Scaffolds.find_best_permutation(ma, paths, return_all_sorted_best_paths=True)
+            expected = _exhaustive_permutation(ma, paths, return_all_sorted_best_paths=True)
+            assert np.allclose([x[1] for x in result], [x[1] for x in expected])
+            if kind == 'ties':
+                # the integer values are exact, thus the order of the ties is the same
+                assert result == expected
+            else:
+                assert sorted([x[0] for x in result]) == sorted([x[0] for x in expected])
+
+            list_of_permutations = [x[0] for x in expected][::2]
+            assert Scaffolds.find_best_permutation(ma, paths, list_of_permutations=list_of_permutations) == \
+                _exhaustive_permutation(ma, paths, list_of_permutations=list_of_permutations)
+
+
+def test_find_best_permutation_only_expand():
+    """
+    For more than MAX_PATHS_EXHAUSTIVE_ORIENTATION paths with more than one bin,
+    BandwidthScore.best_orientation is used instead of evaluating all the orientations.
+    """
+    rs = np.random.RandomState(4)
+    for kind in KINDS:
+        for num_paths in range(1, 8):
+            for _ in range(3):
+                ma, paths = _random_case(rs, kind, num_paths)
+                result = Scaffolds.find_best_permutation(ma, paths, only_expand_but_not_permute=True)
+                expected = _exhaustive_permutation(ma, paths, only_expand_but_not_permute=True)
+                assert np.isclose(_bw(ma, result), _bw(ma, expected))
+                if kind == 'ties':
+                    # for ties, the paths are not flipped as in the exhaustive search
+                    assert result == expected
+
+
+def test_find_best_direction():
+    rs = np.random.RandomState(5)
+    for kind in KINDS:
+        for num_paths in range(1, 8):
+            for _ in range(3):
+                ma, paths = _random_case(rs, kind, num_paths)
+                assert Scaffolds.find_best_direction(ma, paths) == _exhaustive_direction(ma, paths)
+
+
+def test_find_best_permutation_branch_and_bound():
+    """
+    For more than MAX_PATHS_EXHAUSTIVE_ORDER paths, the branch and bound search should
+    find an arrangement having the minimum bandwidth. For 5 paths, the minimum is
+    computed by the exhaustive search. For 7 paths, the brute force search scores
+    all the arrangements using BandwidthScore.evaluate_batch (see test_evaluate_flip_swap).
+    """
+    rs = np.random.RandomState(6)
+    for kind in KINDS:
+        for _ in range(2):
+            ma, paths = _random_case(rs, kind, 5, max_path_len=2)
+            search_stats = {}
+            result = Scaffolds.find_best_permutation(ma, paths, search_stats=search_stats)
+            assert search_stats == {'searches': 1, 'optimal': 1}
+            assert np.isclose(_bw(ma, result), _bw(ma, _exhaustive_permutation(ma, paths)))
+
+        for _ in range(2):
+            ma, paths = _random_case(rs, kind, 7, max_path_len=2)
+            score = BandwidthScore(ma, paths)
+            order, reverse, is_optimal = score.best_arrangement()
+            assert is_optimal
+            assert order[0] < order[-1]
+            arrangements = [x for perm in itertools.permutations(range(7)) if perm[0] < perm[-1]
+                            for x in score.get_arrangement_flips(perm)]
+            brute_force = score.evaluate_batch(arrangements).min()
+            assert np.isclose(score.evaluate(order, reverse), brute_force)
+            assert np.isclose(_bw(ma, Scaffolds.find_best_permutation(ma, paths)), brute_force)
@@ -0,0 +1,404 @@
+import os.path
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, triu
+import cooler
+import networkx as nx
+import hicexplorer.HiCMatrix as HiCMatrix
+import hicassembler.HiCAssembler as HiCAssembler
+from hicassembler.Scaffolds import Scaffolds, get_test_matrix
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../data/")
+
+
+def assemble(out_folder, dtype, num_iterations=1, cache_dir=None):
+    os.makedirs(out_folder)
+    H = HiCAssembler.HiCAssembler(ROOT + "hic_small.h5", None, out_folder, min_scaffold_length=100000,
+                                  matrix_bin_size=5000, misassembly_zscore_threshold=-1.0,
+                                  num_iterations=num_iterations, num_processors=1, dtype=dtype,
+                                  cache_dir=cache_dir)
+    return H, H.assemble_contigs()
+
+
+def test_assembly_order():
+    """
+    The order of the scaffolds of hic_small.h5. The X and 2L scaffolds are joined
+    and the small X scaffolds are put back as separated paths.
+    """
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        H, order = assemble(out_folder + "/float64", "float64", num_iterations=2)
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert order == [[('2L:0-305840(+)', 59236, 303410, '+'), ('2L:305900-611856(-)', 1378, 305956, '-'),
+                      ('2L:611916-920243(-)', 0, 308164, '-'), ('2L:920303-1234732(-)', 5388, 309997, '-'),
+                      ('X:232641-529858(-)', 0, 286949, '-'), ('X:529918-845891(+)', 3043, 315973, '+'),
+                      ('X:845951-1152429(-)', 0, 306478, '-'), ('X:1152489-1460680(+)', 1874, 306587, '+')],
+                     [('X:187262-212208(+)', 0, 13745, '-'), ('X:172057-186647(-)', 0, 13263, '+'),
+                      ('X:111714-172055(+)', 11786, 58733, '-')],
+                     [('X:111714-172055(+)', 0, 7956, '+')]]
+
+
+def test_float32_assembly_order():
+    """
+    The assembly using reduced precision matrices should produce the same order.
+    """
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        H_64, order_64 = assemble(out_folder + "/float64", "float64")
+        H_32, order_32 = assemble(out_folder + "/float32", "float32")
+    finally:
+        shutil.rmtree(out_folder)
+
+    # hic_small.h5 is a corrected matrix, thus the values are stored as float32
+    assert H_64.hic.matrix.dtype == 'float64'
+    assert H_32.hic.matrix.dtype == 'float32'
+    assert H_32.scaffolds_graph.matrix.dtype == 'float32'
+    assert order_32 == order_64
+
+
+def test_matrix_cache_dtype():
+    """
+    Runs with different dtypes sharing the same matrix cache should
+    not reuse the matrix cached using the other dtype.
+    """
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    cache_dir = out_folder + "/matrix_cache"
+    try:
+        H_32, order_32 = assemble(out_folder + "/float32", "float32", num_iterations=2, cache_dir=cache_dir)
+        H_64, order_64 = assemble(out_folder + "/float64", "float64", num_iterations=2, cache_dir=cache_dir)
+        num_cache_entries = len(H_64.matrix_cache.manifest)
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert num_cache_entries == 2
+    assert H_32.hic.matrix.dtype == 'float32'
+    assert H_64.hic.matrix.dtype == 'float64'
+    assert H_64.scaffolds_graph.matrix.dtype == 'float64'
+    assert order_32 == order_64
+
+
+def get_count_matrix(bin_size=1000, num_bins=20, scaffolds=('a', 'b', 'c')):
+    """
+    Returns the bins and the matrix of integer counts of scaffolds of `num_bins` bins whose contacts
+    decay with the distance. The counts are stored as float64 as in the matrices of raw counts
+    saved by some tools.
+    """
+    bins = [(scaff, idx * bin_size, (idx + 1) * bin_size, 1) for scaff in scaffolds for idx in range(num_bins)]
+    position = np.arange(len(bins))
+    distance = np.abs(position[:, None] - position[None, :])
+    same_scaffold = (position[:, None] // num_bins) == (position[None, :] // num_bins)
+    counts = np.where(same_scaffold, np.floor(1000.0 / (1 + distance)), 1.0)
+    return bins, csr_matrix(counts)
+
+
+def get_cached_matrix(H):
+    """
+    Loads the only matrix of the cache of the HiCAssembler object.
+    """
+    assert len(H.matrix_cache.manifest) == 1
+    entry = list(H.matrix_cache.manifest.values())[0]
+    return HiCMatrix.hiCMatrix(os.path.join(H.matrix_cache.cache_dir, entry['file']))
+
+
+def test_matrix_cache_dtype_reduced_h5():
+    """
+    The matrix reduced while reading the h5 file is cast to the given dtype before it is cached.
+    """
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        bins, matrix = get_count_matrix()
+        hic = HiCMatrix.hiCMatrix()
+        hic.setMatrix(matrix, bins)
+        hic.nan_bins = []
+        hic.save(out_folder + "/matrix.h5")
+
+        H = HiCAssembler.HiCAssembler(out_folder + "/matrix.h5", None, out_folder, split_misassemblies=False,
+                                      min_scaffold_length=1000, matrix_bin_size=2000, num_processors=1,
+                                      dtype='float32')
+        cached_hic = get_cached_matrix(H)
+        merged_hic = HiCAssembler.HiCAssembler.merge_bins(HiCMatrix.hiCMatrix(out_folder + "/matrix.h5"), 2)
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert cached_hic.matrix.dtype == 'int32'
+    assert np.array_equal(cached_hic.matrix.todense(), merged_hic.matrix.todense())
+
+
+def test_matrix_cache_dtype_mcool():
+    """
+    The matrix loaded from a multi-resolution cooler file is cast to the given dtype before it is cached.
+    """
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        for idx, bin_size in enumerate([1000, 2000]):
+            bins, matrix = get_count_matrix(bin_size=bin_size, num_bins=20 // (idx + 1))
+            pixels = triu(matrix, format='coo')
+            cooler.io.create("{}/matrix.mcool::/resolutions/{}".format(out_folder, bin_size),
+                             pd.DataFrame([x[:3] for x in bins], columns=['chrom', 'start', 'end']),
+                             {'bin1_id': pixels.row, 'bin2_id': pixels.col, 'count': pixels.data},
+                             dtype={'count': np.float64}, append=idx > 0)
+
+        H = HiCAssembler.HiCAssembler(out_folder + "/matrix.mcool", None, out_folder, split_misassemblies=False,
+                                      min_scaffold_length=1000, matrix_bin_size=2000, num_processors=1,
+                                      dtype='float32')
+        cached_hic = get_cached_matrix(H)
+    finally:
+        shutil.rmtree(out_folder)
+
+    # the matrix of the 2000 bp resolution is used
+    assert cached_hic.matrix.dtype == 'int32'
+    assert np.array_equal(cached_hic.matrix.todense(), matrix.todense())
+
+
+def load_split_h5_matrix(out_folder):
+    """
+    Saves a matrix whose scaffold 'a' has bins of 500 bp while the other scaffolds have bins of 1000 bp
+    together with a bed file whose region removes 6 bins of 'a'. Then, the matrix is
+    loaded without detecting misassemblies, thus, it is reduced while reading the h5 file.
+    """
+    bins = [('a', idx * 500, (idx + 1) * 500, 1) for idx in range(20)] + \
+        [(scaff, idx * 1000, (idx + 1) * 1000, 1) for scaff in ('b', 'c') for idx in range(10)]
+    _, matrix = get_count_matrix(num_bins=40, scaffolds=('a',))
+    hic = HiCMatrix.hiCMatrix()
+    hic.setMatrix(matrix, bins)
+    hic.nan_bins = []
+    hic.save(out_folder + "/matrix.h5")
+    with open(out_folder + "/split.bed", 'w') as fh:
+        fh.write("a\t2600\t5800\n")
+
+    return HiCAssembler.HiCAssembler(out_folder + "/matrix.h5", None, out_folder, split_misassemblies=False,
+                                     split_positions_file=out_folder + "/split.bed", min_scaffold_length=1000,
+                                     matrix_bin_size=2000, num_processors=1)
+
+
+def test_split_positions_file_without_misassembly_detection():
+    """
+    The positions of the split_positions_file are split even if the misassemblies are not detected.
+    """
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        H = load_split_h5_matrix(out_folder)
+        cached_hic = get_cached_matrix(H)
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert sorted(set([x[0] for x in cached_hic.cut_intervals])) == ['a/1', 'a/2', 'b', 'c']
+
+
+def test_reduced_h5_matrix_bin_size_after_split():
+    """
+    The bin size used to merge the bins is computed after the bins within the split
+    regions are removed, as when the matrix is loaded into memory, split and merged.
+    Removing the bins changes the median bin size from 500 to 1000 bp.
+    """
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        H = load_split_h5_matrix(out_folder)
+        cached_hic = get_cached_matrix(H)
+
+        H.hic = HiCMatrix.hiCMatrix(out_folder + "/matrix.h5")
+        H.split_misassemblies(out_folder + "/matrix.h5", out_folder + "/split.bed", detect_misassemblies=False)
+        assert H.hic.getBinSize() == 1000
+        merged_hic = HiCAssembler.HiCAssembler.merge_bins(H.hic, 2)
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert [x[:3] for x in cached_hic.cut_intervals] == [x[:3] for x in merged_hic.cut_intervals]
+    assert np.allclose(cached_hic.matrix.todense(), merged_hic.matrix.todense())
+
+
+def test_put_back_small_scaffolds_no_stats():
+    """
+    If the scaffolds are too short to be split into parts of min_scaffold_length, there
+    are no stats per split to set the confidence score, which falls back to a percentile
+    of the scaffold contacts.
+    """
+    cut_intervals = [('c-0', 0, 10, 1), ('c-0', 10, 20, 1), ('c-1', 0, 10, 1),
+                     ('c-2', 0, 10, 1), ('c-2', 10, 20, 1)]
+    A = csr_matrix(np.array([[50, 19, 9, 3, 1],
+                             [19, 50, 19, 8, 3],
+                             [9, 19, 50, 19, 9],
+                             [3, 8, 19, 50, 19],
+                             [1, 3, 9, 19, 50]]))
+    hic = get_test_matrix(cut_intervals=cut_intervals, matrix=A)
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        H = HiCAssembler.HiCAssembler(hic, "", out_folder, split_misassemblies=False,
+                                      min_scaffold_length=15, use_log=False)
+        H.scaffolds_graph.split_and_merge_contigs(num_splits=1, normalize_method='none')
+        H.scaffolds_graph.add_edge(0, 1)
+        H.put_back_small_scaffolds(normalize_method='none')
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert list(H.scaffolds_graph.scaffold.get_all_paths()) == [['c-2', 'c-1', 'c-0']]
+
+
+def _make_scaffold_network_by_edge(H, orig_scaff, confidence_score=None):
+    """
+    Makes the scaffold network adding the edges one by one, as make_scaffold_network
+    did before the edges were added in bulk.
+    """
+    nxG = nx.Graph()
+    for node_id, node in orig_scaff.scaffold.node.iteritems():
+        nn = node.copy()
+        for attr, value in nn.iteritems():
+            if isinstance(value, np.int64):
+                nn[attr] = int(value)
+            elif isinstance(value, np.float64):
+                nn[attr] = float(value)
+            elif isinstance(value, list):
+                nn[attr] = ", ".join([str(x) for x in value])
+            elif isinstance(value, np.string_):
+                nn[attr] = str(value)
+
+        if node_id in H.scaffolds_graph.scaffold.node:
+            nn['is_backbone'] = 1
+        nxG.add_node(node_id, **nn)
+
+    matrix = orig_scaff.matrix.tocoo()
+    max_weight = float(orig_scaff.matrix.max() * 1.5)
+    for u, v, weight in zip(matrix.row, matrix.col, matrix.data):
+        if u == v:
+            continue
+        if weight < confidence_score:
+            continue
+        scaff_u = orig_scaff.pg_base.node[u]['name']
+        scaff_v = orig_scaff.pg_base.node[v]['name']
+        nxG.add_edge(scaff_u, scaff_v, weight=float(weight))
+        if scaff_u in H.scaffolds_graph.scaffold.node and \
+           scaff_v in H.scaffolds_graph.scaffold.node and \
+           scaff_u in H.scaffolds_graph.scaffold.adj[scaff_v]:
+            nxG.add_edge(scaff_u, scaff_v, weight=float(max_weight))
+
+    for path in H.scaffolds_graph.scaffold.get_all_paths():
+        for scaff_u, scaff_v in zip(path[:-1], path[1:]):
+            nxG.add_edge(scaff_u, scaff_v, weight=float(max_weight))
+    return nxG
+
+
+def test_make_scaffold_network_by_edge():
+    """
+    The scaffold network should be the same as the network made edge by edge. The node
+    attributes and the weights should be python types that can be saved as GraphML.
+    """
+    num_bins = [4, 1, 3, 2, 4, 3]
+    cut_intervals = [('c-{}'.format(scaff), idx * 10, (idx + 1) * 10, 1)
+                     for scaff, size in enumerate(num_bins) for idx in range(size)]
+    rs = np.random.RandomState(0)
+    A = np.triu(rs.randint(1, 50, size=(len(cut_intervals), len(cut_intervals))))
+    A = csr_matrix(A + np.triu(A, k=1).T)
+    hic = get_test_matrix(cut_intervals=cut_intervals, matrix=A)
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        # the scaffolds shorter than 30 are not part of the scaffolds graph
+        H = HiCAssembler.HiCAssembler(hic, "", out_folder, split_misassemblies=False,
+                                      min_scaffold_length=25, use_log=False)
+        H.scaffolds_graph.split_and_merge_contigs(num_splits=1, normalize_method='none')
+        H.scaffolds_graph.add_edge(0, 1)
+        H.scaffolds_graph.add_edge(2, 3)
+        orig_scaff = Scaffolds(H.hic)
+        orig_scaff.split_and_merge_contigs(num_splits=1, normalize_method='none')
+
+        for confidence_score in [None, np.percentile(orig_scaff.matrix.data, 50)]:
+            G = H.make_scaffold_network(orig_scaff, confidence_score=confidence_score)
+            expected = _make_scaffold_network_by_edge(H, orig_scaff, confidence_score=confidence_score)
+            assert list(G.nodes(data=True)) == list(expected.nodes(data=True))
+            assert list(G.edges(data=True)) == list(expected.edges(data=True))
+            for node_id, attr in G.nodes(data=True):
+                for value in attr.values():
+                    assert type(value) in (int, float, str)
+            for u, v, attr in G.edges(data=True):
+                assert type(attr['weight']) == float
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert [node_id for node_id, attr in G.nodes(data=True) if 'is_backbone' in attr] == \
+        [node_id for node_id in G if node_id in H.scaffolds_graph.scaffold.node]
+    assert len(list(H.scaffolds_graph.scaffold.get_all_paths())) == 2
+
+
+def test_tad_score_boundaries_num_processors():
+    """
+    The misassembly scores are computed per group of scaffolds, thus, the boundaries
+    do not depend on the number of processors.
+    """
+    hic = HiCMatrix.hiCMatrix(ROOT + "hic_small.h5")
+    bin_size = hic.getBinSize()
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    boundaries = []
+    try:
+        for num_processors in [1, 3]:
+            os.makedirs(out_folder + "/{}".format(num_processors))
+            H = HiCAssembler.HiCAssembler(get_test_matrix(), None, out_folder + "/{}".format(num_processors),
+                                          num_processors=num_processors)
+            boundaries.append(H.get_tad_score_boundaries(hic, min(200000, bin_size * 200),
+                                                         max(800000, bin_size * 500), bin_size * 50))
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert len(boundaries[0]) > 0
+    assert boundaries[0] == boundaries[1]
+
+
+def test_tad_score_boundaries_input_matrix():
+    """
+    The TAD-scores saved for a matrix are not reused for a different input matrix
+    having the same bin size.
+    """
+    hic = HiCMatrix.hiCMatrix(ROOT + "hic_small.h5")
+    other_hic = HiCMatrix.hiCMatrix(ROOT + "hic_small.h5")
+    other_hic.matrix.data = other_hic.matrix.data ** 2
+    bin_size = hic.getBinSize()
+    depths = (min(200000, bin_size * 200), max(800000, bin_size * 500), bin_size * 50)
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        os.makedirs(out_folder + "/other")
+        H_other = HiCAssembler.HiCAssembler(get_test_matrix(), None, out_folder + "/other", num_processors=1)
+        H_other.matrix_digest = 'other'
+        expected = H_other.get_tad_score_boundaries(other_hic, *depths)
+
+        H = HiCAssembler.HiCAssembler(get_test_matrix(), None, out_folder, num_processors=1)
+        H.matrix_digest = 'small'
+        boundaries = H.get_tad_score_boundaries(hic, *depths)
+        H.matrix_digest = 'other'
+        other_boundaries = H.get_tad_score_boundaries(other_hic, *depths)
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert boundaries != expected
+    assert other_boundaries == expected
+
+
+def test_band_score_boundaries_input_matrix():
+    """
+    The band scores saved for a matrix are not reused for a different input matrix
+    having the same bin size.
+    """
+    hic = HiCMatrix.hiCMatrix(ROOT + "hic_small.h5")
+    other_hic = HiCMatrix.hiCMatrix(ROOT + "hic_small.h5")
+    other_hic.matrix.data = other_hic.matrix.data ** 2
+    bin_size = hic.getBinSize()
+    depths = (min(200000, bin_size * 200), max(800000, bin_size * 500), bin_size * 50)
+    out_folder = tempfile.mkdtemp(prefix="hicassembler_test_")
+    try:
+        os.makedirs(out_folder + "/other")
+        H_other = HiCAssembler.HiCAssembler(get_test_matrix(), None, out_folder + "/other",
+                                            misassembly_detector='native')
+        H_other.matrix_digest = 'other'
+        expected = H_other.get_band_score_boundaries(other_hic, *depths)
+
+        H = HiCAssembler.HiCAssembler(get_test_matrix(), None, out_folder, misassembly_detector='native')
+        H.matrix_digest = 'small'
+        boundaries = H.get_band_score_boundaries(hic, *depths)
+        H.matrix_digest = 'other'
+        other_boundaries = H.get_band_score_boundaries(other_hic, *depths)
+    finally:
+        shutil.rmtree(out_folder)
+
+    assert boundaries != expected
+    assert other_boundaries == expected
@@ -1,6 +1,9 @@
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, triu
 import numpy as np
+import networkx as nx
+import pytest
 import hicexplorer.HiCMatrix as HiCMatrix
+from hicexplorer.reduceMatrix import reduce_matrix
 from hicassembler.Scaffolds import Scaffolds
 
 
@@ -88,6 +91,318 @@ class TestClass:
         # the node names are the merge of the original start and end positions
         assert S.pg_base.node[2] == {'start': 40, 'length': 20, 'end': 60, 'name': 'c-0', 'coverage': 1.0}
 
+
+def test_init_path_graph_non_consecutive_bins():
+    """
+    The bins of each scaffold should be consecutive, otherwise
+    the path of the scaffold can not be built.
+    """
+    cut_intervals = [('c-0', 0, 10, 1), ('c-0', 10, 20, 1), ('c-1', 0, 10, 1),
+                     ('c-0', 20, 30, 1), ('c-2', 0, 10, 1)]
+    hic = get_test_matrix(cut_intervals=cut_intervals)
+    with pytest.raises(ValueError) as error:
+        Scaffolds(hic)
+    assert "c-0" in str(error.value)
+
+
+def get_random_matrix(seed, num_bins=60, dtype=np.int64):
+    """
+    Random symmetric matrix, with about a third of non zero values, of integer or float values.
+    """
+    rs = np.random.RandomState(seed)
+    matrix = rs.randint(1, 100, size=(num_bins, num_bins)).astype(dtype)
+    if dtype == np.float64:
+        matrix = matrix * rs.rand(num_bins, num_bins)
+    matrix[rs.rand(num_bins, num_bins) < 0.66] = 0
+    matrix = np.triu(matrix)
+    return csr_matrix(matrix + np.triu(matrix, k=1).T)
+
+
+def test_reduce_hic_matrix_incremental():
+    """
+    The incremental reduction of the matrix, which reuses the values of the paths that
+    did not change, should be the same as the reduction of the whole matrix.
+    """
+    for dtype in [np.int64, np.int32, np.float64]:
+        for seed in range(5):
+            matrix = get_random_matrix(seed, dtype=dtype)
+            if dtype == np.int32:
+                # the sums of some paths do not fit into int32
+                matrix = matrix * (2 ** 24)
+            cut_intervals = [('c-0', x * 10, (x + 1) * 10, 1) for x in range(matrix.shape[0])]
+            hic = HiCMatrix.hiCMatrix()
+            hic.nan_bins = []
+            hic.setMatrix(matrix, cut_intervals)
+            S = Scaffolds(hic)
+
+            rs = np.random.RandomState(seed)
+            bins = rs.permutation(matrix.shape[0]).tolist()
+            # paths of 1 to 4 bins. Some bins are not part of any path.
+            paths = []
+            while len(bins) > 5:
+                size = rs.randint(1, 5)
+                paths.append(bins[:size])
+                bins = bins[size:]
+
+            S.reduce_hic_matrix(paths, incremental=False)
+            for step in range(4):
+                # join two paths, split a path, invert a path and reorder the
+                # paths such that most, but not all, paths are reused.
+                prev_paths = set([tuple(x) for x in paths])
+                paths = [paths[0] + paths[1]] + paths[2:]
+                longest = max(range(len(paths)), key=lambda x: len(paths[x]))
+                paths = paths[:longest] + [paths[longest][:1], paths[longest][1:]] + paths[longest + 1:]
+                paths[-1] = paths[-1][::-1]
+                paths = [paths[x] for x in rs.permutation(len(paths))]
+                assert len(prev_paths.intersection([tuple(x) for x in paths])) >= len(paths) / 2
+
+                reduced = S.reduce_hic_matrix(paths, incremental=True)
+                if dtype == np.int32:
+                    expected = reduce_matrix(matrix.astype(np.int64), paths, diagonal=True)
+                else:
+                    expected = reduce_matrix(matrix, paths, diagonal=True)
+                if dtype != np.float64:
+                    assert (reduced != expected).nnz == 0
+                    assert reduced.dtype == S.reduce_hic_matrix(paths, incremental=False).dtype
+                else:
+                    assert np.allclose(reduced.todense(), expected.todense())
+                assert np.allclose(reduced.todense(), S.reduce_hic_matrix(paths, incremental=False).todense())
+
+
+def _stats_per_distance_by_path(matrix, paths):
+    """
+    Stats per distance computed by slicing the matrix for each path, as
+    done before Scaffolds.summarize_by_distance was used.
+    """
+    dist_dict = dict()
+    for path in paths:
+        sub_m = triu(matrix[path, :][:, path], k=1, format='coo')
+        dist_list = sub_m.col - sub_m.row
+        for distance in np.unique(dist_list):
+            if distance not in dist_dict:
+                dist_dict[distance] = sub_m.data[dist_list == distance]
+            else:
+                dist_dict[distance] = np.hstack([dist_dict[distance], sub_m.data[dist_list == distance]])
+
+    return dict([(k, {'mean': np.mean(v), 'median': np.median(v), 'max': np.max(v), 'min': np.min(v),
+                      'len': len(v)}) for k, v in dist_dict.iteritems()])
+
+
+def test_stats_per_distance_by_path():
+    """
+    The stats per distance computed at once for all paths should be the same
+    as those computed path by path. Paths of less than 3 bins and a path whose
+    bins are in decreasing order are included.
+    """
+    for dtype in [np.int64, np.float64]:
+        for seed in range(5):
+            matrix = get_random_matrix(seed, dtype=dtype)
+            rs = np.random.RandomState(seed)
+            cut_intervals = []
+            while len(cut_intervals) < matrix.shape[0]:
+                scaff_name = 'c-{}'.format(len(cut_intervals))
+                for idx in range(min(rs.randint(1, 8), matrix.shape[0] - len(cut_intervals))):
+                    cut_intervals.append((scaff_name, idx * 10, (idx + 1) * 10, 1))
+            hic = HiCMatrix.hiCMatrix()
+            hic.nan_bins = []
+            hic.setMatrix(matrix, cut_intervals)
+            S = Scaffolds(hic)
+            S.pg_base.path['c-0'] = S.pg_base.path['c-0'][::-1]
+
+            paths = S.pg_base.path.values()
+            expected = _stats_per_distance_by_path(S.matrix, paths)
+            path_length = [S.pg_base.node[n]['length'] for path in paths for n in path]
+            mean_length, sd_length, stats_per_distance = S.get_stats_per_distance()
+            stats_per_split = S.get_stats_per_split()
+
+            assert mean_length == np.mean(path_length)
+            assert sd_length == np.std(path_length)
+            for stats in [stats_per_distance, stats_per_split]:
+                assert sorted(stats.keys()) == sorted(expected.keys())
+                for distance, values in expected.iteritems():
+                    for key in ['median', 'max', 'min', 'len']:
+                        assert stats[distance][key] == values[key]
+                    assert np.isclose(stats[distance]['mean'], values['mean'])
+
+
+def test_split_and_merge_contigs_again():
+    """
+    Merging the contigs of a Scaffolds object that was already split (as in put_back_small_scaffolds)
+    should give the same result as merging the contigs of a new Scaffolds object.
+    """
+    for dtype in [np.int64, np.float64]:
+        for seed in range(3):
+            matrix = get_random_matrix(seed, dtype=dtype)
+            rs = np.random.RandomState(seed)
+            cut_intervals = []
+            while len(cut_intervals) < matrix.shape[0]:
+                scaff_name = 'c-{}'.format(len(cut_intervals))
+                for idx in range(min(rs.randint(1, 8), matrix.shape[0] - len(cut_intervals))):
+                    cut_intervals.append((scaff_name, idx * 10, (idx + 1) * 10, 1))
+            hic = HiCMatrix.hiCMatrix()
+            hic.nan_bins = []
+            hic.setMatrix(matrix, cut_intervals)
+
+            expected = Scaffolds(hic)
+            expected.split_and_merge_contigs(num_splits=1, normalize_method='ice')
+            S = Scaffolds(hic)
+            S.split_and_merge_contigs(num_splits=1, target_size=30, normalize_method='ice')
+            S.split_and_merge_contigs(num_splits=1, normalize_method='ice', incremental=False)
+
+            assert (S.matrix != expected.matrix).nnz == 0
+            assert S.pg_base.node == expected.pg_base.node
+            assert S.pg_base.path == expected.pg_base.path
+            assert S.matrix_bins.node == expected.matrix_bins.node
+            assert S.scaffold.node == expected.scaffold.node
+
+
+def _prune_by_node(S, confidence_score, node_degree_threshold=None):
+    """
+    Removes the contacts of the internal nodes of paths and the hubs node by node, as
+    join_paths_max_span_tree did before a single mask was used. Unlike the previous code,
+    which only removed the (node, adj_node) value, the contacts are removed symmetrically.
+    """
+    matrix = S.matrix.copy()
+    matrix.data[matrix.data <= confidence_score] = 0
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+
+    internal_nodes = []
+    for path in S.get_all_paths(pg_base=True):
+        if len(path) > 3:
+            internal_nodes.extend(path[1:-1])
+
+    node_degree = dict([(x, matrix[x, :].nnz) for x in range(matrix.shape[0])])
+    matrix = matrix.tolil()
+    for node in internal_nodes:
+        if node_degree[node] > 2:
+            for adj_node in np.flatnonzero(matrix[node, :].todense().A):
+                if adj_node not in S.pg_base.adj[node].keys():
+                    matrix[node, adj_node] = 0
+                    matrix[adj_node, node] = 0
+
+    if node_degree_threshold is None:
+        node_degree_threshold = np.percentile(node_degree.values(), 99)
+    to_remove = [node for node, degree in node_degree.iteritems() if degree >= node_degree_threshold]
+    if len(to_remove) > 0:
+        matrix[to_remove, :] = 0
+        matrix[:, to_remove] = 0
+    matrix = matrix.tocsr()
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def test_join_paths_max_span_tree_pruning():
+    """
+    The matrix used for the maximum spanning tree should be the same as the matrix
+    pruned node by node. The contacts of the internal nodes should be removed from both
+    triangles of the matrix, such that the graph only links them to their path neighbors.
+    """
+    for seed in range(5):
+        matrix = get_random_matrix(seed, num_bins=200)
+        rs = np.random.RandomState(seed)
+        cut_intervals = []
+        while len(cut_intervals) < matrix.shape[0]:
+            scaff_name = 'c-{}'.format(len(cut_intervals))
+            for idx in range(min(rs.randint(5, 11), matrix.shape[0] - len(cut_intervals))):
+                cut_intervals.append((scaff_name, idx * 10, (idx + 1) * 10, 1))
+        hic = HiCMatrix.hiCMatrix()
+        hic.nan_bins = []
+        hic.setMatrix(matrix, cut_intervals)
+        S = Scaffolds(hic)
+        # split each contig such that the paths have internal nodes
+        S.split_and_merge_contigs(num_splits=5, normalize_method='none')
+        confidence_score = np.median(S.matrix.data)
+        node_degree_threshold = 20 if seed % 2 else None
+
+        expected = _prune_by_node(S, confidence_score, node_degree_threshold=node_degree_threshold)
+        internal_nodes = [node for path in S.get_all_paths(pg_base=True) for node in path[1:-1] if len(path) > 3]
+        path_neighbors = dict([(node, S.pg_base.adj[node].keys()) for node in internal_nodes])
+        S.join_paths_max_span_tree(confidence_score, node_degree_threshold=node_degree_threshold)
+
+        assert (S.matrix != expected).nnz == 0
+        assert (S.matrix != S.matrix.T).nnz == 0
+        G = S.make_nx_graph()
+        for node in internal_nodes:
+            if expected[node, :].nnz > 0:
+                assert set(G.adj[node].keys()).issubset(path_neighbors[node])
+
+
+def _make_nx_graph_by_edge(S):
+    """
+    Makes the networkx graph of the Scaffolds object adding the edges one by one, as
+    make_nx_graph did before the edges were added in bulk.
+    """
+    nxG = nx.Graph()
+    if S.pg_base is not None:
+        path_graph_to_use = S.pg_base
+    else:
+        path_graph_to_use = S.matrix_bins
+
+    for node_id, node in path_graph_to_use.node.iteritems():
+        nn = node.copy()
+        for attr, value in nn.iteritems():
+            if isinstance(value, np.int64):
+                nn[attr] = int(value)
+            elif isinstance(value, np.float64):
+                nn[attr] = float(value)
+            elif isinstance(value, list):
+                nn[attr] = ", ".join([str(x) for x in value])
+        nxG.add_node(node_id, **nn)
+
+    matrix = S.matrix.tocoo()
+    max_weight = matrix.data.max() + 1
+    for u, v, weight in zip(matrix.row, matrix.col, matrix.data):
+        if u == v:
+            continue
+        if u in path_graph_to_use.adj[v]:
+            nxG.add_edge(u, v, weight=float(max_weight))
+        else:
+            nxG.add_edge(u, v, weight=float(weight))
+    return nxG
+
+
+def assert_same_nx_graph(G, expected):
+    """
+    The nodes, their attributes and the edges, with their weights, should be the same and in the same order.
+    The attributes and weights should be python types that can be saved as GraphML.
+    """
+    assert list(G.nodes(data=True)) == list(expected.nodes(data=True))
+    assert list(G.edges(data=True)) == list(expected.edges(data=True))
+    for node_id, attr in G.nodes(data=True):
+        for value in attr.values():
+            assert type(value) in (int, float, str)
+    for u, v, attr in G.edges(data=True):
+        assert type(attr['weight']) == float
+
+
+def test_make_nx_graph_by_edge():
+    """
+    The graph made by make_nx_graph should be the same as the graph made edge by edge,
+    before and after the contigs are split and joined.
+    """
+    for dtype in [np.int64, np.float64]:
+        for seed in range(3):
+            matrix = get_random_matrix(seed, num_bins=90, dtype=dtype)
+            cut_intervals = [('c-{}'.format(x // 6), (x % 6) * 10, (x % 6 + 1) * 10, 1)
+                             for x in range(matrix.shape[0])]
+            hic = HiCMatrix.hiCMatrix()
+            hic.nan_bins = []
+            hic.setMatrix(matrix, cut_intervals)
+            S = Scaffolds(hic)
+            assert_same_nx_graph(S.make_nx_graph(), _make_nx_graph_by_edge(S))
+
+            S.split_and_merge_contigs(num_splits=3, normalize_method='none')
+            assert_same_nx_graph(S.make_nx_graph(), _make_nx_graph_by_edge(S))
+
+            # join pairs of contigs
+            S = Scaffolds(hic)
+            S.split_and_merge_contigs(num_splits=1, normalize_method='none')
+            for node in range(0, S.matrix.shape[0] - 1, 2):
+                S.add_edge(node, node + 1)
+            assert_same_nx_graph(S.make_nx_graph(), _make_nx_graph_by_edge(S))
+
+
 def get_test_matrix(cut_intervals=None, matrix=None):
     hic = HiCMatrix.hiCMatrix()
     hic.nan_bins = []
@@ -0,0 +1,94 @@
+import numpy as np
+import networkx as nx
+from scipy.sparse import csr_matrix
+import hicexplorer.HiCMatrix as HiCMatrix
+from hicassembler.Scaffolds import Scaffolds
+from hicassembler.SpanningTree import SpanningTree
+
+
+def get_random_scaffolds(seed, num_bins=40, max_value=None):
+    """
+    Returns a Scaffolds object of a random symmetric matrix whose scaffolds have between 1 and 4 bins.
+    If `max_value` is None, all the values of the matrix are different, otherwise the values
+    are integers between 1 and `max_value` such that there are many ties.
+    """
+    rs = np.random.RandomState(seed)
+    row, col = np.triu_indices(num_bins, k=1)
+    keep = rs.rand(len(row)) < 0.3
+    row, col = row[keep], col[keep]
+    if max_value is None:
+        values = rs.permutation(len(row)) + 1.0
+    else:
+        values = rs.randint(1, max_value + 1, len(row)).astype(float)
+    matrix = csr_matrix((np.concatenate([values, values]), (np.concatenate([row, col]), np.concatenate([col, row]))),
+                        shape=(num_bins, num_bins))
+
+    cut_intervals = []
+    scaff_idx = 0
+    while len(cut_intervals) < num_bins:
+        for idx in range(min(rs.randint(1, 5), num_bins - len(cut_intervals))):
+            cut_intervals.append(("scaff_{}".format(scaff_idx), idx * 10, (idx + 1) * 10, 1))
+        scaff_idx += 1
+
+    hic = HiCMatrix.hiCMatrix()
+    hic.nan_bins = []
+    hic.setMatrix(matrix, cut_intervals)
+    return Scaffolds(hic)
+
+
+def get_trees(S):
+    """
+    Returns the spanning tree computed with SpanningTree and with networkx, as
+    done before SpanningTree was used.
+    """
+    tree = SpanningTree.maximum(S.matrix, paths=S.pg_base.get_all_paths())
+    nx_tree = nx.maximum_spanning_tree(S.make_nx_graph(), weight='weight')
+    return tree, nx_tree
+
+
+def test_maximum_spanning_tree_networkx():
+    """
+    If all the weights are different, the maximum spanning tree is unique, thus
+    the edges should be those found by networkx.
+    """
+    for seed in range(10):
+        tree, nx_tree = get_trees(get_random_scaffolds(seed))
+        row, col, weight = tree.edges()
+        assert len(row) == nx_tree.number_of_edges()
+        assert set([(min(u, v), max(u, v), w) for u, v, w in zip(row.tolist(), col.tolist(), weight.tolist())]) == \
+            set([(min(u, v), max(u, v), data['weight']) for u, v, data in nx_tree.edges(data=True)])
+
+
+def test_maximum_spanning_tree_networkx_ties():
+    """
+    With ties, the edges of the tree depend on the order in which the edges
+    are visited, thus, the edges may differ from those of networkx. However,
+    both trees should span the same nodes and have the same (maximum) total weight.
+    """
+    for seed in range(10):
+        tree, nx_tree = get_trees(get_random_scaffolds(seed, max_value=3))
+        row, col, weight = tree.edges()
+        assert len(row) == nx_tree.number_of_edges()
+        assert set(np.flatnonzero(tree.degree).tolist()) == set([x for x in nx_tree if nx_tree.degree(x) > 0])
+        assert np.isclose(weight.sum(), sum([data['weight'] for u, v, data in nx_tree.edges(data=True)]))
+
+
+def test_get_paths_networkx():
+    """
+    After removing the nodes with degree > 2, the paths of the tree should be
+    those returned by Scaffolds._return_paths_from_graph for the same edges. The paths
+    of SpanningTree start at their smallest node while _return_paths_from_graph starts at
+    the first node of the set of the connected component, thus the orientation of some paths differs.
+    """
+    for seed in range(10):
+        tree, nx_tree = get_trees(get_random_scaffolds(seed))
+        for node in np.flatnonzero(tree.degree > 2):
+            tree.remove_node(node)
+            nx_tree.remove_edges_from(list(nx_tree.edges(node)))
+        nx_tree.remove_nodes_from([x for x in list(nx_tree) if nx_tree.degree(x) == 0])
+
+        paths = tree.get_paths()
+        nx_paths = Scaffolds._return_paths_from_graph(nx_tree)
+        assert len(paths) == len(nx_paths)
+        for path, nx_path in zip(sorted(paths, key=min), sorted(nx_paths, key=min)):
+            assert path == nx_path or path == nx_path[::-1]